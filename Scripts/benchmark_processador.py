@@ -0,0 +1,189 @@
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import cache_rotas
+import hints_osrm
+import processador_rotas_unificado as pru
+import processador_rotas_unificado_sem_valhalla as prs
+from stub_servidores import iniciar_stub, url_stub
+from trilhas_sinteticas import FORMAS, como_erictech, gerar_trilha
+
+TAMANHOS_DEFAULT = [1000, 10000]
+REPETICOES_DEFAULT = 5
+
+_cache_raiz: Optional[str] = None
+
+
+def parse_args(argv: List[str]) -> Dict[str, Any]:
+    """
+    Parse command line arguments for the benchmark runner.
+
+    --n=<a,b,...>         track sizes (points)
+    --formas=<a,b,...>    track shapes: urbano, rodovia, saltos, loop
+    --repeticoes=<k>      timed repetitions per stage (best and median reported)
+    --saida=<arquivo>     JSON results file (default: bench_<commit>.json)
+    --comparar=<arquivo>  previous results file to compare against
+    --sem-e2e             skip processar_uma_trilha against the stub server
+    """
+    args: Dict[str, Any] = {
+        "n": TAMANHOS_DEFAULT,
+        "formas": list(FORMAS),
+        "repeticoes": REPETICOES_DEFAULT,
+        "saida": None,
+        "comparar": None,
+        "e2e": True,
+    }
+    for arg in argv:
+        if arg.startswith("--n="):
+            args["n"] = [int(x) for x in arg.split("=", 1)[1].split(",") if x]
+        elif arg.startswith("--formas="):
+            args["formas"] = [x for x in arg.split("=", 1)[1].split(",") if x]
+        elif arg.startswith("--repeticoes="):
+            args["repeticoes"] = max(1, int(arg.split("=", 1)[1]))
+        elif arg.startswith("--saida="):
+            args["saida"] = arg.split("=", 1)[1]
+        elif arg.startswith("--comparar="):
+            args["comparar"] = arg.split("=", 1)[1]
+        elif arg == "--sem-e2e":
+            args["e2e"] = False
+        else:
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+    return args
+
+
+def _commit_atual() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent, timeout=10)
+        return out.stdout.strip() or "desconhecido"
+    except Exception:
+        return "desconhecido"
+
+
+def _esfriar_caches() -> None:
+    """Start a repetition with empty route caches, on disk and in memory, and no stored OSRM hints."""
+    cache_rotas.CACHE_DIR = Path(tempfile.mkdtemp(prefix="rep_", dir=_cache_raiz))
+    with cache_rotas._memoria_lock:
+        cache_rotas._memoria.clear()
+    with cache_rotas._acessos_lock:
+        cache_rotas._acessos.clear()
+    with hints_osrm._lock:
+        hints_osrm._hints.clear()
+
+
+def cronometrar(fn: Callable[[], Any], repeticoes: int) -> Dict[str, float]:
+    tempos: List[float] = []
+    for _ in range(repeticoes):
+        _esfriar_caches()
+        t0 = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - t0)
+    return {
+        "min_s": min(tempos),
+        "mediana_s": statistics.median(tempos),
+        "media_s": statistics.fmean(tempos),
+    }
+
+
+def _cerca_metade(pontos) -> List[List[float]]:
+    metade = pontos[: max(2, len(pontos) // 2)]
+    lons = [p[0] for p in metade]
+    lats = [p[1] for p in metade]
+    x0, x1, y0, y1 = min(lons), max(lons), min(lats), max(lats)
+    return [[x0, y0], [x0, y1], [x1, y1], [x1, y0], [x0, y0]]
+
+
+def medir_trilha(forma: str, n: int, repeticoes: int, host: Optional[str]) -> List[Dict[str, Any]]:
+    pontos = gerar_trilha(forma, n, seed=n)
+    bruto = como_erictech(pontos)
+    ordenados = pru.ordenar_por_ts(pontos)
+    dedup = pru.dedupe_por_raio(ordenados, pru.DEDUP_EPS_M)
+    simplificado = pru.douglas_peucker(dedup, pru.DP_TOL_DEFAULT)
+    caminho = [[lon, lat] for lon, lat, _ in dedup]
+
+    etapas: List[tuple] = [
+        ("extrair_pontos", lambda: pru.extrair_pontos(bruto)),
+        ("extrair_pontos_sem_valhalla", lambda: prs.extrair_pontos(bruto)),
+        ("ordenar_por_ts", lambda: pru.ordenar_por_ts(pontos)),
+        ("dedupe_por_raio", lambda: pru.dedupe_por_raio(ordenados, pru.DEDUP_EPS_M)),
+        ("douglas_peucker", lambda: pru.douglas_peucker(dedup, pru.DP_TOL_DEFAULT)),
+        ("montar_url_match", lambda: pru.montar_url_match(simplificado, "http://stub", "full", "ignore")),
+        ("_smooth_and_densify", lambda: pru._smooth_and_densify(caminho)),
+    ]
+    if host:
+        cerca = _cerca_metade(dedup)
+        etapas += [
+            ("processar_uma_trilha", lambda: pru.processar_uma_trilha(pontos, host=host, valhalla_host=host)),
+            ("processar_uma_trilha_cerca",
+             lambda: pru.processar_uma_trilha(pontos, host=host, valhalla_host=host, fence_poly=cerca)),
+            ("processar_uma_trilha_sem_valhalla", lambda: prs.processar_uma_trilha(pontos, host=host)),
+        ]
+
+    out = []
+    for nome, fn in etapas:
+        r = cronometrar(fn, repeticoes)
+        r.update({"forma": forma, "n": n, "etapa": nome})
+        out.append(r)
+        print(f"{forma:>8} n={n:<7} {nome:<34} min {r['min_s'] * 1000:10.2f} ms  mediana {r['mediana_s'] * 1000:10.2f} ms")
+    return out
+
+
+def comparar(atual: List[Dict[str, Any]], anterior_path: str) -> None:
+    with open(anterior_path, "r", encoding="utf-8") as f:
+        anterior = json.load(f)
+    base = {(r["forma"], r["n"], r["etapa"]): r for r in anterior.get("resultados", [])}
+    print(f"\nComparacao com {anterior_path} (commit {anterior.get('commit')}): razao atual/anterior do tempo minimo")
+    for r in atual:
+        b = base.get((r["forma"], r["n"], r["etapa"]))
+        if not b or b["min_s"] <= 0:
+            continue
+        razao = r["min_s"] / b["min_s"]
+        marca = "  REGRESSAO" if razao > 1.10 else ("  melhora" if razao < 0.90 else "")
+        print(f"{r['forma']:>8} n={r['n']:<7} {r['etapa']:<34} x{razao:6.2f}{marca}")
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    srv = iniciar_stub() if args["e2e"] else None
+    host = url_stub(srv) if srv else None
+    global _cache_raiz
+    _cache_raiz = tempfile.mkdtemp(prefix="bench_cache_")
+
+    resultados: List[Dict[str, Any]] = []
+    try:
+        for forma in args["formas"]:
+            for n in args["n"]:
+                resultados.extend(medir_trilha(forma, n, args["repeticoes"], host))
+    finally:
+        if srv:
+            srv.shutdown()
+        shutil.rmtree(_cache_raiz, ignore_errors=True)
+
+    commit = _commit_atual()
+    relatorio = {
+        "commit": commit,
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "repeticoes": args["repeticoes"],
+        "resultados": resultados,
+    }
+    saida = Path(args["saida"] or f"bench_{commit}.json")
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados salvos em: {saida}")
+
+    if args["comparar"]:
+        comparar(resultados, args["comparar"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+CACHE_DIR = Path(os.getenv("ROTAS_CACHE_DIR", str(Path.home() / ".cache" / "erictech_routing")))
+CACHE_TTL_S_DEFAULT = 7 * 24 * 3600.0
+# Grid for coordinates in canonical keys: 1e-5 deg is about 1.1 m, below
+# GPS jitter, so repeated requests for the same place share one entry.
+CACHE_QUANT_DEG = float(os.getenv("ROTAS_CACHE_QUANT_DEG", "1e-5"))
+# Entries kept in memory (least recently used evicted first); the disk
+# layer keeps everything else.
+CACHE_MEMORIA_MAX = int(os.getenv("ROTAS_CACHE_MEMORIA_MAX", "20000"))
+
+_memoria_lock = threading.Lock()
+_memoria: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+_acessos_lock = threading.Lock()
+_acessos: Dict[str, Dict[str, int]] = {}
+
+
+def chave_celula(lat: float, lon: float, cell_deg: float) -> str:
+    return f"{int(round(lat / cell_deg))}_{int(round(lon / cell_deg))}"
+
+
+def chave_hash(*partes: Any) -> str:
+    bruto = json.dumps(partes, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.md5(bruto.encode("utf-8")).hexdigest()
+
+
+def chave_canonica(servico: str,
+                   coords: Iterable[Sequence[float]],
+                   params: Optional[Dict[str, Any]] = None,
+                   quant_deg: Optional[float] = None) -> str:
+    """
+    Key for an OSRM request that ignores how it was spelled.
+
+    Coordinates are snapped to a ``quant_deg`` grid (default CACHE_QUANT_DEG)
+    and parameters are hashed in sorted order, so float repr differences,
+    centimetre jitter and parameter order map to the same entry.  The host is
+    not part of the key: entries are tagged with the dataset instead.
+    """
+    passo = quant_deg or CACHE_QUANT_DEG
+    grade = [[int(round(c[0] / passo)), int(round(c[1] / passo))] for c in coords]
+    return chave_hash(servico, grade, passo, {str(k): str(v) for k, v in (params or {}).items()})
+
+
+def registrar_acesso(namespace: str, acerto: bool) -> None:
+    with _acessos_lock:
+        c = _acessos.setdefault(namespace, {"hits": 0, "misses": 0})
+        c["hits" if acerto else "misses"] += 1
+
+
+def estatisticas_cache() -> Dict[str, Dict[str, Any]]:
+    """Hits, misses and hit rate per namespace since the process started."""
+    with _acessos_lock:
+        out: Dict[str, Dict[str, Any]] = {}
+        for ns, c in _acessos.items():
+            total = c["hits"] + c["misses"]
+            out[ns] = dict(c, hit_rate=round(c["hits"] / total, 4) if total else None)
+        return out
+
+
+def _cache_path(namespace: str, key: str) -> Path:
+    return CACHE_DIR / namespace / f"{key}.json"
+
+
+def _lembrar(namespace: str, key: str, entry: Dict[str, Any]) -> None:
+    with _memoria_lock:
+        _memoria[(namespace, key)] = entry
+        _memoria.move_to_end((namespace, key))
+        while len(_memoria) > CACHE_MEMORIA_MAX:
+            _memoria.popitem(last=False)
+
+
+def cache_get(namespace: str, key: str, dataset: str, ttl_s: float = CACHE_TTL_S_DEFAULT) -> Optional[Dict[str, Any]]:
+    """
+    Return the cached entry ``{"value": ...}`` or None on a miss.
+
+    Entries written for another dataset version, or older than ``ttl_s``,
+    count as misses and are removed from disk.
+    """
+    agora = time.time()
+    with _memoria_lock:
+        entry = _memoria.get((namespace, key))
+    if entry is None:
+        path = _cache_path(namespace, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except Exception:
+            return None
+    if entry.get("dataset") != dataset or agora - float(entry.get("ts", 0)) > ttl_s:
+        with _memoria_lock:
+            _memoria.pop((namespace, key), None)
+        try:
+            _cache_path(namespace, key).unlink()
+        except Exception:
+            pass
+        return None
+    _lembrar(namespace, key, entry)
+    return entry
+
+
+def cache_set(namespace: str, key: str, dataset: str, value: Any) -> None:
+    entry = {"ts": time.time(), "dataset": dataset, "value": value}
+    _lembrar(namespace, key, entry)
+    path = _cache_path(namespace, key)
+    # One temp file per writer: threads and workers may store the same key at once.
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            tmp.unlink()
+        except Exception:
+            pass
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from trilhas_sinteticas import FORMAS, gerar_trilha
+
+# Where trips start: (lon, lat, weight) around the main São Paulo demand poles.
+POLOS_SP = [
+    (-46.6333, -23.5505, 0.30),  # Centro / Sé
+    (-46.6544, -23.5614, 0.20),  # Paulista
+    (-46.6920, -23.5670, 0.15),  # Pinheiros
+    (-46.6990, -23.6260, 0.10),  # Santo Amaro
+    (-46.5330, -23.4630, 0.10),  # Guarulhos
+    (-46.5750, -23.5400, 0.10),  # Tatuapé
+    (-46.7370, -23.5330, 0.05),  # Osasco
+]
+DISPERSAO_DEG = 0.02
+
+TAXAS_DEFAULT = [5, 10, 20, 50, 100]
+DURACAO_DEFAULT_S = 10.0
+TIMEOUT_DEFAULT_S = 30.0
+SLO_P99_DEFAULT_S = 1.0
+MAX_ERROS_SATURACAO = 0.01
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+
+def parse_args(argv: List[str]) -> Dict[str, Any]:
+    """
+    Open-loop load test of the realtime proxy against a stub OSRM.
+
+    --endpoint=<e>          track (POST /api/track, default) or process (POST /api/process)
+    --taxas=<a,b,...>       offered arrival rates in requests/s, one step each
+    --duracao=<s>           seconds of arrivals per step (default 10)
+    --latencia=<s>          fixed latency of the stub OSRM per request
+    --latencia-por-coord=<s> extra stub latency per coordinate
+    --pontos=<n>            points per /api/process track (default 200)
+    --workers=<n>           uvicorn workers for the proxy (default 1)
+    --proxy=<url>           use a running proxy instead of starting one
+    --em-processo           serve the proxy in this process through ASGI (no uvicorn)
+    --slo-p99=<s>           p99 above which a step counts as saturated (default 1 s)
+    --timeout=<s>           client timeout per request
+    --seed=<n>              seed for arrivals and coordinates
+    --saida=<arquivo>       JSON report
+    """
+    args: Dict[str, Any] = {
+        "endpoint": "track",
+        "taxas": TAXAS_DEFAULT,
+        "duracao": DURACAO_DEFAULT_S,
+        "latencia": 0.02,
+        "latencia_por_coord": 0.0,
+        "pontos": 200,
+        "workers": 1,
+        "proxy": None,
+        "em_processo": False,
+        "slo_p99": SLO_P99_DEFAULT_S,
+        "timeout": TIMEOUT_DEFAULT_S,
+        "seed": 0,
+        "saida": None,
+    }
+    for arg in argv:
+        if arg == "--em-processo":
+            args["em_processo"] = True
+            continue
+        if not arg.startswith("--") or "=" not in arg:
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+        chave, val = arg[2:].split("=", 1)
+        chave = chave.replace("-", "_")
+        if chave == "taxas":
+            args["taxas"] = [float(x) for x in val.split(",") if x]
+        elif chave in ("duracao", "latencia", "latencia_por_coord", "slo_p99", "timeout"):
+            args[chave] = float(val)
+        elif chave in ("pontos", "workers", "seed"):
+            args[chave] = int(val)
+        elif chave in ("endpoint", "proxy", "saida"):
+            args[chave] = val
+        else:
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+    if args["endpoint"] not in ("track", "process"):
+        raise SystemExit(f"Endpoint invalido: {args['endpoint']} (use track ou process)")
+    return args
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _esperar_porta(port: int, timeout: float = 20.0) -> None:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"Servico na porta {port} nao respondeu em {timeout:.0f} s")
+
+
+def _origem(rnd: random.Random) -> Tuple[float, float]:
+    lon, lat, _ = rnd.choices(POLOS_SP, weights=[p[2] for p in POLOS_SP])[0]
+    return lon + rnd.gauss(0.0, DISPERSAO_DEG), lat + rnd.gauss(0.0, DISPERSAO_DEG)
+
+
+def payload_track(rnd: random.Random) -> Dict[str, Any]:
+    """A 2-8 stop trip, each leg 0.5-5 km in a random direction."""
+    lon, lat = _origem(rnd)
+    coords = [[lon, lat]]
+    for _ in range(rnd.randint(1, 7)):
+        dist_deg = rnd.uniform(500.0, 5000.0) / 111000.0
+        ang = rnd.uniform(0.0, 2 * math.pi)
+        lon += dist_deg * math.cos(ang)
+        lat += dist_deg * math.sin(ang)
+        coords.append([lon, lat])
+    return {"coordinates": coords}
+
+
+def payload_process(rnd: random.Random, n: int) -> Dict[str, Any]:
+    pontos = gerar_trilha(rnd.choice(FORMAS), n, seed=rnd.randrange(1 << 30), origem=_origem(rnd))
+    return {"points": [[lon, lat, ts] for lon, lat, ts in pontos]}
+
+
+async def _disparar(client: httpx.AsyncClient, url: str, corpo: Dict[str, Any], agendado: float,
+                    loop: asyncio.AbstractEventLoop) -> Tuple[float, Optional[int]]:
+    try:
+        r = await client.post(url, json=corpo)
+        status: Optional[int] = r.status_code
+    except Exception:
+        status = None
+    # Latency counts from the scheduled arrival, so client-side queueing is not hidden.
+    return loop.time() - agendado, status
+
+
+def _percentil(valores: List[float], p: float) -> Optional[float]:
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100.0 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+
+async def degrau(client: httpx.AsyncClient, url: str, taxa: float, duracao: float, corpos: List[Dict[str, Any]],
+                 rnd: random.Random) -> Dict[str, Any]:
+    """One step of Poisson arrivals at ``taxa`` req/s, independent of completions (open loop)."""
+    loop = asyncio.get_running_loop()
+    tarefas = []
+    t0 = loop.time()
+    proximo = t0
+    while True:
+        proximo += rnd.expovariate(taxa)
+        if proximo - t0 > duracao:
+            break
+        espera = proximo - loop.time()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        corpo = corpos[len(tarefas) % len(corpos)]
+        tarefas.append(asyncio.ensure_future(_disparar(client, url, corpo, proximo, loop)))
+    resultados = await asyncio.gather(*tarefas)
+    decorrido = loop.time() - t0
+    lat_ok = [dt for dt, st in resultados if st is not None and 200 <= st < 300]
+    erros = len(resultados) - len(lat_ok)
+    return {
+        "taxa_oferecida": taxa,
+        "taxa_enviada": len(resultados) / duracao,
+        "enviadas": len(resultados),
+        "ok": len(lat_ok),
+        "erros": erros,
+        "taxa_erros": erros / len(resultados) if resultados else 0.0,
+        "vazao_ok": len(lat_ok) / decorrido if decorrido > 0 else 0.0,
+        "p50_s": _percentil(lat_ok, 50),
+        "p95_s": _percentil(lat_ok, 95),
+        "p99_s": _percentil(lat_ok, 99),
+        "media_s": statistics.fmean(lat_ok) if lat_ok else None,
+        "decorrido_s": decorrido,
+    }
+
+
+def saturado(r: Dict[str, Any], slo_p99: float) -> bool:
+    return (r["vazao_ok"] < 0.9 * r["taxa_enviada"]
+            or r["taxa_erros"] > MAX_ERROS_SATURACAO
+            or r["p99_s"] is None
+            or r["p99_s"] > slo_p99)
+
+
+async def executar(args: Dict[str, Any], base_url: str, transport=None) -> List[Dict[str, Any]]:
+    rnd = random.Random(args["seed"])
+    if args["endpoint"] == "track":
+        url = f"{base_url}/api/track"
+        corpos = [payload_track(rnd) for _ in range(500)]
+    else:
+        url = f"{base_url}/api/process"
+        corpos = [payload_process(rnd, args["pontos"]) for _ in range(50)]
+    limites = httpx.Limits(max_connections=2000, max_keepalive_connections=200)
+    resultados = []
+    async with httpx.AsyncClient(timeout=args["timeout"], limits=limites, transport=transport) as client:
+        for taxa in args["taxas"]:
+            r = await degrau(client, url, taxa, args["duracao"], corpos, rnd)
+            r["saturado"] = saturado(r, args["slo_p99"])
+            resultados.append(r)
+            p = lambda v: f"{v * 1000:8.1f}" if v is not None else "       -"
+            print(f"taxa {taxa:7.1f}/s  vazao {r['vazao_ok']:7.1f}/s  p50 {p(r['p50_s'])} ms  p95 {p(r['p95_s'])} ms"
+                  f"  p99 {p(r['p99_s'])} ms  erros {r['taxa_erros'] * 100:5.1f}%{'  SATURADO' if r['saturado'] else ''}")
+    return resultados
+
+
+def ponto_de_saturacao(resultados: List[Dict[str, Any]]) -> Optional[float]:
+    for r in resultados:
+        if r["saturado"]:
+            return r["taxa_oferecida"]
+    return None
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    processos: List[subprocess.Popen] = []
+    try:
+        transport = None
+        if args["proxy"]:
+            base_url = args["proxy"].rstrip("/")
+        else:
+            porta_stub = _porta_livre()
+            processos.append(subprocess.Popen(
+                [sys.executable, "stub_servidores.py", f"--port={porta_stub}", f"--latencia={args['latencia']}",
+                 f"--latencia-por-coord={args['latencia_por_coord']}"],
+                cwd=SCRIPTS_DIR, stdout=subprocess.DEVNULL,
+            ))
+            _esperar_porta(porta_stub)
+            stub = f"http://127.0.0.1:{porta_stub}"
+            os.environ["OSRM_BASEURL"] = stub
+            os.environ["VALHALLA_BASEURL"] = stub
+            if args["em_processo"]:
+                import realtime_proxy_osrm
+                transport = httpx.ASGITransport(app=realtime_proxy_osrm.app)
+                base_url = "http://proxy"
+            else:
+                porta_proxy = _porta_livre()
+                processos.append(subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "realtime_proxy_osrm:app", "--host", "127.0.0.1",
+                     "--port", str(porta_proxy), "--workers", str(args["workers"]), "--log-level", "warning"],
+                    cwd=SCRIPTS_DIR, env=dict(os.environ),
+                ))
+                _esperar_porta(porta_proxy)
+                base_url = f"http://127.0.0.1:{porta_proxy}"
+
+        resultados = asyncio.run(executar(args, base_url, transport))
+    finally:
+        for p in processos:
+            p.terminate()
+        for p in processos:
+            p.wait(timeout=10)
+
+    saturacao = ponto_de_saturacao(resultados)
+    if saturacao is None:
+        print("\nSem saturacao nas taxas testadas.")
+    else:
+        print(f"\nPonto de saturacao: {saturacao:.1f} req/s")
+    relatorio = {
+        "timestamp": int(time.time()),
+        "endpoint": args["endpoint"],
+        "parametros": {k: v for k, v in args.items() if k != "saida"},
+        "saturacao_req_s": saturacao,
+        "degraus": resultados,
+    }
+    if args["saida"]:
+        with open(args["saida"], "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"Relatorio salvo em: {args['saida']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import math
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cache_rotas
+from cliente_backend import prazo_excedido
+
+CHECKPOINT_OVERLAP_PONTOS = 20
+CHECKPOINT_VERSAO = 2
+# Per-segment property lists, aligned with segment_start_ts.
+CHECKPOINT_PROPS_SEGMENTO = ("segment_engines", "segment_hosts", "segment_start_ts")
+
+Ponto = Tuple[float, float, int]
+Caminho = List[List[float]]
+
+
+def _dir_checkpoints() -> Path:
+    return cache_rotas.CACHE_DIR / "checkpoints"
+
+
+def trilha_id_de(data: Any, path: str) -> str:
+    tid = None
+    if isinstance(data, dict):
+        track = data.get("track")
+        if isinstance(track, dict):
+            tid = track.get("id") or track.get("track_id")
+        tid = tid or data.get("id") or data.get("track_id")
+    return str(tid) if tid else Path(path).stem
+
+
+def chave_parametros(**params: Any) -> str:
+    bruto = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.md5(bruto.encode("utf-8")).hexdigest()
+
+
+def _arquivo(track_id: str) -> Path:
+    nome = hashlib.md5(track_id.encode("utf-8")).hexdigest()
+    return _dir_checkpoints() / f"{nome}.json"
+
+
+def carregar(track_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_arquivo(track_id), "r", encoding="utf-8") as f:
+            ckpt = json.load(f)
+        if ckpt.get("versao") == CHECKPOINT_VERSAO and ckpt.get("track_id") == track_id:
+            return ckpt
+    except Exception:
+        pass
+    return None
+
+
+def salvar(track_id: str, ckpt: Dict[str, Any]) -> None:
+    path = _arquivo(track_id)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(ckpt, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"Falha ao salvar checkpoint de {track_id}: {e}")
+        try:
+            tmp.unlink()
+        except Exception:
+            pass
+
+
+def _dist2(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    mx = (lon2 - lon1) * math.cos(math.radians(lat1))
+    my = lat2 - lat1
+    return mx * mx + my * my
+
+
+def ponto_de_corte(caminho: Caminho, pontos: List[Ponto], overlap: int) -> Tuple[int, int]:
+    """
+    Choose the last stable point of a matched path.
+
+    Returns (k, j): raw index ``k`` that the next run restarts from (``overlap``
+    points before the end) and the path vertex ``j`` closest to raw point k,
+    searched only in the stretch of the path proportional to the tail.
+    """
+    n = len(pontos)
+    k = max(0, n - 1 - overlap)
+    if k == 0 or len(caminho) < 2:
+        return 0, 0
+    por_ponto = len(caminho) / float(n)
+    inicio = max(0, len(caminho) - int(por_ponto * (n - k) * 3) - 20)
+    alvo_lon, alvo_lat = pontos[k][0], pontos[k][1]
+    j = min(range(inicio, len(caminho)), key=lambda i: _dist2(alvo_lon, alvo_lat, caminho[i][0], caminho[i][1]))
+    return k, j
+
+
+def juntar_propriedades(anteriores: Dict[str, Any], novas: Dict[str, Any], ts_corte: int) -> Dict[str, Any]:
+    """
+    Properties of a whole track from the stored run and the run of its tail.
+
+    The tail run restarts at the point with timestamp ``ts_corte``: stored
+    segments starting before it are kept, the rest come from the tail run.
+    When the first new segment continues the stored one that contains the
+    cut (same engine and host), both count as one segment.
+    """
+    inicios = anteriores.get("segment_start_ts")
+    if not inicios or "segment_start_ts" not in novas:
+        return novas
+    n = sum(1 for t in inicios if t < ts_corte)
+    chaves = [c for c in CHECKPOINT_PROPS_SEGMENTO if c in anteriores and c in novas]
+    out = dict(novas)
+    for c in chaves:
+        out[c] = anteriores[c][:n] + novas[c]
+    continua = n > 0 and novas["segment_start_ts"] and all(
+        anteriores[c][n - 1] == novas[c][0] for c in chaves if c != "segment_start_ts"
+    )
+    if continua:
+        for c in chaves:
+            out[c] = anteriores[c][:n] + novas[c][1:]
+    return out
+
+
+def processar_incremental(track_id: str,
+                          params: str,
+                          ordenados: List[Ponto],
+                          caminho_fn: Callable[[List[Ponto]], Tuple[Optional[Caminho], Dict[str, Any]]],
+                          suavizar_fn: Callable[[Caminho], Caminho],
+                          overlap: int = CHECKPOINT_OVERLAP_PONTOS) -> Tuple[Optional[Caminho], Dict[str, Any]]:
+    """
+    Match only the part of ``ordenados`` not covered by the stored checkpoint.
+
+    The checkpoint keeps the final (smoothed) geometry up to the last stable
+    point, the raw index and point it corresponds to, and the final tail after
+    it.  New points are matched from that raw point on (the overlap window),
+    smoothed on their own and appended to the stored prefix.
+    """
+    ckpt = carregar(track_id)
+    offset = 0
+    n_ant = 0
+    prefixo: Caminho = []
+    props_ant: Dict[str, Any] = {}
+    info: Dict[str, Any] = {"incremental": False}
+    if ckpt and ckpt.get("params") == params:
+        k = int(ckpt.get("offset", 0))
+        corte = ckpt.get("corte")
+        n_salvo = int(ckpt.get("n_pontos", 0))
+        if 0 < k < len(ordenados) and n_salvo <= len(ordenados) and corte and list(ordenados[k]) == corte:
+            if n_salvo == len(ordenados) and list(ordenados[-1]) == ckpt.get("ultimo"):
+                info.update(incremental=True, pontos_novos=0, offset=k)
+                return ckpt["prefixo"] + ckpt["cauda"][1:], dict(ckpt.get("propriedades") or {}, checkpoint=info)
+            offset, n_ant = k, n_salvo
+            prefixo = ckpt["prefixo"]
+            props_ant = ckpt.get("propriedades") or {}
+
+    pontos = ordenados[offset:]
+    caminho, props = caminho_fn(pontos)
+    if not caminho:
+        return None, props
+    if offset:
+        props = juntar_propriedades(props_ant, props, ordenados[offset][2])
+    k_rel, j = ponto_de_corte(caminho, pontos, overlap)
+    if offset and k_rel == 0:
+        # Too few new points to move the stable point: keep the stored one.
+        k_rel, j = 0, 0
+    parte_estavel = suavizar_fn(caminho[: j + 1]) if j > 0 else caminho[:1]
+    cauda = suavizar_fn(caminho[j:])
+    if prefixo:
+        novo_prefixo = prefixo + parte_estavel[1:] if parte_estavel[0] == prefixo[-1] else prefixo + parte_estavel
+    else:
+        novo_prefixo = parte_estavel
+    info.update(incremental=bool(offset), pontos_novos=len(ordenados) - n_ant, offset=offset)
+    final = novo_prefixo + cauda[1:] if cauda and novo_prefixo and cauda[0] == novo_prefixo[-1] else novo_prefixo + cauda
+    if prazo_excedido():
+        # A result cut short by the track deadline is not a stable prefix.
+        return final, dict(props, checkpoint=info)
+    salvar(track_id, {
+        "versao": CHECKPOINT_VERSAO,
+        "track_id": track_id,
+        "params": params,
+        "offset": offset + k_rel,
+        "corte": list(pontos[k_rel]),
+        "n_pontos": len(ordenados),
+        "ultimo": list(ordenados[-1]),
+        "prefixo": novo_prefixo,
+        "cauda": cauda,
+        "propriedades": props,
+    })
+    return final, dict(props, checkpoint=info)
@@ -0,0 +1,515 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentacao import atual
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+POOL_SIZE = 32
+ASYNC_MAX_CONEXOES = 256
+
+# Circuit breaker per backend (scheme://host:port): after DISJUNTOR_FALHAS
+# consecutive failures (connection errors, timeouts, 5xx) the backend is
+# skipped for DISJUNTOR_ABERTO_S, then a single probe request decides whether
+# it closes again.  4xx answers (NoMatch, NoRoute...) are not failures.
+DISJUNTOR_FALHAS = 5
+DISJUNTOR_ABERTO_S = 30.0
+MAX_EM_VOO_POR_BACKEND = POOL_SIZE
+
+# Adaptive in-flight limit per backend (gradient limiter).  Each answer is
+# compared with the minimum RTT seen for requests of the same service and
+# size; while latency stays within LIMITE_TOLERANCIA of it the limit grows
+# by about sqrt(limit), when requests start queueing inside the backend it
+# shrinks in proportion.  Failures (5xx, timeouts) cut it by LIMITE_RECUO,
+# at most once per RTT.  BACKEND_LIMITE_ADAPTATIVO=0 keeps the fixed
+# MAX_EM_VOO_POR_BACKEND.
+LIMITE_ADAPTATIVO: bool = os.getenv("BACKEND_LIMITE_ADAPTATIVO", "1") != "0"
+LIMITE_MIN = 2
+LIMITE_MAX = int(os.getenv("BACKEND_LIMITE_MAX", "64"))
+LIMITE_INICIAL = 16
+LIMITE_TOLERANCIA = 1.5
+LIMITE_SUAVIZACAO = 0.2
+LIMITE_RECUO = 0.8
+# The minimum RTT is kept over two windows, so it follows a backend that
+# became permanently slower (bigger dataset) after at most two windows.
+LIMITE_JANELA_RTT_S = 60.0
+
+# Optional steps (arrival bridge, smoothing) are skipped when less than this
+# is left of the track deadline.
+PRAZO_MIN_OPCIONAL_S = 2.0
+
+_sessao: Optional[requests.Session] = None
+_cliente_async = None
+_cliente_async_loop = None
+
+
+class BackendIndisponivel(RuntimeError):
+    pass
+
+
+class PrazoEsgotado(RuntimeError):
+    pass
+
+
+class _Prazo:
+    def __init__(self, limite: float):
+        self.limite = limite
+        self.excedido = False
+
+
+_prazo: ContextVar[Optional[_Prazo]] = ContextVar("prazo_trilha", default=None)
+
+
+@contextmanager
+def prazo_trilha(segundos: Optional[float]) -> Iterator[Optional[_Prazo]]:
+    """Bound every backend call made in this context (threads and tasks included) by one deadline."""
+    if not segundos or segundos <= 0:
+        yield _prazo.get()
+        return
+    token = _prazo.set(_Prazo(time.monotonic() + segundos))
+    try:
+        yield _prazo.get()
+    finally:
+        _prazo.reset(token)
+
+
+def prazo_restante() -> Optional[float]:
+    p = _prazo.get()
+    return None if p is None else p.limite - time.monotonic()
+
+
+def prazo_excedido() -> bool:
+    p = _prazo.get()
+    return p is not None and (p.excedido or time.monotonic() >= p.limite)
+
+
+def prazo_curto(minimo: float = PRAZO_MIN_OPCIONAL_S) -> bool:
+    """True (and the track is marked as cut short) when an optional step no longer fits."""
+    p = _prazo.get()
+    if p is None or p.limite - time.monotonic() >= minimo:
+        return False
+    p.excedido = True
+    return True
+
+
+def _timeout_no_prazo(timeout: float) -> float:
+    p = _prazo.get()
+    if p is None:
+        return timeout
+    restante = p.limite - time.monotonic()
+    if restante <= 0:
+        p.excedido = True
+        atual().contar("prazo_esgotado")
+        raise PrazoEsgotado("prazo da trilha esgotado")
+    return min(timeout, restante)
+
+
+def _registrar_erro(b: "_Backend", e: BaseException, encurtado: bool) -> Optional[bool]:
+    """Feed the circuit breaker; returns whether the backend failed (None: the track deadline ran out)."""
+    if encurtado and prazo_excedido():
+        # Timed out on the track budget, not because the backend is unhealthy.
+        _prazo.get().excedido = True
+        b.disjuntor.liberar_sonda()
+        return None
+    if _falha_de_backend(e):
+        b.disjuntor.falha()
+        return True
+    b.disjuntor.sucesso()
+    return False
+
+
+class Disjuntor:
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(self, limiar: Optional[int] = None, aberto_s: Optional[float] = None):
+        self.limiar = limiar or DISJUNTOR_FALHAS
+        self.aberto_s = aberto_s or DISJUNTOR_ABERTO_S
+        self.estado = self.FECHADO
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self.sonda_em_curso = False
+        self.rejeitados = 0
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.estado == self.ABERTO and time.monotonic() >= self.aberto_ate:
+                self.estado = self.MEIO_ABERTO
+                self.sonda_em_curso = False
+            if self.estado == self.FECHADO:
+                return True
+            if self.estado == self.MEIO_ABERTO and not self.sonda_em_curso:
+                self.sonda_em_curso = True
+                return True
+            self.rejeitados += 1
+            return False
+
+    def sucesso(self) -> None:
+        with self._lock:
+            self.estado = self.FECHADO
+            self.falhas = 0
+            self.sonda_em_curso = False
+
+    def liberar_sonda(self) -> None:
+        with self._lock:
+            self.sonda_em_curso = False
+
+    def falha(self) -> None:
+        with self._lock:
+            self.falhas += 1
+            if self.estado == self.MEIO_ABERTO or self.falhas >= self.limiar:
+                self.estado = self.ABERTO
+                self.aberto_ate = time.monotonic() + self.aberto_s
+            self.sonda_em_curso = False
+
+
+def _classe_rtt(url: str, enviados: int) -> str:
+    """RTT class of a request: service (match, route, trace_route...) and size in powers of two."""
+    partes = urlsplit(url).path.strip("/").split("/")
+    return f"{partes[0] if partes else ''}/{enviados.bit_length()}"
+
+
+class Limitador:
+    """In-flight slots of one backend, shared by threads and the event loop."""
+
+    def __init__(self, adaptativo: Optional[bool] = None):
+        self.adaptativo = LIMITE_ADAPTATIVO if adaptativo is None else adaptativo
+        self.limite = float(LIMITE_INICIAL if self.adaptativo else MAX_EM_VOO_POR_BACKEND)
+        self.em_uso = 0
+        self.em_voo = 0
+        self.gradiente = 1.0
+        self.recuos = 0
+        self._recuo_ate = 0.0
+        self._janela_t0 = time.monotonic()
+        self._rtt_min: Dict[str, float] = {}
+        self._rtt_min_anterior: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        # Coroutines waiting for a slot, served in order: a freed slot is
+        # handed to the oldest one instead of going to whoever asks first.
+        self._fila_async: deque = deque()
+
+    def _livre(self) -> bool:
+        return self.em_uso < max(1, int(self.limite))
+
+    def reservar(self, timeout: float) -> bool:
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._fila_async and self._livre(), timeout):
+                return False
+            self.em_uso += 1
+            return True
+
+    async def reservar_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if not self._fila_async and self._livre():
+                self.em_uso += 1
+                return
+            espera = (loop, loop.create_future())
+            self._fila_async.append(espera)
+        try:
+            await espera[1]
+        except asyncio.CancelledError:
+            with self._cond:
+                if espera in self._fila_async:
+                    self._fila_async.remove(espera)
+                    raise
+            if not espera[1].cancelled():
+                # The slot arrived together with the cancellation.
+                self.liberar()
+            raise
+
+    def contar_em_voo(self, delta: int) -> None:
+        with self._cond:
+            self.em_voo += delta
+
+    def _entregar(self, fut: "asyncio.Future") -> None:
+        if fut.cancelled():
+            self.liberar()
+        else:
+            fut.set_result(None)
+
+    def liberar(self, rtt: Optional[float] = None, classe: str = "", falha: bool = False) -> None:
+        """Free a slot; ``rtt`` None means the call says nothing about the backend (deadline, circuit open)."""
+        entregas = []
+        with self._cond:
+            self.em_uso -= 1
+            if rtt is not None and self.adaptativo:
+                self._ajustar(rtt, classe, falha)
+            while self._fila_async and self._livre():
+                self.em_uso += 1
+                entregas.append(self._fila_async.popleft())
+            self._cond.notify_all()
+        for loop, fut in entregas:
+            try:
+                loop.call_soon_threadsafe(self._entregar, fut)
+            except RuntimeError:
+                # Loop already closed: nobody is waiting there any more.
+                self.liberar()
+
+    def _ajustar(self, rtt: float, classe: str, falha: bool) -> None:
+        agora = time.monotonic()
+        if agora - self._janela_t0 >= LIMITE_JANELA_RTT_S:
+            self._rtt_min_anterior, self._rtt_min = self._rtt_min, {}
+            self._janela_t0 = agora
+        if falha:
+            if agora >= self._recuo_ate:
+                self.limite = max(LIMITE_MIN, self.limite * LIMITE_RECUO)
+                self._recuo_ate = agora + (self.rtt_min(classe) or rtt)
+                self.recuos += 1
+            return
+        self._rtt_min[classe] = min(self._rtt_min.get(classe, rtt), rtt)
+        rtt_min = self.rtt_min(classe)
+        g = max(0.5, min(1.0, LIMITE_TOLERANCIA * rtt_min / rtt)) if rtt > 0 else 1.0
+        self.gradiente += LIMITE_SUAVIZACAO * (g - self.gradiente)
+        alvo = self.limite * self.gradiente + math.sqrt(self.limite)
+        if alvo > self.limite and self.em_uso + 1 < self.limite / 2:
+            # Not using half of the current limit: nothing says more would help.
+            return
+        novo = self.limite + LIMITE_SUAVIZACAO * (alvo - self.limite)
+        self.limite = max(LIMITE_MIN, min(LIMITE_MAX, novo))
+
+    def rtt_min(self, classe: str) -> Optional[float]:
+        vals = [d[classe] for d in (self._rtt_min, self._rtt_min_anterior) if classe in d]
+        return min(vals) if vals else None
+
+    def estado(self) -> Dict[str, Any]:
+        with self._cond:
+            classes = set(self._rtt_min) | set(self._rtt_min_anterior)
+            return {
+                "limite": round(float(self.limite), 1),
+                "adaptativo": self.adaptativo,
+                "em_uso": self.em_uso,
+                "na_fila": len(self._fila_async),
+                "gradiente": round(self.gradiente, 3),
+                "recuos": self.recuos,
+                "rtt_min_ms": {c: round(self.rtt_min(c) * 1000, 2) for c in sorted(classes)},
+            }
+
+
+class _Backend:
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.disjuntor = Disjuntor()
+        self.limitador = Limitador()
+
+    @property
+    def em_voo(self) -> int:
+        return self.limitador.em_voo
+
+
+_backends: Dict[str, _Backend] = {}
+_backends_lock = threading.Lock()
+
+
+def _backend(url: str) -> _Backend:
+    partes = urlsplit(url)
+    nome = f"{partes.scheme}://{partes.netloc}"
+    b = _backends.get(nome)
+    if b is None:
+        with _backends_lock:
+            b = _backends.setdefault(nome, _Backend(nome))
+    return b
+
+
+def estado_backends() -> Dict[str, Dict[str, Any]]:
+    return {
+        nome: {
+            "estado": b.disjuntor.estado,
+            "falhas": b.disjuntor.falhas,
+            "rejeitados": b.disjuntor.rejeitados,
+            "em_voo": b.em_voo,
+            "concorrencia": b.limitador.estado(),
+        }
+        for nome, b in list(_backends.items())
+    }
+
+
+def _falha_de_backend(e: BaseException) -> bool:
+    status = None
+    resp = getattr(e, "response", None)
+    if resp is not None:
+        status = getattr(resp, "status_code", None)
+    return status is None or status >= 500
+
+
+def _checar_disjuntor(b: _Backend, engine: str) -> None:
+    if not b.disjuntor.permitir():
+        atual().contar(f"disjuntor_aberto_{engine}")
+        raise BackendIndisponivel(f"{b.nome} indisponivel (circuito aberto)")
+
+
+def sessao() -> requests.Session:
+    global _sessao
+    if _sessao is None:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=max(POOL_SIZE, LIMITE_MAX))
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        _sessao = s
+    return _sessao
+
+
+def _executar(url: str, engine: str, enviados: int, timeout: float, fazer) -> Any:
+    med = atual()
+    b = _backend(url)
+    if not b.limitador.reservar(_timeout_no_prazo(timeout)):
+        med.contar(f"sem_vaga_{engine}")
+        raise BackendIndisponivel(f"{b.nome}: sem vaga para requisicao")
+    try:
+        # The wait for a slot came out of the track deadline.
+        t_efetivo = _timeout_no_prazo(timeout)
+        encurtado = t_efetivo < timeout
+        _checar_disjuntor(b, engine)
+    except BaseException:
+        b.limitador.liberar()
+        raise
+    t0 = time.perf_counter()
+    recebidos = 0
+    ok = False
+    falha: Optional[bool] = False
+    b.limitador.contar_em_voo(1)
+    try:
+        try:
+            r = fazer(t_efetivo)
+            recebidos = len(r.content)
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            falha = _registrar_erro(b, e, encurtado)
+            raise
+        b.disjuntor.sucesso()
+        ok = True
+        return data
+    finally:
+        dt = time.perf_counter() - t0
+        b.limitador.contar_em_voo(-1)
+        b.limitador.liberar(None if falha is None else dt, _classe_rtt(url, enviados), bool(falha))
+        med.registrar_http(engine, enviados, recebidos, dt, ok)
+
+
+def http_get_json(url: str, timeout: float, engine: str = "osrm") -> Any:
+    return _executar(url, engine, len(url), timeout, lambda t: sessao().get(url, timeout=t))
+
+
+def http_post_json(url: str, payload: Any, timeout: float, engine: str = "valhalla") -> Any:
+    corpo = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _executar(url, engine, len(url) + len(corpo), timeout, lambda t: sessao().post(
+        url, data=corpo, headers={"Content-Type": "application/json"}, timeout=t,
+    ))
+
+
+def cliente_async():
+    global _cliente_async, _cliente_async_loop
+    if httpx is None:
+        raise RuntimeError("httpx nao esta instalado; necessario para o pipeline assincrono.")
+    loop = asyncio.get_running_loop()
+    if _cliente_async is None or _cliente_async.is_closed or _cliente_async_loop is not loop:
+        _cliente_async = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=ASYNC_MAX_CONEXOES, max_keepalive_connections=POOL_SIZE,
+        ))
+        _cliente_async_loop = loop
+    return _cliente_async
+
+
+async def _reservar_async(b: _Backend, timeout: float, engine: str) -> None:
+    try:
+        await asyncio.wait_for(b.limitador.reservar_async(), _timeout_no_prazo(timeout))
+    except asyncio.TimeoutError:
+        atual().contar(f"sem_vaga_{engine}")
+        raise BackendIndisponivel(f"{b.nome}: sem vaga para requisicao") from None
+
+
+async def _executar_async(url: str, engine: str, enviados: int, timeout: float, fazer) -> Any:
+    med = atual()
+    b = _backend(url)
+    await _reservar_async(b, timeout, engine)
+    try:
+        t_efetivo = _timeout_no_prazo(timeout)
+        encurtado = t_efetivo < timeout
+        _checar_disjuntor(b, engine)
+    except BaseException:
+        b.limitador.liberar()
+        raise
+    t0 = time.perf_counter()
+    recebidos = 0
+    ok = False
+    falha: Optional[bool] = False
+    b.limitador.contar_em_voo(1)
+    try:
+        try:
+            r = await fazer(t_efetivo)
+            recebidos = len(r.content)
+            r.raise_for_status()
+            data = r.json()
+        except asyncio.CancelledError:
+            b.disjuntor.liberar_sonda()
+            falha = None
+            raise
+        except Exception as e:
+            falha = _registrar_erro(b, e, encurtado)
+            raise
+        b.disjuntor.sucesso()
+        ok = True
+        return data
+    finally:
+        dt = time.perf_counter() - t0
+        b.limitador.contar_em_voo(-1)
+        b.limitador.liberar(None if falha is None else dt, _classe_rtt(url, enviados), bool(falha))
+        med.registrar_http(engine, enviados, recebidos, dt, ok)
+
+
+async def http_get_json_async(url: str, timeout: float, engine: str = "osrm", client=None) -> Any:
+    return await _executar_async(url, engine, len(url), timeout,
+                                 lambda t: (client or cliente_async()).get(url, timeout=t))
+
+
+async def http_post_json_async(url: str, payload: Any, timeout: float, engine: str = "valhalla", client=None) -> Any:
+    corpo = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return await _executar_async(url, engine, len(url) + len(corpo), timeout, lambda t: (client or cliente_async()).post(
+        url, content=corpo, headers={"Content-Type": "application/json"}, timeout=t,
+    ))
+
+
+async def chamada_limitada_async(url: str, timeout: float, fazer: Callable[[float], Awaitable[Any]],
+                                  engine: str = "osrm") -> Any:
+    """
+    Run ``fazer(timeout)`` (an HTTP call returning a response) within the
+    adaptive in-flight limit of the backend of ``url``, without the circuit
+    breaker or raise_for_status: for callers that relay the backend answer
+    as is.  The wait for a slot counts against ``timeout``.
+    """
+    b = _backend(url)
+    t_inicio = time.monotonic()
+    await _reservar_async(b, timeout, engine)
+    restante = timeout - (time.monotonic() - t_inicio)
+    if restante <= 0:
+        b.limitador.liberar()
+        raise BackendIndisponivel(f"{b.nome}: sem vaga para requisicao")
+    t0 = time.perf_counter()
+    falha: Optional[bool] = True
+    try:
+        r = await fazer(restante)
+        falha = getattr(r, "status_code", 200) >= 500
+        return r
+    except asyncio.CancelledError:
+        falha = None
+        raise
+    finally:
+        b.limitador.liberar(None if falha is None else time.perf_counter() - t0, _classe_rtt(url, len(url)), bool(falha))
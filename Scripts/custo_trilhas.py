@@ -0,0 +1,139 @@
+import heapq
+import json
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import checkpoint_rotas
+import processador_rotas_unificado as pru
+from entrada_pontos import extrair_pontos
+from metricas_qualidade import _gaps
+
+# Relative cost of a track, in "matched point" units.  A gap costs a /route
+# bridge plus a segment split; points inside the fence go to Valhalla, which
+# is several times slower per point than OSRM /match.
+CUSTO_FIXO = 50.0
+CUSTO_POR_GAP = 200.0
+PESO_VALHALLA = 3.0
+CUSTO_AMOSTRA_CERCA = 2000
+
+T = TypeVar("T")
+
+
+def _fracao_na_cerca(pontos: Sequence[Tuple[float, float, int]], cerca: Optional[List[List[float]]]) -> float:
+    if not cerca or not pontos:
+        return 0.0
+    min_lon, max_lon = min(c[0] for c in cerca), max(c[0] for c in cerca)
+    min_lat, max_lat = min(c[1] for c in cerca), max(c[1] for c in cerca)
+    passo = max(1, len(pontos) // CUSTO_AMOSTRA_CERCA)
+    amostra = pontos[::passo]
+    dentro = sum(
+        1 for p in amostra
+        if min_lon <= p[0] <= max_lon and min_lat <= p[1] <= max_lat and pru.point_in_poly(p[0], p[1], cerca)
+    )
+    return dentro / len(amostra)
+
+
+def _cobertura_checkpoint(track_id: Optional[str], n: int) -> float:
+    if not track_id or n <= 0:
+        return 0.0
+    ckpt = checkpoint_rotas.carregar(track_id)
+    if not ckpt:
+        return 0.0
+    return min(1.0, int(ckpt.get("offset", 0)) / float(n))
+
+
+def estimar_custo(pontos: Sequence[Tuple[float, float, int]],
+                  cerca: Optional[List[List[float]]] = None,
+                  track_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Cheap cost estimate of one track: point count, gaps from one pass over
+    the sorted points, the share of (sampled) points inside the fence and the
+    share already covered by an incremental checkpoint.
+    """
+    ordenados = sorted(pontos, key=lambda p: p[2])
+    n = len(ordenados)
+    n_gaps, _ = _gaps(ordenados, pru.MAX_DT_GAP, pru.MIN_DIST_GAP, pru.MAX_VEL_GAP)
+    fracao_cerca = _fracao_na_cerca(ordenados, cerca)
+    cobertura = _cobertura_checkpoint(track_id, n)
+    restante = n * (1.0 - cobertura)
+    custo = (CUSTO_FIXO
+             + restante * (1.0 + fracao_cerca * (PESO_VALHALLA - 1.0))
+             + CUSTO_POR_GAP * n_gaps * (1.0 - cobertura))
+    return {
+        "pontos": n,
+        "gaps_estimados": n_gaps,
+        "fracao_na_cerca": round(fracao_cerca, 4),
+        "cobertura_cache": round(cobertura, 4),
+        "custo": round(custo, 1),
+    }
+
+
+def estimar_arquivos(arquivos: Sequence[str], cerca: Optional[List[List[float]]] = None,
+                     track_id: Optional[str] = None) -> Dict[str, Any]:
+    pontos: List[Tuple[float, float, int]] = []
+    for path in arquivos:
+        with open(path, "r", encoding="utf-8") as f:
+            pontos.extend(extrair_pontos(json.load(f)))
+    return estimar_custo(pontos, cerca, track_id)
+
+
+def ordenar_ljf(itens: Sequence[T], custo: Callable[[T], float]) -> List[T]:
+    """Longest job first: the most expensive items start first, so no big one is left for the end."""
+    return sorted(itens, key=custo, reverse=True)
+
+
+def simular_makespan(custos: Sequence[float], workers: int) -> Dict[str, float]:
+    """Makespan and mean completion time of list scheduling in the given order."""
+    livres = [0.0] * max(1, workers)
+    fins: List[float] = []
+    for c in custos:
+        inicio = heapq.heappop(livres)
+        fins.append(inicio + c)
+        heapq.heappush(livres, inicio + c)
+    return {
+        "makespan": max(fins) if fins else 0.0,
+        "conclusao_media": sum(fins) / len(fins) if fins else 0.0,
+    }
+
+
+def main():
+    """
+    Estimated cost per track file and simulated makespan, FIFO vs LJF.
+
+    --workers=<n>         parallel workers to simulate (default 4)
+    --fence=<lon,lat;...> fence polygon (default: the processors' fence)
+    """
+    workers, cerca = 4, pru.FENCE_POLYGON_DEFAULT
+    arquivos: List[str] = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--workers="):
+            workers = int(arg.split("=", 1)[1])
+        elif arg.startswith("--fence="):
+            cerca = pru._parse_fence_poly(arg.split("=", 1)[1])
+        elif arg.startswith("--"):
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+        else:
+            arquivos.append(arg)
+    if not arquivos:
+        raise SystemExit("Uso: python custo_trilhas.py [--workers=] [--fence=] trilha1.json ...")
+
+    custos: List[Tuple[str, float]] = []
+    for path in arquivos:
+        try:
+            est = estimar_arquivos([path], cerca)
+        except Exception as e:
+            print(f"{path}: {e}")
+            continue
+        custos.append((path, est["custo"]))
+        print(f"{Path(path).name:<40} pontos {est['pontos']:>8}  gaps {est['gaps_estimados']:>5}  "
+              f"cerca {est['fracao_na_cerca']:.2f}  cache {est['cobertura_cache']:.2f}  custo {est['custo']:>10.0f}")
+    fifo = simular_makespan([c for _, c in custos], workers)
+    ljf = simular_makespan([c for _, c in ordenar_ljf(custos, lambda x: x[1])], workers)
+    print(f"\n{workers} workers, em unidades de custo:")
+    print(f"  FIFO  makespan {fifo['makespan']:>12.0f}  conclusao media {fifo['conclusao_media']:>12.0f}")
+    print(f"  LJF   makespan {ljf['makespan']:>12.0f}  conclusao media {ljf['conclusao_media']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
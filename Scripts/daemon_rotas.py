@@ -0,0 +1,254 @@
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+_T_INICIO = time.perf_counter()
+
+import processador_rotas_unificado as pru
+import processador_rotas_unificado_sem_valhalla as prs
+from cache_rotas import estatisticas_cache
+from cliente_backend import estado_backends, sessao
+from saida_rotas import escrever_saidas
+from upstream_osrm import upstream_ativo
+
+DAEMON_HOST_DEFAULT = "127.0.0.1"
+DAEMON_PORT_DEFAULT = 5010
+MAX_CORPO_BYTES = 256 * 1024 * 1024
+
+VARIANTES = {
+    "valhalla": pru,
+    "sem_valhalla": prs,
+}
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {"jobs": 0, "falhas": 0, "latencias_s": []}
+
+
+def _pontos_do_job(job: Dict[str, Any], mod) -> List[Tuple[float, float, int]]:
+    brutos: List[Tuple[float, float, int]] = []
+    if job.get("pontos"):
+        for p in job["pontos"]:
+            brutos.append((float(p[0]), float(p[1]), int(p[2])))
+    if job.get("dados") is not None:
+        brutos.extend(mod.extrair_pontos(job["dados"]))
+    for path in job.get("arquivos") or []:
+        with open(path, "r", encoding="utf-8") as f:
+            brutos.extend(mod.extrair_pontos(json.load(f)))
+    return brutos
+
+
+def executar_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run one track through a warm processor.
+
+    Job keys: variante (valhalla | sem_valhalla), arquivos | dados | pontos,
+    and optionally host, valhalla_host, fence, hedge, dp, eps, overview,
+    gaps, timings, track_id (incremental checkpoint), prazo (deadline in
+    seconds), saida (list of paths) and formato.  Without ``saida`` the GeoJSON is returned inline.
+    """
+    t0 = time.perf_counter()
+    variante = job.get("variante", "valhalla")
+    mod = VARIANTES.get(variante)
+    if mod is None:
+        return {"ok": False, "msg": f"Variante desconhecida: {variante}"}
+    brutos = _pontos_do_job(job, mod)
+    kwargs: Dict[str, Any] = {
+        "host": job.get("host") or upstream_ativo(mod.OSRM_HOST_DEFAULT),
+        "dp_tol": float(job.get("dp", mod.DP_TOL_DEFAULT)),
+        "eps_m": float(job.get("eps", mod.DEDUP_EPS_M)),
+        "overview": job.get("overview", mod.OVERVIEW_MODE),
+        "gaps": job.get("gaps", mod.GAPS_MODE),
+        "timings": bool(job.get("timings", False)),
+        "track_id": job.get("track_id"),
+        "deadline_s": float(job["prazo"]) if job.get("prazo") else None,
+    }
+    if mod is pru:
+        fence_poly = pru._parse_fence_poly(job["fence"]) if job.get("fence") else None
+        kwargs["valhalla_host"] = job.get("valhalla_host", pru.VALHALLA_HOST_DEFAULT)
+        kwargs["fence_poly"] = fence_poly or pru.FENCE_POLYGON_DEFAULT
+        kwargs["hedge"] = bool(job.get("hedge", pru.HEDGE_ENABLE))
+    geojson_data, msg, ok = mod.processar_uma_trilha(pontos_brutos=brutos, **kwargs)
+    resposta: Dict[str, Any] = {"ok": ok, "msg": msg}
+    if ok and job.get("saida"):
+        resultado = escrever_saidas(geojson_data, [Path(p) for p in job["saida"]], job.get("formato"))
+        resposta["saida"] = {str(p): erro for p, erro in resultado.items()}
+    elif ok:
+        resposta["geojson"] = geojson_data
+    resposta["latencia_s"] = time.perf_counter() - t0
+    with _stats_lock:
+        _stats["jobs"] += 1
+        _stats["falhas"] += 0 if ok else 1
+        _stats["latencias_s"].append(resposta["latencia_s"])
+        del _stats["latencias_s"][:-1000]
+    return resposta
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status: int, obj: Any) -> None:
+        body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/ping":
+            self._responder(200, {"msg": "pong"})
+        elif self.path == "/stats":
+            # Copy under the lock; a slow client must not hold up jobs recording their stats.
+            with _stats_lock:
+                jobs, falhas, lat = _stats["jobs"], _stats["falhas"], list(_stats["latencias_s"])
+            self._responder(200, {
+                "jobs": jobs,
+                "falhas": falhas,
+                "startup_s": self.server.startup_s,
+                "latencia_mediana_s": statistics.median(lat) if lat else None,
+                "backends": estado_backends(),
+                "hedge_perdedores_em_voo": pru.perdedores_hedge_em_voo(),
+                "cache": estatisticas_cache(),
+            })
+        else:
+            self._responder(404, {"erro": "rota desconhecida"})
+
+    def do_POST(self):
+        if self.path != "/processar":
+            self._responder(404, {"erro": "rota desconhecida"})
+            return
+        n = int(self.headers.get("Content-Length") or 0)
+        if n > MAX_CORPO_BYTES:
+            self._responder(413, {"erro": "corpo muito grande"})
+            return
+        try:
+            job = json.loads(self.rfile.read(n) or b"{}")
+            self._responder(200, executar_job(job))
+        except Exception as e:
+            self._responder(400, {"ok": False, "msg": str(e)})
+
+
+def iniciar_daemon(host: str = DAEMON_HOST_DEFAULT, port: int = DAEMON_PORT_DEFAULT) -> ThreadingHTTPServer:
+    sessao()
+    srv = ThreadingHTTPServer((host, port), DaemonHandler)
+    srv.daemon_threads = True
+    srv.startup_s = time.perf_counter() - _T_INICIO
+    return srv
+
+
+def enviar_job(job: Dict[str, Any], url: str, timeout: float = 3600.0) -> Dict[str, Any]:
+    r = sessao().post(f"{url}/processar", json=job, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+
+def comparar_com_cli(arquivos: List[str], variante: str, extra_cli: List[str], job_base: Dict[str, Any]) -> Dict[str, Any]:
+    """Time each file through the current CLI and through an in-process daemon."""
+    script = Path(VARIANTES[variante].__file__).resolve()
+    tmp = Path(tempfile.mkdtemp(prefix="daemon_cmp_"))
+
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {script.stem}"], cwd=script.parent, check=True)
+    startup_cli = time.perf_counter() - t0
+
+    srv = iniciar_daemon(port=0)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://{srv.server_address[0]}:{srv.server_address[1]}"
+    jobs = []
+    try:
+        for i, arq in enumerate(arquivos):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, str(script), "--sem-timings", f"--saida={tmp / f'cli_{i}.json'}", *extra_cli, arq],
+                           cwd=script.parent, capture_output=True)
+            t_cli = time.perf_counter() - t0
+            job = dict(job_base, variante=variante, arquivos=[arq], saida=[str(tmp / f"daemon_{i}.json")])
+            t0 = time.perf_counter()
+            enviar_job(job, url)
+            t_daemon = time.perf_counter() - t0
+            jobs.append({"arquivo": arq, "cli_s": t_cli, "daemon_s": t_daemon})
+    finally:
+        srv.shutdown()
+    return {
+        "variante": variante,
+        "startup_cli_s": startup_cli,
+        "startup_daemon_s": srv.startup_s,
+        "cli_mediana_s": statistics.median([j["cli_s"] for j in jobs]) if jobs else None,
+        "daemon_mediana_s": statistics.median([j["daemon_s"] for j in jobs]) if jobs else None,
+        "jobs": jobs,
+    }
+
+
+def parse_args(argv: List[str]) -> Dict[str, Any]:
+    """
+    --port=<n>              listen port (default 5010, localhost only)
+    --enviar=<url>          submit the given files to a running daemon
+    --comparar              time the given files via CLI and via the daemon
+    --variante=<v>          valhalla | sem_valhalla (for --enviar/--comparar)
+    --host=, --valhalla_host=, --fence=, --saida=, --formato=
+                            forwarded to the job (and to the CLI when comparing)
+    """
+    args: Dict[str, Any] = {
+        "port": DAEMON_PORT_DEFAULT,
+        "enviar": None,
+        "comparar": False,
+        "variante": "valhalla",
+        "files": [],
+        "job": {},
+        "cli": [],
+    }
+    for arg in argv:
+        if arg.startswith("--port="):
+            args["port"] = int(arg.split("=", 1)[1])
+        elif arg.startswith("--enviar="):
+            args["enviar"] = arg.split("=", 1)[1].rstrip("/")
+        elif arg == "--comparar":
+            args["comparar"] = True
+        elif arg.startswith("--variante="):
+            args["variante"] = arg.split("=", 1)[1]
+        elif arg.startswith(("--host=", "--valhalla_host=", "--fence=", "--formato=")):
+            chave, val = arg[2:].split("=", 1)
+            args["job"][chave] = val
+            args["cli"].append(arg)
+        elif arg.startswith("--saida="):
+            args["job"].setdefault("saida", []).append(arg.split("=", 1)[1])
+        elif arg.startswith("--"):
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+        else:
+            args["files"].append(arg)
+    if args["variante"] not in VARIANTES:
+        raise SystemExit(f"Variante desconhecida: {args['variante']}")
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args["comparar"]:
+        job = {k: v for k, v in args["job"].items() if k != "saida"}
+        print(json.dumps(comparar_com_cli(args["files"], args["variante"], args["cli"], job), indent=2))
+        return
+    if args["enviar"]:
+        job = dict(args["job"], variante=args["variante"], arquivos=[str(Path(f).resolve()) for f in args["files"]])
+        resp = enviar_job(job, args["enviar"])
+        resp.pop("geojson", None)
+        print(json.dumps(resp, ensure_ascii=False, indent=2))
+        return
+    srv = iniciar_daemon(port=args["port"])
+    print(f"Daemon de rotas em http://{DAEMON_HOST_DEFAULT}:{args['port']} (startup {srv.startup_s:.3f} s)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import statistics
+from typing import Any, List, Optional, Sequence, Tuple
+
+# The schema is recognised from the first AMOSTRA_ESQUEMA rows only; the whole
+# input is then converted in one pass, with the row layout, the timestamp unit
+# and the lat/lon order decided once per track from that same sample.
+AMOSTRA_ESQUEMA = 32
+TS_MS_LIMIAR = 1e12
+
+Ponto = Tuple[float, float, int]
+
+ERICTECH = "erictech"  # {"track": {"route": [[ts, lat, lon], ...]}}
+GEOJSON = "geojson"    # FeatureCollection with a LineString / MultiLineString
+LINHAS = "linhas"      # [[ts, lat, lon], ...] or [[lat, lon], ...]
+DICTS = "dicts"        # [{"lat": .., "lon": .., "time": ..}, ...]
+
+
+def detectar_esquema(data: Any) -> Optional[str]:
+    if isinstance(data, dict):
+        track = data.get("track")
+        if isinstance(track, dict) and isinstance(track.get("route"), list) and track["route"]:
+            return ERICTECH
+        if data.get("type") == "FeatureCollection" and isinstance(data.get("features"), list):
+            return GEOJSON
+        return None
+    if isinstance(data, list) and data:
+        amostra = data[:AMOSTRA_ESQUEMA]
+        if all(isinstance(x, dict) for x in amostra):
+            return DICTS
+        if any(isinstance(x, (list, tuple)) for x in amostra):
+            return LINHAS
+    return None
+
+
+def _ts_em_ms(valores: Sequence[float]) -> bool:
+    return bool(valores) and statistics.median(valores) > TS_MS_LIMIAR
+
+
+def _eixos_trocados(pares: Sequence[Tuple[float, float]]) -> bool:
+    """``pares`` are (lat, lon) as read; True when most of them only make sense swapped."""
+    fora = sum(1 for lat, lon in pares if abs(lat) > 90 and abs(lon) <= 90)
+    return fora * 2 > len(pares)
+
+
+def _amostra_floats(linhas: Sequence[Any], idx: Tuple[Any, ...]) -> List[Tuple[float, ...]]:
+    out = []
+    for r in linhas[:AMOSTRA_ESQUEMA]:
+        try:
+            out.append(tuple(float(r[i]) for i in idx))
+        except (TypeError, ValueError, IndexError, KeyError):
+            continue
+    return out
+
+
+def _de_linhas_com_tempo(linhas: Sequence[Any]) -> List[Ponto]:
+    amostra = _amostra_floats(linhas, (0, 1, 2))
+    div = 1000 if _ts_em_ms([a[0] for a in amostra]) else 1
+    i_lon, i_lat = (1, 2) if _eixos_trocados([(a[1], a[2]) for a in amostra]) else (2, 1)
+    out: List[Ponto] = []
+    append = out.append
+    for r in linhas:
+        try:
+            append((float(r[i_lon]), float(r[i_lat]), int(round(float(r[0]))) // div))
+        except (TypeError, ValueError, IndexError, KeyError):
+            continue
+    return out
+
+
+def _de_pares(linhas: Sequence[Any], lon_primeiro: bool) -> List[Ponto]:
+    """Untimed coordinate pairs; the timestamp is the running index."""
+    amostra = _amostra_floats(linhas, (0, 1))
+    pares = [(a[1], a[0]) for a in amostra] if lon_primeiro else amostra
+    trocado = _eixos_trocados(pares)
+    i_lon, i_lat = (0, 1) if lon_primeiro != trocado else (1, 0)
+    out: List[Ponto] = []
+    append = out.append
+    for r in linhas:
+        try:
+            append((float(r[i_lon]), float(r[i_lat]), len(out)))
+        except (TypeError, ValueError, IndexError, KeyError):
+            continue
+    return out
+
+
+def _de_geojson(data: Any) -> List[Ponto]:
+    features = [f for f in data["features"] if isinstance(f, dict)]
+    for tipo in ("LineString", "MultiLineString"):
+        for feat in features:
+            geom = feat.get("geometry") or {}
+            coords = geom.get("coordinates")
+            if geom.get("type") != tipo or not isinstance(coords, list):
+                continue
+            if tipo == "MultiLineString":
+                coords = [c for linha in coords if isinstance(linha, list) for c in linha]
+            out = _de_pares(coords, lon_primeiro=True)
+            if out:
+                return out
+    return []
+
+
+def _de_linhas(data: List[Any]) -> Tuple[List[Ponto], bool]:
+    amostra = [r for r in data[:AMOSTRA_ESQUEMA] if isinstance(r, (list, tuple))]
+    com_tempo = sum(1 for r in amostra if len(r) >= 3 and isinstance(r[1], (int, float)) and isinstance(r[2], (int, float)))
+    if com_tempo * 2 > len(amostra):
+        return _de_linhas_com_tempo(data), True
+    return _de_pares(data, lon_primeiro=False), False
+
+
+def _de_dicts(data: List[Any]) -> Tuple[List[Ponto], bool]:
+    amostra = _amostra_floats(data, ("lat", "lon"))
+    trocado = _eixos_trocados(amostra)
+    k_lat, k_lon = ("lon", "lat") if trocado else ("lat", "lon")
+    tempos = [a[0] for a in _amostra_floats(data, ("time",))]
+    div = 1000 if _ts_em_ms(tempos) else 1
+    out: List[Ponto] = []
+    append = out.append
+    contador = 0
+    for p in data:
+        try:
+            lat, lon = float(p[k_lat]), float(p[k_lon])
+        except (TypeError, ValueError, KeyError):
+            continue
+        t = p.get("time")
+        try:
+            ts = contador if t is None else int(round(float(t))) // div
+        except (TypeError, ValueError):
+            ts = contador
+        append((lon, lat, ts))
+        contador = max(contador + 1, ts + 1)
+    return out, bool(tempos)
+
+
+def normalizar(data: Any) -> Tuple[List[Ponto], bool]:
+    """Points as (lon, lat, ts) in input order, and whether ts came from the input."""
+    esquema = detectar_esquema(data)
+    if esquema == ERICTECH:
+        return _de_linhas_com_tempo(data["track"]["route"]), True
+    if esquema == GEOJSON:
+        return _de_geojson(data), False
+    if esquema == LINHAS:
+        return _de_linhas(data)
+    if esquema == DICTS:
+        return _de_dicts(data)
+    return [], False
+
+
+def extrair_pontos(data: Any) -> List[Ponto]:
+    return normalizar(data)[0]
@@ -0,0 +1,346 @@
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache_rotas import chave_hash
+
+# Durable job queue in one SQLite file.  Put it on a volume every worker host
+# mounts (with working POSIX/SMB locks); workers claim jobs with a lease that
+# a heartbeat renews, and jobs whose lease expired go back to the queue.
+FILA_ARQUIVO_DEFAULT = os.getenv("ROTAS_FILA", "fila_rotas.db")
+FILA_LEASE_S = 60.0
+FILA_MAX_TENTATIVAS = 3
+FILA_ESPERA_VAZIA_S = 2.0
+FILA_TIMEOUT_SQLITE_S = 30.0
+
+PENDENTE, EXECUTANDO, FEITO, FALHOU = "pendente", "executando", "feito", "falhou"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    prioridade REAL NOT NULL DEFAULT 0,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_ate REAL,
+    criado REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL,
+    duracao_s REAL,
+    resultado TEXT,
+    erro TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_fila ON jobs (estado, prioridade DESC, criado);
+"""
+
+
+def abrir(path: str = FILA_ARQUIVO_DEFAULT) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=FILA_TIMEOUT_SQLITE_S, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_ESQUEMA)
+    return conn
+
+
+def enfileirar(conn: sqlite3.Connection, job: Dict[str, Any], job_id: Optional[str] = None,
+               prioridade: float = 0.0) -> Tuple[str, bool]:
+    """Add a job; the same id (by default, a hash of the job) is only queued once."""
+    job_id = job_id or chave_hash(job)
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO jobs (id, job, estado, prioridade, criado) VALUES (?, ?, ?, ?, ?)",
+        (job_id, json.dumps(job, ensure_ascii=False), PENDENTE, prioridade, time.time()),
+    )
+    return job_id, cur.rowcount == 1
+
+
+def _recuperar_expirados(conn: sqlite3.Connection, agora: float) -> None:
+    conn.execute(
+        "UPDATE jobs SET estado = CASE WHEN tentativas >= ? THEN ? ELSE ? END, worker = NULL, "
+        "erro = 'lease expirado' WHERE estado = ? AND lease_ate < ?",
+        (FILA_MAX_TENTATIVAS, FALHOU, PENDENTE, EXECUTANDO, agora),
+    )
+
+
+def reservar(conn: sqlite3.Connection, worker: str, lease_s: float = FILA_LEASE_S
+             ) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Claim the next pending job for ``worker``, re-queueing expired leases first."""
+    agora = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _recuperar_expirados(conn, agora)
+        row = conn.execute(
+            "SELECT id, job FROM jobs WHERE estado = ? ORDER BY prioridade DESC, criado LIMIT 1", (PENDENTE,)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET estado = ?, worker = ?, lease_ate = ?, iniciado = ?, "
+                "tentativas = tentativas + 1 WHERE id = ?",
+                (EXECUTANDO, worker, agora + lease_s, agora, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return (row["id"], json.loads(row["job"])) if row is not None else None
+
+
+def renovar(conn: sqlite3.Connection, job_id: str, worker: str, lease_s: float = FILA_LEASE_S) -> bool:
+    """Heartbeat; False means the lease was lost and the job belongs to someone else now."""
+    cur = conn.execute(
+        "UPDATE jobs SET lease_ate = ? WHERE id = ? AND worker = ? AND estado = ?",
+        (time.time() + lease_s, job_id, worker, EXECUTANDO),
+    )
+    return cur.rowcount == 1
+
+
+def concluir(conn: sqlite3.Connection, job_id: str, worker: str, resultado: Dict[str, Any]) -> bool:
+    agora = time.time()
+    cur = conn.execute(
+        "UPDATE jobs SET estado = ?, terminado = ?, duracao_s = ? - iniciado, resultado = ?, erro = NULL, "
+        "lease_ate = NULL WHERE id = ? AND worker = ? AND estado = ?",
+        (FEITO, agora, agora, json.dumps(resultado, ensure_ascii=False), job_id, worker, EXECUTANDO),
+    )
+    return cur.rowcount == 1
+
+
+def falhar(conn: sqlite3.Connection, job_id: str, worker: str, erro: str, retentar: bool) -> bool:
+    """Record a failure; the job is re-queued while ``retentar`` and attempts remain."""
+    agora = time.time()
+    cur = conn.execute(
+        "UPDATE jobs SET estado = CASE WHEN ? AND tentativas < ? THEN ? ELSE ? END, worker = NULL, "
+        "lease_ate = NULL, terminado = ?, duracao_s = ? - iniciado, erro = ? "
+        "WHERE id = ? AND worker = ? AND estado = ?",
+        (1 if retentar else 0, FILA_MAX_TENTATIVAS, PENDENTE, FALHOU, agora, agora, erro,
+         job_id, worker, EXECUTANDO),
+    )
+    return cur.rowcount == 1
+
+
+def reenfileirar_falhas(conn: sqlite3.Connection) -> int:
+    cur = conn.execute("UPDATE jobs SET estado = ?, tentativas = 0, erro = NULL WHERE estado = ?",
+                       (PENDENTE, FALHOU))
+    return cur.rowcount
+
+
+def _percentil(valores: List[float], p: float) -> Optional[float]:
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100.0 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+
+def estatisticas(conn: sqlite3.Connection) -> Dict[str, Any]:
+    agora = time.time()
+    por_estado = {r["estado"]: r["n"] for r in conn.execute("SELECT estado, COUNT(*) AS n FROM jobs GROUP BY estado")}
+    duracoes = [r["duracao_s"] for r in conn.execute(
+        "SELECT duracao_s FROM jobs WHERE estado = ? AND duracao_s IS NOT NULL", (FEITO,))]
+    mais_antigo = conn.execute("SELECT MIN(criado) AS t FROM jobs WHERE estado = ?", (PENDENTE,)).fetchone()["t"]
+    workers = {r["worker"]: r["n"] for r in conn.execute(
+        "SELECT worker, COUNT(*) AS n FROM jobs WHERE estado = ? GROUP BY worker", (EXECUTANDO,))}
+    retentados = conn.execute("SELECT COUNT(*) AS n FROM jobs WHERE tentativas > 1").fetchone()["n"]
+    janela = conn.execute("SELECT MIN(iniciado) AS i, MAX(terminado) AS t FROM jobs WHERE estado = ?",
+                          (FEITO,)).fetchone()
+    # Seconds per unit of estimated cost (the priority of cost-ordered jobs).
+    por_custo = [r["duracao_s"] / r["prioridade"] for r in conn.execute(
+        "SELECT duracao_s, prioridade FROM jobs WHERE estado = ? AND duracao_s IS NOT NULL AND prioridade > 0",
+        (FEITO,))]
+    return {
+        "jobs": {e: por_estado.get(e, 0) for e in (PENDENTE, EXECUTANDO, FEITO, FALHOU)},
+        "retentados": retentados,
+        "duracao_p50_s": _percentil(duracoes, 50),
+        "duracao_p95_s": _percentil(duracoes, 95),
+        "makespan_s": round(janela["t"] - janela["i"], 3) if janela["i"] is not None else None,
+        "segundos_por_custo": _percentil(por_custo, 50),
+        "pendente_mais_antigo_s": round(agora - mais_antigo, 1) if mais_antigo else None,
+        "em_execucao_por_worker": workers,
+    }
+
+
+def _batimento(path: str, job_id: str, worker: str, lease_s: float, fim: threading.Event,
+               perdido: threading.Event) -> None:
+    conn = abrir(path)
+    try:
+        while not fim.wait(lease_s / 3.0):
+            try:
+                if not renovar(conn, job_id, worker, lease_s):
+                    perdido.set()
+                    return
+            except sqlite3.OperationalError as e:
+                print(f"[{worker}] falha no heartbeat de {job_id}: {e}")
+    finally:
+        conn.close()
+
+
+def executar_reservado(conn: sqlite3.Connection, path: str, job_id: str, job: Dict[str, Any], worker: str,
+                       lease_s: float = FILA_LEASE_S) -> bool:
+    from daemon_rotas import executar_job
+    from saida_rotas import escrever_saidas
+
+    fim, perdido = threading.Event(), threading.Event()
+    hb = threading.Thread(target=_batimento, args=(path, job_id, worker, lease_s, fim, perdido), daemon=True)
+    hb.start()
+    try:
+        # Outputs are written here, after checking the lease, so a worker that
+        # lost its job never overwrites the result of the one that took over.
+        resposta = executar_job(dict(job, saida=None, track_id=job.get("track_id") or job_id))
+    except Exception as e:
+        fim.set()
+        hb.join()
+        return falhar(conn, job_id, worker, f"{type(e).__name__}: {e}", retentar=True)
+    fim.set()
+    hb.join()
+    if perdido.is_set() or not renovar(conn, job_id, worker, lease_s):
+        print(f"[{worker}] lease de {job_id} perdido; resultado descartado.")
+        return False
+    if not resposta.get("ok"):
+        return falhar(conn, job_id, worker, str(resposta.get("msg")), retentar=False)
+    geojson = resposta.pop("geojson", None)
+    if job.get("saida"):
+        res = escrever_saidas(geojson, [Path(p) for p in job["saida"]], job.get("formato"))
+        erros = {str(p): e for p, e in res.items() if e is not None}
+        if erros:
+            return falhar(conn, job_id, worker, json.dumps(erros, ensure_ascii=False), retentar=True)
+        resposta["saida"] = [str(p) for p in res]
+    else:
+        resposta["geojson"] = geojson
+    return concluir(conn, job_id, worker, resposta)
+
+
+def _custo_job(job: Dict[str, Any], job_id: str) -> float:
+    import processador_rotas_unificado as pru
+    from custo_trilhas import estimar_arquivos
+
+    cerca = None
+    if job.get("variante", "valhalla") == "valhalla":
+        cerca = (pru._parse_fence_poly(job["fence"]) if job.get("fence") else None) or pru.FENCE_POLYGON_DEFAULT
+    try:
+        return estimar_arquivos(job.get("arquivos") or [], cerca, job.get("track_id") or job_id)["custo"]
+    except Exception as e:
+        print(f"Sem estimativa de custo para {job.get('arquivos')}: {e}")
+        return 0.0
+
+
+def trabalhar(path: str, worker: str, lease_s: float = FILA_LEASE_S, ate_esvaziar: bool = False) -> int:
+    conn = abrir(path)
+    feitos = 0
+    try:
+        while True:
+            reservado = reservar(conn, worker, lease_s)
+            if reservado is None:
+                if ate_esvaziar and not conn.execute(
+                        "SELECT 1 FROM jobs WHERE estado IN (?, ?) LIMIT 1", (PENDENTE, EXECUTANDO)).fetchone():
+                    return feitos
+                time.sleep(FILA_ESPERA_VAZIA_S)
+                continue
+            job_id, job = reservado
+            if executar_reservado(conn, path, job_id, job, worker, lease_s):
+                feitos += 1
+    finally:
+        conn.close()
+
+
+def parse_args(argv: List[str]) -> Dict[str, Any]:
+    """
+    --fila=<arquivo.db>       queue file (default ROTAS_FILA or fila_rotas.db)
+    --enfileirar              queue the given track files, one job each
+    --variante=<v>            valhalla | sem_valhalla (default valhalla)
+    --saida-pasta=<dir>       output folder for queued jobs (<nome>.geojson)
+    --ordem=<o>               ljf (default: most expensive estimated track first) or fifo
+    --host=, --valhalla_host=, --fence=, --formato=
+                              forwarded to the queued jobs
+    --trabalhar               drain the queue with --workers threads
+    --workers=<n>             worker threads in this process (default 1)
+    --lease=<s>               lease length in seconds (default 60)
+    --ate-esvaziar            stop when nothing is pending or running
+    --stats                   print queue statistics
+    --reenfileirar-falhas     move failed jobs back to pending
+    """
+    args: Dict[str, Any] = {
+        "fila": FILA_ARQUIVO_DEFAULT,
+        "acao": None,
+        "variante": "valhalla",
+        "saida_pasta": None,
+        "workers": 1,
+        "lease": FILA_LEASE_S,
+        "ate_esvaziar": False,
+        "ordem": "ljf",
+        "files": [],
+        "job": {},
+    }
+    for arg in argv:
+        if arg in ("--enfileirar", "--trabalhar", "--stats", "--reenfileirar-falhas"):
+            args["acao"] = arg[2:]
+        elif arg == "--ate-esvaziar":
+            args["ate_esvaziar"] = True
+        elif arg.startswith("--fila="):
+            args["fila"] = arg.split("=", 1)[1]
+        elif arg.startswith("--variante="):
+            args["variante"] = arg.split("=", 1)[1]
+        elif arg.startswith(("--host=", "--valhalla_host=", "--fence=", "--formato=")):
+            chave, val = arg[2:].split("=", 1)
+            args["job"][chave] = val
+        elif arg.startswith("--saida-pasta="):
+            args["saida_pasta"] = arg.split("=", 1)[1]
+        elif arg.startswith("--ordem="):
+            args["ordem"] = arg.split("=", 1)[1]
+        elif arg.startswith("--workers="):
+            args["workers"] = max(1, int(arg.split("=", 1)[1]))
+        elif arg.startswith("--lease="):
+            args["lease"] = float(arg.split("=", 1)[1])
+        elif arg.startswith("--"):
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+        else:
+            args["files"].append(arg)
+    if args["ordem"] not in ("ljf", "fifo"):
+        raise SystemExit(f"Ordem desconhecida: {args['ordem']}")
+    if args["acao"] is None:
+        raise SystemExit("Informe --enfileirar, --trabalhar, --stats ou --reenfileirar-falhas.")
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args["acao"] == "enfileirar":
+        if not args["saida_pasta"]:
+            raise SystemExit("Informe --saida-pasta= para os resultados dos jobs.")
+        conn = abrir(args["fila"])
+        novos = 0
+        for f in args["files"]:
+            src = Path(f).resolve()
+            job = dict(
+                args["job"],
+                variante=args["variante"],
+                arquivos=[str(src)],
+                saida=[str(Path(args["saida_pasta"]).resolve() / f"{src.stem}.geojson")],
+            )
+            job_id = chave_hash(job)
+            prioridade = 0.0
+            if args["ordem"] == "ljf":
+                prioridade = _custo_job(job, job_id)
+            novos += enfileirar(conn, job, job_id, prioridade)[1]
+        print(f"{novos} jobs novos ({len(args['files']) - novos} ja estavam na fila).")
+    elif args["acao"] == "trabalhar":
+        base = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(target=trabalhar, args=(args["fila"], f"{base}:{i}", args["lease"], args["ate_esvaziar"]))
+            for i in range(args["workers"])
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elif args["acao"] == "reenfileirar-falhas":
+        print(f"{reenfileirar_falhas(abrir(args['fila']))} jobs de volta na fila.")
+    if args["acao"] in ("stats", "trabalhar"):
+        print(json.dumps(estatisticas(abrir(args["fila"])), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import math
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from cliente_backend import http_get_json, http_get_json_async
+from instrumentacao import atual
+from upstream_osrm import dataset_de
+
+# OSRM returns a ``hint`` per waypoint (the snapped edge, tagged with the
+# checksum of the dataset); sending it back in ``hints=`` skips the nearest
+# edge search for that coordinate.  osrm-routed only uses a hint when the
+# input coordinate equals the one it was issued for, in its fixed-point
+# 1e-6 degree representation (Hint::IsValid), so hints are keyed on that
+# exact coordinate: only repeated coordinates (depots, fixed stops,
+# retries) benefit, a nearby point in the same street does not.
+HINTS_ENABLE: bool = os.getenv("OSRM_HINTS", "1") != "0"
+OSRM_PRECISAO_COORD = 1e6
+HINTS_MAX = 200_000
+# Each hint adds ~90 characters to the URL; longer requests go without them.
+HINTS_MAX_COORDS = 500
+HINTS_CODIGOS_REJEITADOS = ("InvalidHint", "InvalidOptions", "InvalidQuery")
+
+_lock = threading.Lock()
+_hints: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_stats: Dict[str, int] = {"anexados": 0, "sem_hint": 0, "guardados": 0, "rejeitados": 0}
+
+
+def coord_fixa(v: float) -> int:
+    """Coordinate as osrm-routed stores it (util::toFixed: rounded half away from zero)."""
+    return int(math.copysign(math.floor(abs(v) * OSRM_PRECISAO_COORD + 0.5), v))
+
+
+def _chave(dataset: str, c: Sequence[float]) -> Tuple[str, int, int]:
+    return dataset, coord_fixa(c[0]), coord_fixa(c[1])
+
+
+def hints_para(coords: Sequence[Sequence[float]], dataset: str) -> Optional[str]:
+    """Value for ``hints=`` (empty entries for unknown coordinates), or None if none is known."""
+    if not HINTS_ENABLE or not coords or len(coords) > HINTS_MAX_COORDS:
+        return None
+    with _lock:
+        achados = [_hints.get(_chave(dataset, c)) for c in coords]
+        for c, h in zip(coords, achados):
+            if h is not None:
+                _hints.move_to_end(_chave(dataset, c))
+        n = sum(1 for h in achados if h)
+        _stats["anexados"] += n
+        _stats["sem_hint"] += len(achados) - n
+    if not n:
+        return None
+    atual().contar("osrm_hints", n)
+    return ";".join(h or "" for h in achados)
+
+
+def guardar_hints(coords: Sequence[Sequence[float]], dataset: str, waypoints: Optional[List[Any]]) -> None:
+    """Store the hints of a response; ``waypoints`` (or match tracepoints) align with ``coords``."""
+    if not HINTS_ENABLE or not waypoints or len(waypoints) != len(coords):
+        return
+    with _lock:
+        for c, w in zip(coords, waypoints):
+            if w and w.get("hint"):
+                chave = _chave(dataset, c)
+                _hints[chave] = w["hint"]
+                _hints.move_to_end(chave)
+                _stats["guardados"] += 1
+        while len(_hints) > HINTS_MAX:
+            _hints.popitem(last=False)
+
+
+def descartar_hints(coords: Sequence[Sequence[float]], dataset: str) -> None:
+    with _lock:
+        for c in coords:
+            _hints.pop(_chave(dataset, c), None)
+        _stats["rejeitados"] += 1
+
+
+def rejeitou_hints(resp: Any) -> bool:
+    if resp is None or resp.status_code != 400:
+        return False
+    try:
+        return (resp.json() or {}).get("code") in HINTS_CODIGOS_REJEITADOS
+    except Exception:
+        return False
+
+
+def com_hints(url: str, hints: Optional[str]) -> str:
+    if not hints:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}hints={quote(hints, safe=';')}"
+
+
+def estatisticas_hints() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats, em_cache=len(_hints))
+
+
+def osrm_get_json(url: str, coords: Sequence[Sequence[float]], host: str, timeout: float) -> Any:
+    """http_get_json for OSRM with the known hints attached; retried without them if OSRM rejects them."""
+    dataset = dataset_de(host)
+    hints = hints_para(coords, dataset)
+    try:
+        rj = http_get_json(com_hints(url, hints), timeout=timeout, engine="osrm")
+    except Exception as e:
+        if not hints or not rejeitou_hints(getattr(e, "response", None)):
+            raise
+        descartar_hints(coords, dataset)
+        rj = http_get_json(url, timeout=timeout, engine="osrm")
+    guardar_hints(coords, dataset, rj.get("waypoints") or rj.get("tracepoints"))
+    return rj
+
+
+async def osrm_get_json_async(url: str, coords: Sequence[Sequence[float]], host: str, timeout: float,
+                              client=None) -> Any:
+    dataset = dataset_de(host)
+    hints = hints_para(coords, dataset)
+    try:
+        rj = await http_get_json_async(com_hints(url, hints), timeout=timeout, engine="osrm", client=client)
+    except Exception as e:
+        if not hints or not rejeitou_hints(getattr(e, "response", None)):
+            raise
+        descartar_hints(coords, dataset)
+        rj = await http_get_json_async(url, timeout=timeout, engine="osrm", client=client)
+    guardar_hints(coords, dataset, rj.get("waypoints") or rj.get("tracepoints"))
+    return rj
+
+
+def main():
+    """
+    Latency of repeated /route calls between a depot and corridor points,
+    without and with hints.
+
+    --host=<url>          OSRM (default http://127.0.0.1:5001)
+    --repeticoes=<n>      calls per destination and mode (default 20)
+    --deposito=lon,lat    default -46.8368,-23.5074
+    --corredor=lon,lat;lon,lat;...   destinations (default: 10 points to the east)
+    """
+    global HINTS_ENABLE
+    host, repeticoes = "http://127.0.0.1:5001", 20
+    deposito = (-46.8368, -23.5074)
+    corredor = [(deposito[0] + 0.01 * k, deposito[1] + 0.002 * k) for k in range(1, 11)]
+    for arg in sys.argv[1:]:
+        chave, _, val = arg.partition("=")
+        if chave == "--host":
+            host = val.rstrip("/")
+        elif chave == "--repeticoes":
+            repeticoes = int(val)
+        elif chave == "--deposito":
+            deposito = tuple(float(v) for v in val.split(","))
+        elif chave == "--corredor":
+            corredor = [tuple(float(v) for v in p.split(",")) for p in val.split(";") if p]
+        else:
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+
+    resultado: Dict[str, Dict[str, float]] = {}
+    for modo in ("sem_hints", "com_hints"):
+        HINTS_ENABLE = modo == "com_hints"
+        lat: List[float] = []
+        for destino in corredor:
+            coords = [deposito, destino]
+            url = f"{host}/route/v1/driving/{';'.join(f'{c[0]},{c[1]}' for c in coords)}?overview=false"
+            for _ in range(repeticoes):
+                t0 = time.perf_counter()
+                osrm_get_json(url, coords, host, timeout=30)
+                lat.append(time.perf_counter() - t0)
+        lat.sort()
+        resultado[modo] = {"p50_ms": statistics.median(lat) * 1000, "p95_ms": lat[int(0.95 * (len(lat) - 1))] * 1000}
+        print(f"{modo:<10} p50 {resultado[modo]['p50_ms']:8.2f} ms   p95 {resultado[modo]['p95_ms']:8.2f} ms")
+    base = resultado["sem_hints"]["p50_ms"]
+    if base > 0:
+        print(f"Reducao do p50 com hints: {100.0 * (1 - resultado['com_hints']['p50_ms'] / base):.1f}%")
+    print(estatisticas_hints())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+LOG_VERSION = 1
+TIMINGS_ENABLE: bool = os.getenv("ROTAS_TIMINGS", "1") != "0"
+
+
+class Medidor:
+    """Stage timers and counters for one processed track."""
+
+    ativo = True
+
+    def __init__(self, **contexto: Any):
+        self.contexto: Dict[str, Any] = dict(contexto)
+        self.etapas: Dict[str, float] = {}
+        self.contadores: Dict[str, int] = {}
+        self.http: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    @contextlib.contextmanager
+    def etapa(self, nome: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self.etapas[nome] = self.etapas.get(nome, 0.0) + dt
+
+    def contar(self, nome: str, n: int = 1) -> None:
+        with self._lock:
+            self.contadores[nome] = self.contadores.get(nome, 0) + n
+
+    def registrar_http(self, engine: str, enviados: int, recebidos: int, dt: float, ok: bool) -> None:
+        with self._lock:
+            h = self.http.setdefault(engine, {
+                "chamadas": 0, "erros": 0, "bytes_enviados": 0, "bytes_recebidos": 0, "tempo_s": 0.0,
+            })
+            h["chamadas"] += 1
+            h["erros"] += 0 if ok else 1
+            h["bytes_enviados"] += enviados
+            h["bytes_recebidos"] += recebidos
+            h["tempo_s"] += dt
+
+    def resumo(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_s": round(time.perf_counter() - self._t0, 6),
+                "etapas_s": {k: round(v, 6) for k, v in self.etapas.items()},
+                "http": {k: dict(v, tempo_s=round(v["tempo_s"], 6)) for k, v in self.http.items()},
+                "contadores": dict(self.contadores),
+            }
+
+    def emitir(self, evento: str = "track_timings", **extra: Any) -> None:
+        registro = {"log_version": LOG_VERSION, "evento": evento, "ts": time.time()}
+        registro.update(self.contexto)
+        registro.update(extra)
+        registro.update(self.resumo())
+        print(json.dumps(registro, ensure_ascii=False, separators=(",", ":")), file=sys.stderr)
+
+
+class _MedidorNulo:
+    ativo = False
+    _ctx = contextlib.nullcontext()
+
+    def etapa(self, nome: str):
+        return self._ctx
+
+    def contar(self, nome: str, n: int = 1) -> None:
+        pass
+
+    def registrar_http(self, engine: str, enviados: int, recebidos: int, dt: float, ok: bool) -> None:
+        pass
+
+    def resumo(self) -> Optional[Dict[str, Any]]:
+        return None
+
+    def emitir(self, evento: str = "track_timings", **extra: Any) -> None:
+        pass
+
+
+MEDIDOR_NULO = _MedidorNulo()
+_atual: contextvars.ContextVar = contextvars.ContextVar("medidor_rotas", default=MEDIDOR_NULO)
+
+
+def atual():
+    return _atual.get()
+
+
+@contextlib.contextmanager
+def medir_trilha(ativo: Optional[bool] = None, **contexto: Any):
+    if ativo is None:
+        ativo = TIMINGS_ENABLE
+    med = Medidor(**contexto) if ativo else MEDIDOR_NULO
+    token = _atual.set(med)
+    try:
+        yield med
+    finally:
+        _atual.reset(token)
@@ -0,0 +1,219 @@
+import gzip
+import json
+import math
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Raw points closer than METRICAS_RAIO_MATCH_M to the final path count as matched.
+METRICAS_RAIO_MATCH_M = 20.0
+METRICAS_CELULA_M = 20.0
+METRICAS_BUSCA_MAX_M = 500.0
+
+SANIDADE_MIN_RATIO = 0.8
+SANIDADE_MAX_DESVIO_M = 30.0
+
+M_POR_GRAU = 111000.0
+
+
+class GradeSegmentos:
+    """
+    Uniform grid over the segments of a path, in a local metric projection.
+
+    Each segment is registered in every cell it crosses (long segments are
+    cut into cell-sized pieces first), so the nearest segment to a point is
+    found by scanning rings of cells around it until the ring is farther
+    than the best distance found.
+    """
+
+    def __init__(self, caminho: Sequence[Sequence[float]], celula_m: float = METRICAS_CELULA_M):
+        lat_ref = sum(c[1] for c in caminho) / len(caminho)
+        self.kx = M_POR_GRAU * math.cos(math.radians(lat_ref))
+        self.ky = M_POR_GRAU
+        self.celula = celula_m
+        self.xs = [c[0] * self.kx for c in caminho]
+        self.ys = [c[1] * self.ky for c in caminho]
+        self.celulas: Dict[Tuple[int, int], List[int]] = {}
+        for i in range(len(caminho) - 1):
+            self._registrar(i)
+
+    def _registrar(self, i: int) -> None:
+        x0, y0, x1, y1 = self.xs[i], self.ys[i], self.xs[i + 1], self.ys[i + 1]
+        pedacos = max(1, int(math.hypot(x1 - x0, y1 - y0) / self.celula) + 1)
+        vistos = set()
+        for k in range(pedacos):
+            ax = x0 + (x1 - x0) * k / pedacos
+            ay = y0 + (y1 - y0) * k / pedacos
+            bx = x0 + (x1 - x0) * (k + 1) / pedacos
+            by = y0 + (y1 - y0) * (k + 1) / pedacos
+            for cx in range(int(math.floor(min(ax, bx) / self.celula)), int(math.floor(max(ax, bx) / self.celula)) + 1):
+                for cy in range(int(math.floor(min(ay, by) / self.celula)), int(math.floor(max(ay, by) / self.celula)) + 1):
+                    if (cx, cy) not in vistos:
+                        vistos.add((cx, cy))
+                        self.celulas.setdefault((cx, cy), []).append(i)
+
+    def _dist_segmento(self, i: int, px: float, py: float) -> float:
+        x0, y0 = self.xs[i], self.ys[i]
+        dx, dy = self.xs[i + 1] - x0, self.ys[i + 1] - y0
+        den = dx * dx + dy * dy
+        t = 0.0 if den == 0 else max(0.0, min(1.0, ((px - x0) * dx + (py - y0) * dy) / den))
+        return math.hypot(px - (x0 + t * dx), py - (y0 + t * dy))
+
+    def distancia(self, lon: float, lat: float, busca_max_m: float = METRICAS_BUSCA_MAX_M) -> float:
+        px, py = lon * self.kx, lat * self.ky
+        if len(self.xs) == 1:
+            return math.hypot(px - self.xs[0], py - self.ys[0])
+        cel = self.celula
+        cx0, cy0 = int(math.floor(px / cel)), int(math.floor(py / cel))
+        # Distance from the point to the edge of its own cell; the square of
+        # rings 0..r is at least this plus r cells away on every side.
+        borda0 = min(px - cx0 * cel, (cx0 + 1) * cel - px, py - cy0 * cel, (cy0 + 1) * cel - py)
+        xs, ys, celulas = self.xs, self.ys, self.celulas
+        melhor2 = math.inf
+        vistos = set()
+        r_max = int(math.ceil(busca_max_m / cel))
+        for r in range(r_max + 1):
+            for cx in range(cx0 - r, cx0 + r + 1):
+                lado = cx == cx0 - r or cx == cx0 + r
+                for cy in (range(cy0 - r, cy0 + r + 1) if lado else (cy0 - r, cy0 + r)):
+                    for i in celulas.get((cx, cy), ()):
+                        if i in vistos:
+                            continue
+                        vistos.add(i)
+                        x0, y0 = xs[i], ys[i]
+                        dx, dy = xs[i + 1] - x0, ys[i + 1] - y0
+                        den = dx * dx + dy * dy
+                        t = 0.0 if den == 0 else ((px - x0) * dx + (py - y0) * dy) / den
+                        t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+                        ex, ey = px - x0 - t * dx, py - y0 - t * dy
+                        d2 = ex * ex + ey * ey
+                        if d2 < melhor2:
+                            melhor2 = d2
+            limite = borda0 + r * cel
+            if melhor2 <= limite * limite:
+                return math.sqrt(melhor2)
+        # Far from every segment (rare: outliers): exact scan.
+        return min(self._dist_segmento(i, px, py) for i in range(len(xs) - 1))
+
+
+def comprimento_m(caminho: Sequence[Sequence[float]]) -> float:
+    total = 0.0
+    for a, b in zip(caminho, caminho[1:]):
+        kx = M_POR_GRAU * math.cos(math.radians((a[1] + b[1]) / 2.0))
+        total += math.hypot((b[0] - a[0]) * kx, (b[1] - a[1]) * M_POR_GRAU)
+    return total
+
+
+def _gaps(brutos: Sequence[Tuple[float, float, int]], gap_dt_s: float, gap_dist_m: float,
+          gap_vel_ms: float) -> Tuple[int, float]:
+    n, tempo = 0, 0.0
+    for a, b in zip(brutos, brutos[1:]):
+        dt = max(0, b[2] - a[2])
+        kx = M_POR_GRAU * math.cos(math.radians((a[1] + b[1]) / 2.0))
+        dist = math.hypot((b[0] - a[0]) * kx, (b[1] - a[1]) * M_POR_GRAU)
+        vel = dist / dt if dt > 0 else math.inf
+        if dt >= gap_dt_s or (dist >= gap_dist_m and vel >= gap_vel_ms):
+            n += 1
+            tempo += dt
+    return n, tempo
+
+
+def metricas_trilha(caminho: Sequence[Sequence[float]],
+                    brutos: Sequence[Tuple[float, float, int]],
+                    gap_dt_s: float,
+                    gap_dist_m: float,
+                    gap_vel_ms: float) -> Dict[str, Any]:
+    """Quality of a final path against the raw points it was built from."""
+    n_gaps, tempo_gaps = _gaps(brutos, gap_dt_s, gap_dist_m, gap_vel_ms)
+    props: Dict[str, Any] = {
+        "total_route_length_m": round(comprimento_m(caminho), 1),
+        "number_of_gaps": n_gaps,
+        "total_gap_time_s": tempo_gaps,
+    }
+    if not caminho or not brutos:
+        return props
+    grade = GradeSegmentos(caminho)
+    desvios = [grade.distancia(p[0], p[1]) for p in brutos]
+    props.update(
+        matched_ratio=round(sum(1 for d in desvios if d <= METRICAS_RAIO_MATCH_M) / len(desvios), 4),
+        mean_distance_raw_to_matched_m=round(sum(desvios) / len(desvios), 2),
+        max_distance_raw_to_matched_m=round(max(desvios), 2),
+    )
+    return props
+
+
+def ler_propriedades(path: Path) -> Optional[Dict[str, Any]]:
+    """Properties of the stitched line of a saved output, without touching the geometry."""
+    abrir = gzip.open if path.name.endswith(".gz") else open
+    with abrir(path, "rt", encoding="utf-8") as f:
+        if ".ndjson" in path.name:
+            feats = (json.loads(linha) for linha in f if linha.strip())
+        else:
+            data = json.load(f)
+            feats = (data.get("features") or []) if isinstance(data, dict) else []
+        for feat in feats:
+            props = (feat or {}).get("properties") or {}
+            if props.get("stitched"):
+                return props
+    return None
+
+
+def alertas(props: Dict[str, Any], min_ratio: float = SANIDADE_MIN_RATIO,
+            max_desvio_m: float = SANIDADE_MAX_DESVIO_M) -> List[str]:
+    out: List[str] = []
+    ratio = props.get("matched_ratio")
+    desvio = props.get("max_distance_raw_to_matched_m")
+    if ratio is None or desvio is None:
+        return ["sem metricas de qualidade"]
+    if ratio < min_ratio:
+        out.append(f"matched_ratio {ratio:.3f} < {min_ratio}")
+    if desvio > max_desvio_m:
+        out.append(f"desvio maximo {desvio:.1f} m > {max_desvio_m} m")
+    return out
+
+
+def main():
+    """
+    Sanity check of processed outputs, from the metrics already stored in them.
+
+    --min-ratio=<r>     alert below this matched_ratio (default 0.8)
+    --max-desvio=<m>    alert above this max raw->matched deviation (default 30 m)
+
+    Exits with status 1 if any file raised an alert.
+    """
+    min_ratio, max_desvio = SANIDADE_MIN_RATIO, SANIDADE_MAX_DESVIO_M
+    arquivos: List[Path] = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--min-ratio="):
+            min_ratio = float(arg.split("=", 1)[1])
+        elif arg.startswith("--max-desvio="):
+            max_desvio = float(arg.split("=", 1)[1])
+        elif arg.startswith("--"):
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+        else:
+            arquivos.append(Path(arg))
+    if not arquivos:
+        raise SystemExit("Uso: python metricas_qualidade.py [--min-ratio=] [--max-desvio=] saida1.json ...")
+
+    com_alerta = 0
+    for path in arquivos:
+        try:
+            props = ler_propriedades(path)
+        except Exception as e:
+            print(f"ERRO   {path}: {e}")
+            com_alerta += 1
+            continue
+        avisos = alertas(props or {}, min_ratio, max_desvio)
+        if avisos:
+            com_alerta += 1
+            print(f"ALERTA {path}: {'; '.join(avisos)}")
+        else:
+            print(f"OK     {path}: matched_ratio {props['matched_ratio']:.3f}, "
+                  f"desvio max {props['max_distance_raw_to_matched_m']:.1f} m")
+    print(f"\n{len(arquivos) - com_alerta}/{len(arquivos)} sem alertas.")
+    if com_alerta:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
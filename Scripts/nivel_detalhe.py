@@ -0,0 +1,147 @@
+import math
+from typing import Any, List, Optional, Sequence
+
+from saida_rotas import encode_polyline
+
+# Level of detail for route geometries sent to map clients.
+M_POR_GRAU = 111000.0
+M_POR_PIXEL_Z0 = 156543.03392  # 256 px tiles, at the equator
+PIXELS_TOLERANCIA = 1.0
+DELTA_PRECISAO = 6
+
+Linha = List[List[float]]
+
+
+def tolerancia_zoom(zoom: float, lat: float) -> float:
+    """Metres covered by PIXELS_TOLERANCIA screen pixels at ``zoom``."""
+    return PIXELS_TOLERANCIA * M_POR_PIXEL_Z0 * math.cos(math.radians(lat)) / (2.0 ** zoom)
+
+
+def simplificar(coords: Sequence[Sequence[float]], tol_m: float) -> Linha:
+    """Douglas-Peucker with a tolerance in metres (iterative, endpoints kept)."""
+    n = len(coords)
+    if n <= 2 or tol_m <= 0:
+        return [list(c[:2]) for c in coords]
+    lat_ref = sum(c[1] for c in coords) / n
+    kx = M_POR_GRAU * math.cos(math.radians(lat_ref))
+    xs = [c[0] * kx for c in coords]
+    ys = [c[1] * M_POR_GRAU for c in coords]
+    manter = [False] * n
+    manter[0] = manter[-1] = True
+    tol2 = tol_m * tol_m
+    pilha = [(0, n - 1)]
+    while pilha:
+        a, b = pilha.pop()
+        if b - a < 2:
+            continue
+        ax, ay = xs[a], ys[a]
+        dx, dy = xs[b] - ax, ys[b] - ay
+        den = dx * dx + dy * dy
+        idx, maxd2 = a, -1.0
+        for i in range(a + 1, b):
+            ex, ey = xs[i] - ax, ys[i] - ay
+            if den == 0:
+                d2 = ex * ex + ey * ey
+            else:
+                cruz = ex * dy - ey * dx
+                d2 = cruz * cruz / den
+            if d2 > maxd2:
+                idx, maxd2 = i, d2
+        if maxd2 > tol2:
+            manter[idx] = True
+            pilha.append((a, idx))
+            pilha.append((idx, b))
+    return [list(coords[i][:2]) for i in range(n) if manter[i]]
+
+
+def _recortar_segmento(x0: float, y0: float, x1: float, y1: float, bbox: Sequence[float]):
+    """Liang-Barsky: the part of the segment inside ``bbox`` as (t0, t1), or None."""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x1 - x0, y1 - y0
+    for p, q in ((-dx, x0 - bbox[0]), (dx, bbox[2] - x0), (-dy, y0 - bbox[1]), (dy, bbox[3] - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        r = q / p
+        if p < 0:
+            if r > t1:
+                return None
+            t0 = max(t0, r)
+        else:
+            if r < t0:
+                return None
+            t1 = min(t1, r)
+    return t0, t1
+
+
+def recortar_bbox(coords: Sequence[Sequence[float]], bbox: Sequence[float]) -> List[Linha]:
+    """Pieces of a line inside [min_lon, min_lat, max_lon, max_lat]."""
+    partes: List[Linha] = []
+    atual: Linha = []
+    for a, b in zip(coords, coords[1:]):
+        corte = _recortar_segmento(a[0], a[1], b[0], b[1], bbox)
+        if corte is None:
+            if atual:
+                partes.append(atual)
+                atual = []
+            continue
+        t0, t1 = corte
+        ini = [a[0] + (b[0] - a[0]) * t0, a[1] + (b[1] - a[1]) * t0]
+        fim = [a[0] + (b[0] - a[0]) * t1, a[1] + (b[1] - a[1]) * t1]
+        if not atual:
+            atual = [ini]
+        atual.append(fim)
+        if t1 < 1.0:
+            partes.append(atual)
+            atual = []
+    if atual:
+        partes.append(atual)
+    if len(coords) == 1 and bbox[0] <= coords[0][0] <= bbox[2] and bbox[1] <= coords[0][1] <= bbox[3]:
+        partes.append([list(coords[0][:2])])
+    return partes
+
+
+def codificar_delta(linha: Sequence[Sequence[float]], precisao: int = DELTA_PRECISAO) -> List[int]:
+    """Flat [lon0, lat0, dlon1, dlat1, ...] as integers scaled by 10**precisao."""
+    fator = 10 ** precisao
+    out: List[int] = []
+    plon = plat = 0
+    for c in linha:
+        ilon, ilat = int(round(c[0] * fator)), int(round(c[1] * fator))
+        out.append(ilon - plon)
+        out.append(ilat - plat)
+        plon, plat = ilon, ilat
+    return out
+
+
+def reduzir(coords: Sequence[Sequence[float]],
+            tol_m: Optional[float] = None,
+            zoom: Optional[float] = None,
+            bbox: Optional[Sequence[float]] = None) -> List[Linha]:
+    """Clip a [lon, lat] line to ``bbox`` and simplify each resulting piece."""
+    partes: List[Linha] = recortar_bbox(coords, bbox) if bbox else [[list(c[:2]) for c in coords]]
+    if tol_m is None and zoom is not None and coords:
+        tol_m = tolerancia_zoom(zoom, sum(c[1] for c in coords) / len(coords))
+    if tol_m:
+        partes = [simplificar(p, tol_m) for p in partes]
+    return partes
+
+
+def codificar(partes: List[Linha], formato: str) -> Any:
+    """
+    ``formato`` is geojson (LineString, or MultiLineString when the clip
+    split the line), polyline / polyline6 (a string, or a list of strings
+    for several pieces) or delta.
+    """
+    if formato in ("polyline", "polyline6"):
+        precisao = 6 if formato == "polyline6" else 5
+        codificadas = [encode_polyline([(c[1], c[0]) for c in p], precisao) for p in partes]
+        return codificadas[0] if len(codificadas) == 1 else codificadas
+    if formato == "delta":
+        return {"type": "delta", "precision": DELTA_PRECISAO, "coordinates": [codificar_delta(p) for p in partes]}
+    if len(partes) == 1:
+        return {"type": "LineString", "coordinates": partes[0]}
+    if not partes:
+        return {"type": "LineString", "coordinates": []}
+    return {"type": "MultiLineString", "coordinates": partes}
@@ -0,0 +1,265 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from cliente_backend import http_post_json_async, prazo_curto, prazo_excedido, prazo_trilha
+from hints_osrm import osrm_get_json_async
+from instrumentacao import atual, medir_trilha
+from processador_rotas_unificado import (
+    DEDUP_EPS_M,
+    DP_TOL_DEFAULT,
+    GAPS_MODE,
+    HEDGE_ENABLE,
+    OSRM_HOST_DEFAULT,
+    OVERVIEW_MODE,
+    ROTA_CACHE_NS,
+    VALHALLA_HOST_DEFAULT,
+    _anexar_coords,
+    _atraso_hedge,
+    _coords_matchings,
+    _coords_trace_route,
+    _costurar_chegada,
+    _distancia_chegada,
+    _guardar_rota,
+    _montar_geojson,
+    _payload_trace_route,
+    _prazo_hedge,
+    _propriedades_segmentos,
+    _registrar_latencia_valhalla,
+    _rota_em_cache,
+    _segmentos_por_regiao,
+    _simplificar_segmento,
+    _suavizar_caminho,
+    chave_rota,
+    dedupe_por_raio,
+    montar_url_match,
+    ordenar_por_ts,
+    split_by_fence,
+    url_rota,
+)
+from regioes_osrm import host_para
+
+
+async def call_route_async(start_coord: Tuple[float,float], end_coord: Tuple[float,float], host: str,
+                           client=None) -> List[List[float]]:
+    pontos = [start_coord, end_coord]
+    chave = chave_rota(pontos)
+    cached = _rota_em_cache(ROTA_CACHE_NS, chave, host)
+    if cached:
+        return cached
+    try:
+        rj = await osrm_get_json_async(url_rota(host, pontos), pontos, host, timeout=30, client=client)
+        return _guardar_rota(ROTA_CACHE_NS, chave, host, rj)
+    except Exception as e:
+        print(f"Falha ao chamar /route: {e}")
+    return []
+
+
+async def call_valhalla_trace_route_async(points: List[Tuple[float,float,int]], host: str,
+                                          client=None) -> List[List[float]]:
+    if not points or len(points) < 2:
+        return []
+    url = f"{host.rstrip('/')}/trace_route"
+    try:
+        data = await http_post_json_async(url, _payload_trace_route(points), timeout=60, engine="valhalla", client=client)
+    except Exception as e:
+        print(f"Falha Valhalla: {e}")
+        return []
+    return _coords_trace_route(data)
+
+
+async def _match_osrm_segmento_async(segmento: List[Tuple[float,float,int]],
+                                    osrm_host: str,
+                                    overview: str,
+                                    gaps: str,
+                                    client=None) -> List[List[float]]:
+    if len(segmento) > 1:
+        try:
+            url_match = montar_url_match(segmento, osrm_host, overview, gaps)
+            data = await osrm_get_json_async(url_match, segmento, osrm_host, timeout=60, client=client)
+            out = _coords_matchings(data)
+            if out:
+                return out
+        except Exception as e:
+            print(f"Falha /match OSRM: {e}")
+    return []
+
+
+async def _valhalla_medido_async(segmento: List[Tuple[float,float,int]], valhalla_host: str,
+                                 client=None) -> List[List[float]]:
+    t0 = time.perf_counter()
+    coords = await call_valhalla_trace_route_async(segmento, valhalla_host, client)
+    if coords:
+        _registrar_latencia_valhalla(time.perf_counter() - t0)
+    return coords
+
+
+async def _process_segment_hedged_async(segmento: List[Tuple[float,float,int]],
+                                        osrm_host: str,
+                                        valhalla_host: str,
+                                        overview: str,
+                                        gaps: str,
+                                        client=None) -> Tuple[List[List[float]], str]:
+    med = atual()
+    prazo = _prazo_hedge()
+    limite = time.monotonic() + prazo
+    tarefas = {asyncio.ensure_future(_valhalla_medido_async(segmento, valhalla_host, client)): "valhalla"}
+    done, _ = await asyncio.wait(tarefas, timeout=min(_atraso_hedge(), prazo))
+    for t in done:
+        if t.result():
+            med.contar("hedge_vencedor_valhalla")
+            return t.result(), "valhalla"
+    med.contar("hedge_disparado")
+    tarefas[asyncio.ensure_future(_match_osrm_segmento_async(segmento, osrm_host, overview, gaps, client))] = "osrm"
+    pendentes = {t for t in tarefas if t not in done}
+    try:
+        while pendentes:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                med.contar("hedge_deadline")
+                break
+            done, pendentes = await asyncio.wait(pendentes, timeout=restante, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                coords = t.result()
+                if coords:
+                    med.contar(f"hedge_vencedor_{tarefas[t]}")
+                    return coords, tarefas[t]
+    finally:
+        for perdedor in pendentes:
+            perdedor.cancel()
+    return [], ""
+
+
+async def _process_segment_com_engine_async(segmento: List[Tuple[float,float,int]],
+                                            engine: str,
+                                            osrm_host: str,
+                                            valhalla_host: str,
+                                            overview: str,
+                                            gaps: str,
+                                            hedge: bool = False,
+                                            client=None) -> Tuple[List[List[float]], str]:
+    med = atual()
+    if engine == "valhalla" and hedge:
+        with med.etapa("match_valhalla"):
+            return await _process_segment_hedged_async(segmento, osrm_host, valhalla_host, overview, gaps, client)
+    if engine == "valhalla":
+        with med.etapa("match_valhalla"):
+            coords = await call_valhalla_trace_route_async(segmento, valhalla_host, client)
+        if coords:
+            return coords, "valhalla"
+        med.contar("fallback_valhalla_para_osrm")
+    with med.etapa("match_osrm"):
+        coords = await _match_osrm_segmento_async(segmento, osrm_host, overview, gaps, client)
+    return coords, ("osrm" if coords else "")
+
+
+async def _processar_segmento_async(engine: str, seg: List[Tuple[float,float,int]], host: str, dp_tol: float,
+                                    overview: str, gaps: str, valhalla_host: str, hedge: bool,
+                                    client) -> Tuple[List[List[float]], str]:
+    med = atual()
+    with med.etapa("douglas_peucker"):
+        seg_proc = _simplificar_segmento(seg, dp_tol)
+    coords, usado = await _process_segment_com_engine_async(
+        seg_proc, engine, host, valhalla_host, overview, gaps, hedge, client
+    )
+    if not coords and len(seg_proc) >= 2:
+        lon0, lat0, _ = seg_proc[0]
+        lon1, lat1, _ = seg_proc[-1]
+        with med.etapa("route_bridge"):
+            bridge = await call_route_async((lon0, lat0), (lon1, lat1), host, client)
+        if bridge:
+            med.contar("fallback_route")
+            coords, usado = bridge, "route"
+        else:
+            med.contar("fallback_raw")
+            coords, usado = [[lon, lat] for lon, lat, _ in seg_proc], "raw"
+    return coords, usado
+
+
+async def _processar_uma_trilha_async(
+    pontos_brutos: List[Tuple[float, float, int]],
+    host: str,
+    dp_tol: float,
+    eps_m: float,
+    overview: str,
+    gaps: str,
+    valhalla_host: str,
+    fence_poly: Optional[list[list[float]]],
+    hedge: bool,
+    client,
+) -> Tuple[Dict[str, Any], str, bool]:
+    if not pontos_brutos or len(pontos_brutos) < 2:
+        return None, "Nenhum ponto valido para processar.", False
+
+    med = atual()
+    with med.etapa("ordenar"):
+        ordenados = ordenar_por_ts(pontos_brutos)
+    with med.etapa("dedup"):
+        dedup = dedupe_por_raio(ordenados, eps_m)
+    with med.etapa("split_fence"):
+        engine_segments = _segmentos_por_regiao(split_by_fence(dedup, fence_poly), host)
+
+    resultados = await asyncio.gather(*[
+        _processar_segmento_async(engine, seg, host_seg, dp_tol, overview, gaps, valhalla_host, hedge, client)
+        for engine, host_seg, seg in engine_segments
+    ])
+    final_path: List[List[float]] = []
+    segment_engines: List[str] = []
+    for coords, usado in resultados:
+        segment_engines.append(usado)
+        _anexar_coords(final_path, coords)
+
+    if not final_path:
+        return None, "Nenhuma rota valida encontrada.", False
+    with med.etapa("tail_stitch"):
+        try:
+            last_raw = ordenados[-1]
+            d_tail = _distancia_chegada(final_path, last_raw)
+            bridging_route: List[List[float]] = []
+            if d_tail > 30.0 and not prazo_curto():
+                last_coord = final_path[-1]
+                bridging_route = await call_route_async((last_coord[0], last_coord[1]), (last_raw[0], last_raw[1]),
+                                                        host_para(last_raw[0], last_raw[1], host), client)
+            _costurar_chegada(final_path, last_raw, bridging_route, d_tail)
+        except Exception as e:
+            print(f"Falha ao costurar chegada: {e}")
+            if final_path and final_path[-1] != [ordenados[-1][0], ordenados[-1][1]]:
+                final_path.append([ordenados[-1][0], ordenados[-1][1]])
+    final_path = _suavizar_caminho(final_path)
+    props = _propriedades_segmentos(segment_engines, engine_segments)
+    if prazo_excedido():
+        props["deadline_exceeded"] = True
+    return _montar_geojson(final_path, ordenados, props)
+
+
+async def processar_uma_trilha_async(
+    pontos_brutos: List[Tuple[float, float, int]],
+    host: str = OSRM_HOST_DEFAULT,
+    dp_tol: float = DP_TOL_DEFAULT,
+    eps_m: float = DEDUP_EPS_M,
+    overview: str = OVERVIEW_MODE,
+    gaps: str = GAPS_MODE,
+    valhalla_host: str = VALHALLA_HOST_DEFAULT,
+    fence_poly: Optional[list[list[float]]] = None,
+    timings: bool = False,
+    medir: Optional[bool] = None,
+    hedge: bool = HEDGE_ENABLE,
+    client=None,
+    deadline_s: Optional[float] = None,
+) -> Tuple[Dict[str, Any], str, bool]:
+    """
+    Asynchronous counterpart of processador_rotas_unificado.processar_uma_trilha.
+
+    Same stages and same output; the segments of a track are matched
+    concurrently and every network wait yields to the event loop, so many
+    tracks can be processed at once in a single process (e.g. the proxy).
+    """
+    with medir_trilha(medir, osrm_host=host, valhalla_host=valhalla_host) as med, prazo_trilha(deadline_s):
+        with med.etapa("total"):
+            geojson_final, msg, ok = await _processar_uma_trilha_async(
+                pontos_brutos, host, dp_tol, eps_m, overview, gaps, valhalla_host, fence_poly, hedge, client
+            )
+        med.emitir(ok=ok, pontos=len(pontos_brutos or []), modo="async")
+        if ok and timings and med.ativo:
+            geojson_final["features"][0]["properties"]["timings"] = med.resumo()
+    return geojson_final, msg, ok
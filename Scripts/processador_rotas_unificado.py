@@ -2,11 +2,25 @@
 import json
 import sys
 import math
-import requests
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
 from typing import List, Tuple, Dict, Any, Optional
-import hashlib
+
+from cache_rotas import cache_get, cache_set, chave_canonica, registrar_acesso
+from checkpoint_rotas import chave_parametros, processar_incremental, trilha_id_de
+from cliente_backend import http_post_json, prazo_curto, prazo_excedido, prazo_restante, prazo_trilha
+from entrada_pontos import extrair_pontos
+from hints_osrm import osrm_get_json
+from instrumentacao import atual, medir_trilha
+from metricas_qualidade import metricas_trilha
+from regioes_osrm import carregar_registro, dividir_por_regiao, host_para, registro
+from saida_rotas import FORMATOS, escrever_saidas
+from upstream_osrm import dataset_de
 
 OSRM_HOST_DEFAULT = "http://127.0.0.1:5001"
 VALHALLA_HOST_DEFAULT = "http://127.0.0.1:8002"
@@ -41,29 +55,39 @@ FENCE_POLYGON_DEFAULT: Optional[list[list[float]]] = [
     [-46.836199, -23.507503],
     [-46.837352, -23.507503],
 ]
-CACHE_DIR = Path.home() / ".cache" / "erictech_routing"
-try:
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-except Exception:
-    pass
-
-def _cache_get_json(key: str) -> Any:
-    path = CACHE_DIR / f"{key}.json"
-    try:
-        if path.exists():
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return None
-
-def _cache_set_json(key: str, value: Any) -> None:
-    path = CACHE_DIR / f"{key}.json"
-    try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(value, f, ensure_ascii=False)
-    except Exception:
-        pass
+HEDGE_ENABLE: bool = False
+HEDGE_PERCENTIL: float = 90.0
+HEDGE_DELAY_DEFAULT_S: float = 3.0
+HEDGE_DELAY_MIN_S: float = 0.25
+HEDGE_MIN_AMOSTRAS: int = 20
+HEDGE_DEADLINE_S: float = 60.0
+HEDGE_WORKERS: int = 16
+PONTES_WORKERS: int = 8
+
+ROTA_CACHE_NS = "osrm_route"
+ROTA_MULTI_CACHE_NS = "osrm_route_multi"
+ROTA_PARAMS: Dict[str, str] = {"geometries": "geojson", "overview": "full", "continue_straight": "true"}
+
+def url_rota(host: str, coords: List[Tuple[float,float]]) -> str:
+    coords_str = ";".join(f"{lon},{lat}" for lon, lat in coords)
+    return f"{host}/route/v1/driving/{coords_str}?{urlencode(ROTA_PARAMS)}"
+
+def chave_rota(coords: List[Tuple[float,float]]) -> str:
+    return chave_canonica("route", coords, ROTA_PARAMS)
+
+def _rota_em_cache(namespace: str, chave: str, host: str) -> Optional[List[List[float]]]:
+    entry = cache_get(namespace, chave, dataset_de(host))
+    acerto = entry is not None and bool(entry.get("value"))
+    registrar_acesso(namespace, acerto)
+    atual().contar("cache_hits" if acerto else "cache_misses")
+    atual().contar(f"{'cache_hits' if acerto else 'cache_misses'}.{namespace}")
+    return entry["value"] if acerto else None
+
+def _guardar_rota(namespace: str, chave: str, host: str, rj: Dict[str, Any]) -> List[List[float]]:
+    coords = rj["routes"][0]["geometry"]["coordinates"] if rj.get("routes") else []
+    if coords:
+        cache_set(namespace, chave, dataset_de(host), coords)
+    return coords
 
 def distancia_m(lon1, lat1, lon2, lat2):
     mean_lat = math.radians((lat1 + lat2) / 2.0)
@@ -104,99 +128,6 @@ def douglas_peucker(points: List[Tuple[float,float,int]], tol_deg: float) -> Lis
     else:
         return [start, end]
 
-def extrair_pontos(data) -> List[Tuple[float,float,int]]:
-    pts: List[Tuple[float,float,int]] = []
-
-    try:
-        rota = data.get("track", {}).get("route", [])
-        if isinstance(rota, list) and rota:
-            for p in rota:
-                if isinstance(p, (list, tuple)) and len(p) >= 3:
-                    ts = int(round(float(p[0])))
-                    if ts > 1e12:
-                        ts = int(ts/1000)
-                    lat_val = float(p[1]); lon_val = float(p[2])
-                    if abs(lat_val) > 90 and abs(lon_val) <= 90:
-                        lat_val, lon_val = lon_val, lat_val
-                    pts.append((lon_val, lat_val, int(ts)))
-            if pts:
-                return pts
-    except Exception:
-        pass
-
-    try:
-        if data.get("type") == "FeatureCollection" and isinstance(data.get("features"), list):
-            for feat in data["features"]:
-                geom = (feat or {}).get("geometry") or {}
-                if geom.get("type") == "LineString" and isinstance(geom.get("coordinates"), list):
-                    ts = 0
-                    out = []
-                    for c in geom["coordinates"]:
-                        if isinstance(c, (list, tuple)) and len(c) >= 2:
-                            lon_val = float(c[0]); lat_val = float(c[1])
-                            out.append((lon_val, lat_val, ts))
-                            ts += 1
-                    if out:
-                        return out
-            for feat in data["features"]:
-                geom = (feat or {}).get("geometry") or {}
-                if geom.get("type") == "MultiLineString":
-                    ts = 0
-                    out = []
-                    for line in geom.get("coordinates", []):
-                        for c in line:
-                            if isinstance(c, (list, tuple)) and len(c) >= 2:
-                                lon_val = float(c[0]); lat_val = float(c[1])
-                                out.append((lon_val, lat_val, ts))
-                                ts += 1
-                    if out:
-                        return out
-    except Exception:
-        pass
-
-    if isinstance(data, list) and data:
-        try:
-            out = []
-            ts_counter = 0
-            for row in data:
-                if isinstance(row, (list, tuple)):
-                    if len(row) >= 3 and isinstance(row[1], (int, float)) and isinstance(row[2], (int, float)):
-                        ts = int(round(float(row[0])))
-                        if ts > 1e12:
-                            ts = int(ts/1000)
-                        lat_val = float(row[1]); lon_val = float(row[2])
-                        out.append((lon_val, lat_val, ts))
-                    elif len(row) >= 2 and isinstance(row[0], (int, float)) and isinstance(row[1], (int, float)):
-                        lat_val = float(row[0]); lon_val = float(row[1])
-                        out.append((lon_val, lat_val, ts_counter))
-                        ts_counter += 1
-            if out:
-                return out
-        except Exception:
-            pass
-
-    if isinstance(data, list) and data and all(isinstance(x, dict) for x in data):
-        out = []
-        ts_counter = 0
-        for p in data:
-            if "lat" in p and "lon" in p:
-                lat_val = float(p["lat"]); lon_val = float(p["lon"])
-                if "time" in p:
-                    try:
-                        ts = int(round(float(p["time"])))
-                        if ts > 1e12:
-                            ts = int(ts/1000)
-                    except Exception:
-                        ts = ts_counter
-                else:
-                    ts = ts_counter
-                out.append((lon_val, lat_val, ts))
-                ts_counter = max(ts_counter+1, ts+1)
-        if out:
-            return out
-
-    return []
-
 def ordenar_por_ts(pontos: List[Tuple[float,float,int]]) -> List[Tuple[float,float,int]]:
     pts = sorted(pontos, key=lambda x: x[2])
     out, last = [], None
@@ -252,24 +183,14 @@ def montar_url_match(pts: List[Tuple[float,float,int]], host: str, overview: str
     return f"{host}/match/v1/driving/{quote(coords, safe=';,')}?{qs}"
 
 def call_route(start_coord: Tuple[float,float], end_coord: Tuple[float,float], host: str) -> List[List[float]]:
-    coords_str = f"{start_coord[0]},{start_coord[1]};{end_coord[0]},{end_coord[1]}"
-    url_route = f"{host}/route/v1/driving/{coords_str}?geometries=geojson&overview=full&continue_straight=true"
-    cache_key = "osrm_route_" + hashlib.md5(url_route.encode()).hexdigest()
-    cached = _cache_get_json(cache_key)
+    pontos = [start_coord, end_coord]
+    chave = chave_rota(pontos)
+    cached = _rota_em_cache(ROTA_CACHE_NS, chave, host)
     if cached:
-        try:
-            routes = cached.get("routes") or []
-            if routes and routes[0].get("geometry", {}).get("coordinates"):
-                return routes[0]["geometry"]["coordinates"]
-        except Exception:
-            pass
+        return cached
     try:
-        r = requests.get(url_route, timeout=30)
-        r.raise_for_status()
-        rj = r.json()
-        _cache_set_json(cache_key, rj)
-        if rj.get("routes") and rj["routes"][0]["geometry"]["coordinates"]:
-            return rj["routes"][0]["geometry"]["coordinates"]
+        rj = osrm_get_json(url_rota(host, pontos), pontos, host, timeout=30)
+        return _guardar_rota(ROTA_CACHE_NS, chave, host, rj)
     except Exception as e:
         print(f"Falha ao chamar /route: {e}")
     return []
@@ -277,52 +198,72 @@ def call_route(start_coord: Tuple[float,float], end_coord: Tuple[float,float], h
 def call_route_multi(points: List[Tuple[float,float]], host: str) -> List[List[float]]:
     if not points or len(points) < 2:
         return []
-    coords_str = ";".join(f"{lon},{lat}" for lon, lat in points)
-    url = f"{host}/route/v1/driving/{coords_str}?geometries=geojson&overview=full&continue_straight=true"
-    cache_key = "osrm_route_multi_" + hashlib.md5(url.encode()).hexdigest()
-    cached = _cache_get_json(cache_key)
+    chave = chave_rota(points)
+    cached = _rota_em_cache(ROTA_MULTI_CACHE_NS, chave, host)
     if cached:
-        try:
-            routes = cached.get("routes") or []
-            if routes and routes[0].get("geometry", {}).get("coordinates"):
-                return routes[0]["geometry"]["coordinates"]
-        except Exception:
-            pass
+        return cached
     try:
-        r = requests.get(url, timeout=60)
-        r.raise_for_status()
-        rj = r.json()
-        _cache_set_json(cache_key, rj)
-        if rj.get("routes") and rj["routes"][0]["geometry"]["coordinates"]:
-            return rj["routes"][0]["geometry"]["coordinates"]
+        rj = osrm_get_json(url_rota(host, points), points, host, timeout=60)
+        return _guardar_rota(ROTA_MULTI_CACHE_NS, chave, host, rj)
     except Exception as e:
         print(f"Falha ao chamar /route multi: {e}")
     return []
 
+_pontes_pool: Optional[ThreadPoolExecutor] = None
+
+Ponte = Tuple[str, Tuple[float,float], Tuple[float,float]]
+
+def _submeter_ponte(fn, *args):
+    global _pontes_pool
+    if _pontes_pool is None:
+        _pontes_pool = ThreadPoolExecutor(max_workers=PONTES_WORKERS, thread_name_prefix="ponte")
+    return _pontes_pool.submit(contextvars.copy_context().run, fn, *args)
+
+def resolver_pontes(pares: List[Ponte]) -> Dict[Ponte, List[List[float]]]:
+    """
+    Resolve every /route bridge of a track at once.
+
+    Each bridge is (host, origin, destination).  Identical bridges are
+    requested only once and the unique ones go out concurrently.
+    """
+    med = atual()
+    unicos = list(dict.fromkeys(pares))
+    if not unicos:
+        return {}
+    med.contar("pontes", len(pares))
+    med.contar("pontes_unicas", len(unicos))
+    with med.etapa("route_bridge"):
+        futuros = [_submeter_ponte(call_route, origem, destino, host) for host, origem, destino in unicos]
+        rotas = [f.result() for f in futuros]
+    return dict(zip(unicos, rotas))
+
 def _valhalla_post_json(url: str, payload: dict) -> Optional[dict]:
     try:
-        r = requests.post(url, json=payload, timeout=60)
-        r.raise_for_status()
-        return r.json()
+        return http_post_json(url, payload, timeout=60, engine="valhalla")
     except Exception as e:
         print(f"Falha Valhalla: {e}")
         return None
 
-def call_valhalla_trace_route(points: List[Tuple[float,float,int]], host: str) -> List[List[float]]:
-    if not points or len(points) < 2:
-        return []
+def _payload_trace_route(points: List[Tuple[float,float,int]]) -> Dict[str, Any]:
     shape = []
     for lon, lat, ts in points:
         shape.append({"lat": lat, "lon": lon, "time": int(ts) if ts is not None else 0})
-    payload = {
+    return {
         "shape": shape,
         "costing": "auto",
         "shape_match": "map_snap",
         "use_timestamps": True,
         "format": "geojson"
     }
+
+def call_valhalla_trace_route(points: List[Tuple[float,float,int]], host: str) -> List[List[float]]:
+    if not points or len(points) < 2:
+        return []
     url = f"{host.rstrip('/')}/trace_route"
-    data = _valhalla_post_json(url, payload)
+    data = _valhalla_post_json(url, _payload_trace_route(points))
+    return _coords_trace_route(data)
+
+def _coords_trace_route(data: Optional[dict]) -> List[List[float]]:
     if not data:
         return []
     try:
@@ -391,35 +332,157 @@ def split_by_fence(pontos_ordenados: List[Tuple[float,float,int]],
         out.append((cur_engine, cur_seg))
     return out
 
-def _process_segment_by_engine(segmento: List[Tuple[float,float,int]],
-                               engine: str,
-                               osrm_host: str,
-                               valhalla_host: str,
-                               overview: str,
-                               gaps: str) -> List[List[float]]:
-    if engine == "valhalla":
-        coords = call_valhalla_trace_route(segmento, valhalla_host)
-        if coords:
-            return coords
+def _match_osrm_segmento(segmento: List[Tuple[float,float,int]],
+                         osrm_host: str,
+                         overview: str,
+                         gaps: str) -> List[List[float]]:
     if len(segmento) > 1:
         try:
             url_match = montar_url_match(segmento, osrm_host, overview, gaps)
-            resp = requests.get(url_match, timeout=60)
-            resp.raise_for_status()
-            data = resp.json()
-            matchings = data.get("matchings") or []
-            if matchings:
-                out = []
-                for m in matchings:
-                    geom = m.get("geometry") or {}
-                    if geom.get("type") == "LineString" and geom.get("coordinates"):
-                        out.extend([[c[0], c[1]] for c in geom["coordinates"]])
-                if out:
-                    return out
+            data = osrm_get_json(url_match, segmento, osrm_host, timeout=60)
+            out = _coords_matchings(data)
+            if out:
+                return out
         except Exception as e:
             print(f"Falha /match OSRM: {e}")
     return []
 
+_latencias_valhalla: deque = deque(maxlen=200)
+_latencias_lock = threading.Lock()
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_perdedores_lock = threading.Lock()
+_perdedores_em_voo = 0
+
+def _registrar_latencia_valhalla(dt: float) -> None:
+    with _latencias_lock:
+        _latencias_valhalla.append(dt)
+
+def _atraso_hedge() -> float:
+    with _latencias_lock:
+        amostras = sorted(_latencias_valhalla)
+    if len(amostras) < HEDGE_MIN_AMOSTRAS:
+        return HEDGE_DELAY_DEFAULT_S
+    idx = min(len(amostras) - 1, int(round(HEDGE_PERCENTIL / 100.0 * (len(amostras) - 1))))
+    return max(HEDGE_DELAY_MIN_S, amostras[idx])
+
+def _prazo_hedge() -> float:
+    restante = prazo_restante()
+    return HEDGE_DEADLINE_S if restante is None else max(0.0, min(HEDGE_DEADLINE_S, restante))
+
+def _valhalla_medido(segmento: List[Tuple[float,float,int]], valhalla_host: str) -> List[List[float]]:
+    t0 = time.perf_counter()
+    coords = call_valhalla_trace_route(segmento, valhalla_host)
+    if coords:
+        _registrar_latencia_valhalla(time.perf_counter() - t0)
+    return coords
+
+def _no_prazo(limite: float, fn, *args):
+    # Every backend call inside gets at most what is left of the hedge deadline,
+    # so a losing request ends with it instead of running its full timeout.
+    with prazo_trilha(max(0.001, limite - time.monotonic())):
+        return fn(*args)
+
+def _submeter(limite: float, fn, *args):
+    global _hedge_pool
+    if _hedge_pool is None:
+        _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+    return _hedge_pool.submit(contextvars.copy_context().run, _no_prazo, limite, fn, *args)
+
+def _perdedor_terminou(_f) -> None:
+    global _perdedores_em_voo
+    with _perdedores_lock:
+        _perdedores_em_voo -= 1
+
+def _abandonar(perdedores) -> None:
+    """Cancel the losing calls; those already running are counted until they finish."""
+    global _perdedores_em_voo
+    for f in perdedores:
+        if f.cancel():
+            continue
+        atual().contar("hedge_perdedor_em_voo")
+        with _perdedores_lock:
+            _perdedores_em_voo += 1
+        f.add_done_callback(_perdedor_terminou)
+
+def perdedores_hedge_em_voo() -> int:
+    return _perdedores_em_voo
+
+def _process_segment_hedged(segmento: List[Tuple[float,float,int]],
+                            osrm_host: str,
+                            valhalla_host: str,
+                            overview: str,
+                            gaps: str) -> Tuple[List[List[float]], str]:
+    med = atual()
+    prazo = _prazo_hedge()
+    limite = time.monotonic() + prazo
+    futuros = {_submeter(limite, _valhalla_medido, segmento, valhalla_host): "valhalla"}
+    done, _ = wait(futuros, timeout=min(_atraso_hedge(), prazo))
+    for f in done:
+        if f.result():
+            med.contar("hedge_vencedor_valhalla")
+            return f.result(), "valhalla"
+    if not done and _perdedores_em_voo >= HEDGE_WORKERS // 2:
+        # Half the pool is still busy with losing calls: a second request
+        # would only queue behind them, so wait for Valhalla alone.
+        med.contar("hedge_suprimido")
+        done, _ = wait(futuros, timeout=max(0.0, limite - time.monotonic()))
+        for f in done:
+            if f.result():
+                return f.result(), "valhalla"
+        _abandonar(set(futuros) - done)
+        return [], ""
+    med.contar("hedge_disparado")
+    futuros[_submeter(limite, _match_osrm_segmento, segmento, osrm_host, overview, gaps)] = "osrm"
+    pendentes = {f for f in futuros if f not in done}
+    while pendentes:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        done, pendentes = wait(pendentes, timeout=restante, return_when=FIRST_COMPLETED)
+        for f in done:
+            coords = f.result()
+            if coords:
+                _abandonar(pendentes)
+                med.contar(f"hedge_vencedor_{futuros[f]}")
+                return coords, futuros[f]
+    _abandonar(pendentes)
+    if pendentes:
+        med.contar("hedge_deadline")
+    return [], ""
+
+def _process_segment_com_engine(segmento: List[Tuple[float,float,int]],
+                                engine: str,
+                                osrm_host: str,
+                                valhalla_host: str,
+                                overview: str,
+                                gaps: str,
+                                hedge: bool = False) -> Tuple[List[List[float]], str]:
+    if engine == "valhalla" and hedge:
+        return _process_segment_hedged(segmento, osrm_host, valhalla_host, overview, gaps)
+    if engine == "valhalla":
+        coords = call_valhalla_trace_route(segmento, valhalla_host)
+        if coords:
+            return coords, "valhalla"
+        atual().contar("fallback_valhalla_para_osrm")
+    coords = _match_osrm_segmento(segmento, osrm_host, overview, gaps)
+    return coords, ("osrm" if coords else "")
+
+def _process_segment_by_engine(segmento: List[Tuple[float,float,int]],
+                               engine: str,
+                               osrm_host: str,
+                               valhalla_host: str,
+                               overview: str,
+                               gaps: str) -> List[List[float]]:
+    return _process_segment_com_engine(segmento, engine, osrm_host, valhalla_host, overview, gaps)[0]
+
+def _coords_matchings(data: dict) -> List[List[float]]:
+    out: List[List[float]] = []
+    for m in data.get("matchings") or []:
+        geom = m.get("geometry") or {}
+        if geom.get("type") == "LineString" and geom.get("coordinates"):
+            out.extend([[c[0], c[1]] for c in geom["coordinates"]])
+    return out
+
 def _smooth_and_densify(path: List[List[float]]) -> List[List[float]]:
     if not path:
         return path
@@ -503,73 +566,213 @@ def processar_uma_trilha(
     gaps: str = GAPS_MODE,
     valhalla_host: str = VALHALLA_HOST_DEFAULT,
     fence_poly: Optional[list[list[float]]] = None,
+    timings: bool = False,
+    medir: Optional[bool] = None,
+    hedge: bool = HEDGE_ENABLE,
+    track_id: Optional[str] = None,
+    deadline_s: Optional[float] = None,
+) -> Tuple[Dict[str, Any], str, bool]:
+    """
+    Match one track end to end.  With ``deadline_s`` every backend call gets
+    at most the time left of that budget, the arrival bridge and smoothing are
+    skipped when it runs short, and whatever was matched so far is returned
+    with ``deadline_exceeded`` in the line properties.
+    """
+    with medir_trilha(medir, osrm_host=host, valhalla_host=valhalla_host) as med, prazo_trilha(deadline_s):
+        with med.etapa("total"):
+            geojson_final, msg, ok = _processar_uma_trilha(
+                pontos_brutos, host, dp_tol, eps_m, overview, gaps, valhalla_host, fence_poly, hedge, track_id
+            )
+        med.emitir(ok=ok, pontos=len(pontos_brutos or []))
+        if ok and timings and med.ativo:
+            geojson_final["features"][0]["properties"]["timings"] = med.resumo()
+    return geojson_final, msg, ok
+
+def _processar_uma_trilha(
+    pontos_brutos: List[Tuple[float, float, int]],
+    host: str,
+    dp_tol: float,
+    eps_m: float,
+    overview: str,
+    gaps: str,
+    valhalla_host: str,
+    fence_poly: Optional[list[list[float]]],
+    hedge: bool = False,
+    track_id: Optional[str] = None,
 ) -> Tuple[Dict[str, Any], str, bool]:
     if not pontos_brutos or len(pontos_brutos) < 2:
         return None, "Nenhum ponto valido para processar.", False
 
-    ordenados = ordenar_por_ts(pontos_brutos)
-    dedup = dedupe_por_raio(ordenados, eps_m)
-    engine_segments = split_by_fence(dedup, fence_poly)
+    med = atual()
+    with med.etapa("ordenar"):
+        ordenados = ordenar_por_ts(pontos_brutos)
 
-    final_path: List[List[float]] = []
+    def caminho(pontos):
+        return _caminho_trilha(pontos, host, dp_tol, eps_m, overview, gaps, valhalla_host, fence_poly, hedge)
 
-    for engine, seg in engine_segments:
-        if len(seg) >= 10:
-            seg_proc = douglas_peucker(seg, dp_tol)
-        else:
-            seg_proc = seg[:]
-
-        coords = _process_segment_by_engine(seg_proc, engine, host, valhalla_host, overview, gaps)
+    if track_id:
+        params = chave_parametros(variante="valhalla", host=host, dataset=dataset_de(host), dp=dp_tol, eps=eps_m,
+                                  overview=overview, gaps=gaps, valhalla_host=valhalla_host, fence=fence_poly)
+        final_path, props = processar_incremental(track_id, params, ordenados, caminho, _suavizar_caminho)
+    else:
+        final_path, props = caminho(ordenados)
+        final_path = _suavizar_caminho(final_path) if final_path else final_path
+    if not final_path:
+        return None, "Nenhuma rota valida encontrada.", False
+    if prazo_excedido():
+        props = dict(props, deadline_exceeded=True)
+    return _montar_geojson(final_path, ordenados, props)
+
+def _caminho_trilha(
+    ordenados: List[Tuple[float, float, int]],
+    host: str,
+    dp_tol: float,
+    eps_m: float,
+    overview: str,
+    gaps: str,
+    valhalla_host: str,
+    fence_poly: Optional[list[list[float]]],
+    hedge: bool,
+) -> Tuple[Optional[List[List[float]]], Dict[str, Any]]:
+    med = atual()
+    with med.etapa("dedup"):
+        dedup = dedupe_por_raio(ordenados, eps_m)
+    with med.etapa("split_fence"):
+        engine_segments = _segmentos_por_regiao(split_by_fence(dedup, fence_poly), host)
+
+    # Match every segment; the ones that fail get a /route bridge, resolved below in one batch.
+    pedacos: List[List[List[float]]] = []
+    segment_engines: List[str] = []
+    pendentes: List[Tuple[int, List[Tuple[float,float,int]], Ponte]] = []
+    for engine, host_seg, seg in engine_segments:
+        with med.etapa("douglas_peucker"):
+            seg_proc = _simplificar_segmento(seg, dp_tol)
+
+        with med.etapa(f"match_{engine}"):
+            coords, usado = _process_segment_com_engine(seg_proc, engine, host_seg, valhalla_host, overview, gaps, hedge)
 
         if not coords and len(seg_proc) >= 2:
             lon0, lat0, _ = seg_proc[0]
             lon1, lat1, _ = seg_proc[-1]
-            bridge = call_route((lon0, lat0), (lon1, lat1), host)
-            if bridge:
-                coords = bridge
-            else:
-                coords = [[lon, lat] for lon, lat, _ in seg_proc]
-        for c in coords:
-            if final_path and final_path[-1] == c:
-                continue
-            final_path.append(c)
+            pendentes.append((len(pedacos), seg_proc, (host_seg, (lon0, lat0), (lon1, lat1))))
+        pedacos.append(coords)
+        segment_engines.append(usado)
+
+    # The arrival bridge can join the batch when the end of the path is already known.
+    last_raw = ordenados[-1]
+    host_chegada = host_para(last_raw[0], last_raw[1], host)
+    ultimo_pendente = bool(pendentes) and pendentes[-1][0] == len(pedacos) - 1
+    fim_conhecido = next((p[-1] for p in reversed(pedacos) if p), None) if not ultimo_pendente else None
+    pares = [par for _, _, par in pendentes]
+    if (fim_conhecido is not None and not prazo_curto()
+            and distancia_m(fim_conhecido[0], fim_conhecido[1], last_raw[0], last_raw[1]) > 30.0):
+        pares.append((host_chegada, (fim_conhecido[0], fim_conhecido[1]), (last_raw[0], last_raw[1])))
+    pontes = resolver_pontes(pares)
+
+    for idx, seg_proc, par in pendentes:
+        bridge = pontes.get(par, [])
+        if bridge:
+            med.contar("fallback_route")
+            pedacos[idx], segment_engines[idx] = bridge, "route"
+        else:
+            med.contar("fallback_raw")
+            pedacos[idx], segment_engines[idx] = [[lon, lat] for lon, lat, _ in seg_proc], "raw"
+
+    final_path: List[List[float]] = []
+    for coords in pedacos:
+        _anexar_coords(final_path, coords)
 
+    props = _propriedades_segmentos(segment_engines, engine_segments)
     if not final_path:
-        return None, "Nenhuma rota valida encontrada.", False
-    try:
-        last_raw = ordenados[-1]
-        last_coord = final_path[-1]
-        if last_coord != [last_raw[0], last_raw[1]]:
-            d_tail = distancia_m(last_coord[0], last_coord[1], last_raw[0], last_raw[1])
-            if d_tail > 30.0:
-                bridging_route = call_route((last_coord[0], last_coord[1]),
-                                            (last_raw[0],  last_raw[1]), host)
-                if bridging_route:
-                    dist_route = 0.0
-                    for a, b in zip(bridging_route, bridging_route[1:]):
-                        dist_route += distancia_m(a[0], a[1], b[0], b[1])
-                    if d_tail > 0 and dist_route <= (3.0 * d_tail + 50.0):
-                        start_idx = 1 if bridging_route[0] == last_coord else 0
-                        for coord in bridging_route[start_idx:]:
-                            if not final_path or final_path[-1] != coord:
-                                final_path.append(coord)
-        if final_path[-1] != [last_raw[0], last_raw[1]]:
-            d_tail2 = distancia_m(final_path[-1][0], final_path[-1][1], last_raw[0], last_raw[1])
-            if 2.0 < d_tail2 <= 30.0:
-                final_path.append([last_raw[0], last_raw[1]])
-    except Exception as e:
-        print(f"Falha ao costurar chegada: {e}")
-        if final_path and final_path[-1] != [ordenados[-1][0], ordenados[-1][1]]:
-            final_path.append([ordenados[-1][0], ordenados[-1][1]])
-    if (SMOOTH_ENABLE or DENSIFY_ENABLE) and final_path:
+        return None, props
+    with med.etapa("tail_stitch"):
         try:
-            final_path = _smooth_and_densify(final_path)
+            d_tail = _distancia_chegada(final_path, last_raw)
+            bridging_route: List[List[float]] = []
+            if d_tail > 30.0 and not prazo_curto():
+                last_coord = final_path[-1]
+                par = (host_chegada, (last_coord[0], last_coord[1]), (last_raw[0], last_raw[1]))
+                if par not in pontes:
+                    pontes.update(resolver_pontes([par]))
+                bridging_route = pontes[par]
+            _costurar_chegada(final_path, last_raw, bridging_route, d_tail)
         except Exception as e:
-            print(f"Aviso: pós‑processamento falhou: {e}")
+            print(f"Falha ao costurar chegada: {e}")
+            if final_path and final_path[-1] != [ordenados[-1][0], ordenados[-1][1]]:
+                final_path.append([ordenados[-1][0], ordenados[-1][1]])
+    return final_path, props
+
+def _segmentos_por_regiao(engine_segments: List[Tuple[str, List[Tuple[float,float,int]]]],
+                          host: str) -> List[Tuple[str, str, List[Tuple[float,float,int]]]]:
+    out: List[Tuple[str, str, List[Tuple[float,float,int]]]] = []
+    for engine, seg in engine_segments:
+        for host_seg, sub in dividir_por_regiao(seg, host):
+            out.append((engine, host_seg, sub))
+    return out
 
+def _propriedades_segmentos(segment_engines: List[str],
+                            segmentos: List[Tuple[str, str, List[Tuple[float,float,int]]]]) -> Dict[str, Any]:
+    props: Dict[str, Any] = {
+        "segment_engines": segment_engines,
+        "segment_start_ts": [seg[0][2] for _, _, seg in segmentos],
+    }
+    if registro() is not None:
+        props["segment_hosts"] = [host_seg for _, host_seg, _ in segmentos]
+    return props
+
+def _simplificar_segmento(seg: List[Tuple[float,float,int]], dp_tol: float) -> List[Tuple[float,float,int]]:
+    if len(seg) >= 10:
+        return douglas_peucker(seg, dp_tol)
+    return seg[:]
+
+def _anexar_coords(final_path: List[List[float]], coords: List[List[float]]) -> None:
+    for c in coords:
+        if final_path and final_path[-1] == c:
+            continue
+        final_path.append(c)
+
+def _distancia_chegada(final_path: List[List[float]], last_raw: Tuple[float,float,int]) -> float:
+    last_coord = final_path[-1]
+    if last_coord == [last_raw[0], last_raw[1]]:
+        return 0.0
+    return distancia_m(last_coord[0], last_coord[1], last_raw[0], last_raw[1])
+
+def _costurar_chegada(final_path: List[List[float]],
+                      last_raw: Tuple[float,float,int],
+                      bridging_route: List[List[float]],
+                      d_tail: float) -> None:
+    last_coord = final_path[-1]
+    if bridging_route:
+        dist_route = 0.0
+        for a, b in zip(bridging_route, bridging_route[1:]):
+            dist_route += distancia_m(a[0], a[1], b[0], b[1])
+        if d_tail > 0 and dist_route <= (3.0 * d_tail + 50.0):
+            start_idx = 1 if bridging_route[0] == last_coord else 0
+            for coord in bridging_route[start_idx:]:
+                if not final_path or final_path[-1] != coord:
+                    final_path.append(coord)
+    if final_path[-1] != [last_raw[0], last_raw[1]]:
+        d_tail2 = distancia_m(final_path[-1][0], final_path[-1][1], last_raw[0], last_raw[1])
+        if 2.0 < d_tail2 <= 30.0:
+            final_path.append([last_raw[0], last_raw[1]])
+
+def _suavizar_caminho(final_path: List[List[float]]) -> List[List[float]]:
+    if (SMOOTH_ENABLE or DENSIFY_ENABLE) and final_path and not prazo_curto():
+        with atual().etapa("smooth_densify"):
+            try:
+                return _smooth_and_densify(final_path)
+            except Exception as e:
+                print(f"Aviso: pós‑processamento falhou: {e}")
+    return final_path
+
+def _montar_geojson(final_path: List[List[float]],
+                    ordenados: List[Tuple[float,float,int]],
+                    propriedades: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], str, bool]:
+    with atual().etapa("metricas"):
+        metricas = metricas_trilha(final_path, ordenados, MAX_DT_GAP, MIN_DIST_GAP, MAX_VEL_GAP)
     features = []
     linha_unica = {"type": "LineString", "coordinates": final_path}
-    features.append({"type": "Feature", "properties": {"stitched": True}, "geometry": linha_unica})
+    features.append({"type": "Feature", "properties": {"stitched": True, **(propriedades or {}), **metricas}, "geometry": linha_unica})
     features.append({"type": "Feature", "properties": {"final_point": True}, "geometry": {"type": "Point", "coordinates": [ordenados[-1][0], ordenados[-1][1]]}})
 
     geojson_final = {"type": "FeatureCollection", "features": features}
@@ -585,6 +788,15 @@ def parse_args(argv: List[str]) -> Dict[str, Any]:
         "eps": DEDUP_EPS_M,
         "overview": OVERVIEW_MODE,
         "gaps": GAPS_MODE,
+        "timings": False,
+        "medir": None,
+        "hedge": HEDGE_ENABLE,
+        "checkpoint": False,
+        "track_id": None,
+        "regioes": None,
+        "prazo": None,
+        "formato": None,
+        "saida": [],
     }
     i = 0
     while i < len(argv):
@@ -603,6 +815,29 @@ def parse_args(argv: List[str]) -> Dict[str, Any]:
             args["overview"] = arg.split("=", 1)[1]
         elif arg.startswith("--gaps="):
             args["gaps"] = arg.split("=", 1)[1]
+        elif arg.startswith("--saida="):
+            args["saida"].append(Path(arg.split("=", 1)[1]))
+        elif arg.startswith("--formato="):
+            args["formato"] = arg.split("=", 1)[1]
+            if args["formato"] not in FORMATOS:
+                raise SystemExit(f"Formato invalido: {args['formato']} (use {', '.join(FORMATOS)})")
+        elif arg == "--hedge":
+            args["hedge"] = True
+        elif arg.startswith("--prazo="):
+            args["prazo"] = float(arg.split("=", 1)[1])
+        elif arg.startswith("--regioes="):
+            args["regioes"] = arg.split("=", 1)[1]
+        elif arg == "--checkpoint":
+            args["checkpoint"] = True
+        elif arg.startswith("--track_id="):
+            args["track_id"] = arg.split("=", 1)[1]
+            args["checkpoint"] = True
+        elif arg == "--timings":
+            args["timings"] = True
+            args["medir"] = True
+        elif arg == "--sem-timings":
+            args["timings"] = False
+            args["medir"] = False
         elif arg in ("--host", "--valhalla_host", "--fence", "--dp", "--eps", "--overview", "--gaps"):
             i += 1
             if i >= len(argv):
@@ -642,6 +877,8 @@ def escolher_arquivos():
 def main():
     argv = sys.argv[1:]
     args = parse_args(argv)
+    if args["regioes"]:
+        carregar_registro(args["regioes"])
 
     files = args["files"]
     if not files:
@@ -651,6 +888,7 @@ def main():
         sys.exit(1)
 
     brutos = []
+    track_id = args["track_id"]
     for path in files:
         try:
             with open(path, "r", encoding="utf-8") as f:
@@ -660,6 +898,8 @@ def main():
                 print(f"{path}: sem pontos validos.")
                 continue
             brutos.extend(pts)
+            if args["checkpoint"] and not track_id:
+                track_id = trilha_id_de(data, path)
         except Exception as e:
             print(f"Erro em {path}: {e}")
 
@@ -682,19 +922,21 @@ def main():
         gaps=args["gaps"],
         valhalla_host=args.get("valhalla_host", VALHALLA_HOST_DEFAULT),
         fence_poly=fence_poly,
+        timings=args["timings"],
+        medir=args["medir"],
+        hedge=args["hedge"],
+        track_id=track_id if args["checkpoint"] else None,
+        deadline_s=args["prazo"],
     )
 
     if ok:
-        SAIDA_PASTA.mkdir(parents=True, exist_ok=True)
-        with open(SAIDA_ARQUIVO, "w", encoding="utf-8") as f:
-            json.dump(geojson_data, f, ensure_ascii=False, indent=2)
-        try:
-            SAIDA_GEOJSON_PASTA.mkdir(parents=True, exist_ok=True)
-            with open(SAIDA_GEOJSON_ARQUIVO, "w", encoding="utf-8") as f_out:
-                json.dump(geojson_data, f_out, ensure_ascii=False, indent=2)
-            print(f"GeoJSON salvo em: {SAIDA_ARQUIVO} e {SAIDA_GEOJSON_ARQUIVO}")
-        except Exception as e:
-            print(f"GeoJSON salvo em: {SAIDA_ARQUIVO}. Falha ao salvar em {SAIDA_GEOJSON_ARQUIVO}: {e}")
+        resultado = escrever_saidas(geojson_data, args["saida"] or [SAIDA_ARQUIVO, SAIDA_GEOJSON_ARQUIVO], args["formato"])
+        salvos = [str(p) for p, erro in resultado.items() if erro is None]
+        if salvos:
+            print(f"GeoJSON salvo em: {' e '.join(salvos)}")
+        for destino, erro in resultado.items():
+            if erro is not None:
+                print(f"Falha ao salvar em {destino}: {erro}")
     else:
         print(f"Falha no processamento: {msg}")
 
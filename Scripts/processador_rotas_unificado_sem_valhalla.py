@@ -1,10 +1,22 @@
 import json
 import sys
 import math
-import requests
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import quote
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
+
+from cache_rotas import cache_get, cache_set, chave_canonica, registrar_acesso
+from checkpoint_rotas import chave_parametros, processar_incremental, trilha_id_de
+from cliente_backend import prazo_curto, prazo_excedido, prazo_trilha
+from entrada_pontos import extrair_pontos
+from hints_osrm import osrm_get_json
+from instrumentacao import atual, medir_trilha
+from metricas_qualidade import metricas_trilha
+from regioes_osrm import carregar_registro, dividir_por_regiao, host_para
+from saida_rotas import FORMATOS, escrever_saidas
+from upstream_osrm import dataset_de
 
 OSRM_HOST_DEFAULT = "http://127.0.0.1:5001"
 
@@ -22,6 +34,15 @@ GAP_HYST       = 2
 RADIUS_SMALL    = 30
 RADIUS_LARGE    = 50
 
+# Recovery of a failed /match: split the segment in halves (sharing the
+# middle point), match them concurrently and keep splitting only the halves
+# that still fail, down to BISSECAO_MIN_PONTOS points.
+BISSECAO_MIN_PONTOS = 8
+POOL_WORKERS        = 8
+BISSECAO_CACHE_NS   = "osrm_match_trecho"
+
+_pool: Optional[ThreadPoolExecutor] = None
+
 def parse_args(argv: List[str]) -> Dict[str, Any]:
     """
     Parse command line arguments and return a dictionary of values.
@@ -33,6 +54,20 @@ def parse_args(argv: List[str]) -> Dict[str, Any]:
     --eps=<value>       Deduplication radius (metres)
     --overview=<mode>   OSRM overview mode
     --gaps=<mode>       OSRM gaps policy
+    --saida=<path>      output file (repeatable; default: SAIDA_ARQUIVO)
+    --formato=<fmt>     output format: json (compact), json.gz, ndjson,
+                        ndjson.gz (polyline6 per line) or pretty
+    --timings           add per-stage timings to the output GeoJSON
+    --sem-timings       disable stage timers and the JSON timing log
+    --prazo=<s>         deadline for the whole track; calls get at most the
+                        time left, the arrival bridge is skipped when it runs
+                        short and the partial result is marked deadline_exceeded
+    --regioes=<path>    JSON registry of regional OSRM instances (see
+                        regioes_osrm.py); points outside every region use --host
+    --checkpoint        keep a matched-prefix checkpoint per track and only
+                        match points appended since the previous run
+    --track_id=<id>     checkpoint key (default: track id in the file or the
+                        file name); implies --checkpoint
 
     Positional arguments that do not start with '--' are treated as file
     paths for JSON tracks.  Valhalla support has been removed, so
@@ -45,6 +80,14 @@ def parse_args(argv: List[str]) -> Dict[str, Any]:
         "eps": DEDUP_EPS_M,
         "overview": OVERVIEW_MODE,
         "gaps": GAPS_MODE,
+        "timings": False,
+        "medir": None,
+        "checkpoint": False,
+        "track_id": None,
+        "regioes": None,
+        "prazo": None,
+        "formato": None,
+        "saida": [],
     }
     i = 0
     while i < len(argv):
@@ -59,6 +102,27 @@ def parse_args(argv: List[str]) -> Dict[str, Any]:
             args["overview"] = arg.split("=", 1)[1]
         elif arg.startswith("--gaps="):
             args["gaps"] = arg.split("=", 1)[1]
+        elif arg.startswith("--saida="):
+            args["saida"].append(Path(arg.split("=", 1)[1]))
+        elif arg.startswith("--formato="):
+            args["formato"] = arg.split("=", 1)[1]
+            if args["formato"] not in FORMATOS:
+                raise SystemExit(f"Formato invalido: {args['formato']} (use {', '.join(FORMATOS)})")
+        elif arg == "--timings":
+            args["timings"] = True
+            args["medir"] = True
+        elif arg == "--sem-timings":
+            args["timings"] = False
+            args["medir"] = False
+        elif arg.startswith("--prazo="):
+            args["prazo"] = float(arg.split("=", 1)[1])
+        elif arg.startswith("--regioes="):
+            args["regioes"] = arg.split("=", 1)[1]
+        elif arg == "--checkpoint":
+            args["checkpoint"] = True
+        elif arg.startswith("--track_id="):
+            args["track_id"] = arg.split("=", 1)[1]
+            args["checkpoint"] = True
         elif arg in ("--host", "--dp", "--eps", "--overview", "--gaps"):
             i += 1
             if i >= len(argv):
@@ -121,19 +185,6 @@ def douglas_peucker(points: List[Tuple[float,float,int]], tol_deg: float) -> Lis
     else:
         return [start, end]
 
-def extrair_pontos(data) -> List[Tuple[float,float,int]]:
-    rota = data.get("track", {}).get("route", [])
-    pts: List[Tuple[float,float,int]] = []
-    for p in rota:
-        if isinstance(p, (list, tuple)) and len(p) >= 3:
-            ts = int(p[0] / 1000)
-            lat_val = float(p[1])
-            lon_val = float(p[2])
-            if abs(lat_val) > 90 and abs(lon_val) <= 90:
-                lat_val, lon_val = lon_val, lat_val
-            pts.append((lon_val, lat_val, ts))
-    return pts
-
 def ordenar_por_ts(pontos: List[Tuple[float,float,int]]) -> List[Tuple[float,float,int]]:
     pts = sorted(pontos, key=lambda x: x[2])
     out, last = [], None
@@ -192,9 +243,7 @@ def call_route(start_coord: Tuple[float,float], end_coord: Tuple[float,float], h
     coords_str = f"{start_coord[0]},{start_coord[1]};{end_coord[0]},{end_coord[1]}"
     url_route = f"{host}/route/v1/driving/{coords_str}?geometries=geojson&overview=full&continue_straight=true"
     try:
-        r = requests.get(url_route, timeout=30)
-        r.raise_for_status()
-        rj = r.json()
+        rj = osrm_get_json(url_route, [start_coord, end_coord], host, timeout=30)
         if rj.get("routes") and rj["routes"][0]["geometry"]["coordinates"]:
             return rj["routes"][0]["geometry"]["coordinates"]
     except Exception as e:
@@ -206,9 +255,7 @@ def call_route_multi(points: List[Tuple[float,float]], host: str) -> List[List[f
     coords_str = ";".join(f"{lon},{lat}" for lon, lat in points)
     url = f"{host}/route/v1/driving/{coords_str}?geometries=geojson&overview=full&continue_straight=true"
     try:
-        r = requests.get(url, timeout=60)
-        r.raise_for_status()
-        rj = r.json()
+        rj = osrm_get_json(url, points, host, timeout=60)
         if rj.get("routes") and rj["routes"][0]["geometry"]["coordinates"]:
             return rj["routes"][0]["geometry"]["coordinates"]
     except Exception as e:
@@ -222,16 +269,240 @@ def processar_uma_trilha(
     dp_tol: float = DP_TOL_DEFAULT,
     eps_m: float = DEDUP_EPS_M,
     overview: str = OVERVIEW_MODE,
-    gaps: str = GAPS_MODE
+    gaps: str = GAPS_MODE,
+    timings: bool = False,
+    medir: Optional[bool] = None,
+    track_id: Optional[str] = None,
+    deadline_s: Optional[float] = None,
+) -> Tuple[Dict[str, Any], str, bool]:
+    with medir_trilha(medir, osrm_host=host) as med, prazo_trilha(deadline_s):
+        with med.etapa("total"):
+            geojson_final, msg, ok = _processar_uma_trilha(pontos_brutos, host, dp_tol, eps_m, overview, gaps, track_id)
+        med.emitir(ok=ok, pontos=len(pontos_brutos or []))
+        if ok and timings and med.ativo:
+            geojson_final["features"][0]["properties"]["timings"] = med.resumo()
+    return geojson_final, msg, ok
+
+def _coords_match(data: Dict[str, Any]) -> List[List[float]]:
+    out: List[List[float]] = []
+    for m in data.get("matchings") or []:
+        geom = m.get("geometry") or {}
+        if geom.get("type") == "LineString" and geom.get("coordinates"):
+            out.extend([[c[0], c[1]] for c in geom["coordinates"]])
+    return out
+
+def _match_trecho(trecho: List[Tuple[float,float,int]], host: str, overview: str, gaps: str) -> List[List[float]]:
+    url_match = montar_url_match(trecho, host, overview, gaps)
+    # Radiuses and bearings are derived from the coordinates, and only the
+    # spacing of the timestamps matters to /match, not the time of day.
+    t0 = trecho[0][2]
+    chave = chave_canonica("match", trecho, {
+        "overview": overview, "gaps": gaps, "timestamps": ";".join(str(p[2] - t0) for p in trecho),
+    })
+    entry = cache_get(BISSECAO_CACHE_NS, chave, dataset_de(host))
+    registrar_acesso(BISSECAO_CACHE_NS, entry is not None)
+    if entry is not None:
+        atual().contar("cache_hits")
+        atual().contar(f"cache_hits.{BISSECAO_CACHE_NS}")
+        return entry["value"]
+    atual().contar("cache_misses")
+    atual().contar(f"cache_misses.{BISSECAO_CACHE_NS}")
+    try:
+        coords = _coords_match(osrm_get_json(url_match, trecho, host, timeout=60))
+    except Exception:
+        return []
+    if coords:
+        cache_set(BISSECAO_CACHE_NS, chave, dataset_de(host), coords)
+    return coords
+
+def _submeter(fn, *args):
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="osrm")
+    return _pool.submit(contextvars.copy_context().run, fn, *args)
+
+def _match_bisseccao(segmento: List[Tuple[float,float,int]], host: str, overview: str,
+                     gaps: str) -> Tuple[List[List[float]], bool]:
+    """
+    Recover a segment whose full /match failed.
+
+    Pieces are matched level by level: every pending piece of a level is sent
+    concurrently, the ones that fail are halved for the next level and pieces
+    already at the minimum size fall back to their raw points.  Once the track
+    deadline has passed no further level is sent and the pending pieces fall
+    back to their raw points too.  Returns the stitched coordinates and whether
+    at least one piece was matched.
+    """
+    med = atual()
+    resultado: Dict[int, List[List[float]]] = {}
+    pendentes: List[Tuple[int, int]] = [(0, len(segmento) - 1)]
+    algum_ok = False
+    while pendentes:
+        if prazo_excedido():
+            med.contar("bisseccao_bruto", len(pendentes))
+            for i0, i1 in pendentes:
+                resultado[i0] = [[lon, lat] for lon, lat, _ in segmento[i0:i1 + 1]]
+            break
+        proximos: List[Tuple[int, int]] = []
+        divididos: List[Tuple[int, int]] = []
+        for i0, i1 in pendentes:
+            meio = (i0 + i1) // 2
+            divididos.extend([(i0, meio), (meio, i1)])
+        futuros = [_submeter(_match_trecho, segmento[i0:i1 + 1], host, overview, gaps)
+                   for i0, i1 in divididos]
+        med.contar("bisseccao_requests", len(futuros))
+        for (i0, i1), fut in zip(divididos, futuros):
+            coords = fut.result()
+            if coords:
+                resultado[i0] = coords
+                algum_ok = True
+            elif i1 - i0 + 1 >= 2 * BISSECAO_MIN_PONTOS:
+                proximos.append((i0, i1))
+            else:
+                med.contar("bisseccao_bruto")
+                resultado[i0] = [[lon, lat] for lon, lat, _ in segmento[i0:i1 + 1]]
+        pendentes = proximos
+    out: List[List[float]] = []
+    for i0 in sorted(resultado):
+        for c in resultado[i0]:
+            if not out or out[-1] != c:
+                out.append(c)
+    return out, algum_ok
+
+def _match_segmento(simplificado_segmento: List[Tuple[float,float,int]], host: str, overview: str, gaps: str,
+                    final_path: List[List[float]], rotulo: str) -> bool:
+    med = atual()
+    match_sucesso = False
+    with med.etapa("match"):
+        url_match = montar_url_match(simplificado_segmento, host, overview, gaps)
+        try:
+            coords = _coords_match(osrm_get_json(url_match, simplificado_segmento, host, timeout=60))
+            if coords:
+                final_path.extend(coords)
+                match_sucesso = True
+        except Exception as e:
+            print(f"Falha no /match para {rotulo}. Erro: {e}")
+    if not match_sucesso and not prazo_excedido() and len(simplificado_segmento) >= 2 * BISSECAO_MIN_PONTOS:
+        med.contar("retry_match_bisseccao")
+        with med.etapa("match_bisseccao"):
+            coords, match_sucesso = _match_bisseccao(simplificado_segmento, host, overview, gaps)
+        if match_sucesso:
+            final_path.extend(coords)
+        else:
+            print(f"Falha no /match por bissecao para {rotulo}.")
+    elif not match_sucesso and not prazo_excedido():
+        med.contar("retry_match_split")
+        with med.etapa("match_split"):
+            url_match2 = montar_url_match(simplificado_segmento, host, overview, "split")
+            try:
+                coords = _coords_match(osrm_get_json(url_match2, simplificado_segmento, host, timeout=60))
+                if coords:
+                    final_path.extend(coords)
+                    match_sucesso = True
+            except Exception as e:
+                print(f"Falha no /match (gaps=split) para {rotulo}. Erro: {e}")
+    return match_sucesso
+
+def _comprimento_m(coords: List[List[float]]) -> float:
+    return sum(distancia_m(a[0], a[1], b[0], b[1]) for a, b in zip(coords, coords[1:]))
+
+Ponte = Tuple[str, Tuple[float,float], Tuple[float,float]]
+
+def resolver_pontes(pares: List[Ponte]) -> Dict[Ponte, Tuple[List[List[float]], float]]:
+    """
+    Resolve every /route bridge of a track at once.
+
+    Each bridge is (host, origin, destination).  Identical bridges are
+    requested only once and the unique ones go out concurrently over the
+    pooled session.  The length used by the detour checks is then summed
+    per route in plain Python, one haversine per pair of points.
+    """
+    med = atual()
+    unicos = list(dict.fromkeys(pares))
+    if not unicos:
+        return {}
+    med.contar("pontes", len(pares))
+    med.contar("pontes_unicas", len(unicos))
+    with med.etapa("route_bridge"):
+        futuros = [_submeter(call_route, origem, destino, host) for host, origem, destino in unicos]
+        rotas = [f.result() for f in futuros]
+    return {par: (rota, _comprimento_m(rota)) for par, rota in zip(unicos, rotas)}
+
+def _anexar_ponte_ou_bruto(final_path: List[List[float]],
+                           simplificado_segmento: List[Tuple[float,float,int]],
+                           bridging_route: List[List[float]],
+                           direct_dist: float,
+                           dist_route: float) -> None:
+    med = atual()
+    use_raw_segment = not bridging_route or (direct_dist > 0 and dist_route / direct_dist > 5.0)
+
+    if use_raw_segment:
+        med.contar("fallback_raw")
+        for lon_raw, lat_raw, _ in simplificado_segmento:
+            if final_path and final_path[-1] == [lon_raw, lat_raw]:
+                continue
+            final_path.append([lon_raw, lat_raw])
+    else:
+        med.contar("fallback_route")
+        if final_path and final_path[-1] == bridging_route[0]:
+            final_path.extend(bridging_route[1:])
+        else:
+            final_path.extend(bridging_route)
+
+def _processar_uma_trilha(
+    pontos_brutos: List[Tuple[float, float, int]],
+    host: str,
+    dp_tol: float,
+    eps_m: float,
+    overview: str,
+    gaps: str,
+    track_id: Optional[str] = None,
 ) -> Tuple[Dict[str, Any], str, bool]:
     if not pontos_brutos or len(pontos_brutos) < 2:
         return None, "Nenhum ponto valido para processar.", False
 
-    ordenados = ordenar_por_ts(pontos_brutos)
-    dedup = dedupe_por_raio(ordenados, eps_m)
-    
-    final_path: List[List[float]] = []
-    
+    med = atual()
+    with med.etapa("ordenar"):
+        ordenados = ordenar_por_ts(pontos_brutos)
+
+    def caminho(pontos):
+        return _caminho_trilha(pontos, host, dp_tol, eps_m, overview, gaps), {}
+
+    if track_id:
+        params = chave_parametros(variante="sem_valhalla", host=host, dataset=dataset_de(host), dp=dp_tol,
+                                  eps=eps_m, overview=overview, gaps=gaps)
+        dedup_path, props = processar_incremental(track_id, params, ordenados, caminho, lambda c: c)
+    else:
+        dedup_path, props = caminho(ordenados)
+    if not dedup_path:
+        return None, "Nenhuma rota valida encontrada.", False
+    if prazo_excedido():
+        props = dict(props, deadline_exceeded=True)
+    with med.etapa("metricas"):
+        props = dict(props, **metricas_trilha(dedup_path, ordenados, MAX_DT_GAP, MIN_DIST_GAP, MAX_VEL_GAP))
+
+    features = []
+    linha_unica = {"type": "LineString", "coordinates": dedup_path}
+    features.append({"type": "Feature", "properties": {"stitched": True, **props}, "geometry": linha_unica})
+    features.append({"type": "Feature", "properties": {"final_point": True}, "geometry": {"type": "Point", "coordinates": [ordenados[-1][0], ordenados[-1][1]]}})
+
+    geojson_final = {"type": "FeatureCollection", "features": features}
+    return geojson_final, "Sucesso no processamento.", True
+
+def _caminho_trilha(
+    ordenados: List[Tuple[float, float, int]],
+    host: str,
+    dp_tol: float,
+    eps_m: float,
+    overview: str,
+    gaps: str
+) -> List[List[float]]:
+    med = atual()
+    with med.etapa("dedup"):
+        dedup = dedupe_por_raio(ordenados, eps_m)
+
+    # Split at the gaps first; each piece is (points, label, gap endpoints, gap length).
+    trechos: List[Tuple[List[Tuple[float,float,int]], str, Optional[Tuple[Tuple[float,float], Tuple[float,float]]], float]] = []
     gap_flags = 0
     current_segment = [dedup[0]]
     for i in range(1, len(dedup)):
@@ -246,178 +517,101 @@ def processar_uma_trilha(
         else:
             gap_flags = 0
         if gap_flags >= GAP_HYST:
-            if len(current_segment) < 10:
-                simplificado_segmento = current_segment[:]
-            else:
-                simplificado_segmento = douglas_peucker(current_segment, dp_tol)
-
-            match_sucesso = False
-            if len(simplificado_segmento) > 1:
-                url_match = montar_url_match(simplificado_segmento, host, overview, gaps)
-                try:
-                    resp = requests.get(url_match, timeout=60)
-                    resp.raise_for_status()
-                    data = resp.json()
-                    matchings = data.get("matchings") or []
-                    if matchings:
-                        for m in matchings:
-                            geom = m.get("geometry") or {}
-                            if geom.get("type") == "LineString" and geom.get("coordinates"):
-                                final_path.extend([[c[0], c[1]] for c in geom["coordinates"]])
-                                match_sucesso = True
-                except Exception as e:
-                    print(f"Falha no /match para segmento. Erro: {e}")
-                if not match_sucesso:
-                    url_match2 = montar_url_match(simplificado_segmento, host, overview, "split")
-                    try:
-                        resp2 = requests.get(url_match2, timeout=60)
-                        resp2.raise_for_status()
-                        data2 = resp2.json()
-                        matchings2 = data2.get("matchings") or []
-                        if matchings2:
-                            for m in matchings2:
-                                geom = m.get("geometry") or {}
-                                if geom.get("type") == "LineString" and geom.get("coordinates"):
-                                    final_path.extend([[c[0], c[1]] for c in geom["coordinates"]])
-                                    match_sucesso = True
-                    except Exception as e:
-                        print(f"Falha no /match (gaps=split) para segmento. Erro: {e}")
-
-            if not match_sucesso:
-                print(
-                    f"Gap de {dist:.2f} m / {dt:.1f} s; match falhou. Tentando preencher somente entre pontos consecutivos com /route."
-                )
-                bridging_route: List[List[float]] = call_route((lon0, lat0), (lon1, lat1), host)
-                use_raw_segment = False
-                if bridging_route:
-                    dist_route = 0.0
-                    for a, b in zip(bridging_route, bridging_route[1:]):
-                        dist_route += distancia_m(a[0], a[1], b[0], b[1])
-                    direct_dist = dist
-                    if direct_dist > 0 and dist_route / direct_dist > 5.0:
-                        use_raw_segment = True
-                else:
-                    use_raw_segment = True
-
-                if use_raw_segment:
-                    for lon_raw, lat_raw, _ in simplificado_segmento:
-                        if final_path and final_path[-1] == [lon_raw, lat_raw]:
-                            continue
-                        final_path.append([lon_raw, lat_raw])
-                else:
-                    if final_path and final_path[-1] == bridging_route[0]:
-                        final_path.extend(bridging_route[1:])
-                    else:
-                        final_path.extend(bridging_route)
+            med.contar("gaps")
+            trechos.append((current_segment, "segmento", ((lon0, lat0), (lon1, lat1)), dist))
             current_segment = [dedup[i]]
             gap_flags = 0
         else:
             current_segment.append(dedup[i])
-
     if current_segment and len(current_segment) > 1:
-        if len(current_segment) < 10:
-            simplificado_segmento = current_segment[:]
-        else:
-            simplificado_segmento = douglas_peucker(current_segment, dp_tol)
+        trechos.append((current_segment, "segmento final", None, 0.0))
+
+    # Pieces crossing a region border are matched against each regional instance.
+    por_regiao: List[Tuple[str, List[Tuple[float,float,int]], str, Optional[Ponte], float]] = []
+    for segmento, rotulo, gap, dist in trechos:
+        partes = dividir_por_regiao(segmento, host)
+        for k, (host_parte, parte) in enumerate(partes):
+            if k < len(partes) - 1:
+                por_regiao.append((host_parte, parte, rotulo, None, 0.0))
+            else:
+                ponte = (host_para(gap[0][0], gap[0][1], host), gap[0], gap[1]) if gap is not None else None
+                por_regiao.append((host_parte, parte, rotulo, ponte, dist))
+
+    # Match every piece; the ones that fail get a /route bridge, resolved below in one batch.
+    pedacos: List[List[List[float]]] = []
+    pendentes: List[Tuple[int, List[Tuple[float,float,int]], Ponte, float]] = []
+    for host_parte, segmento, rotulo, gap, dist in por_regiao:
+        with med.etapa("douglas_peucker"):
+            if len(segmento) < 10:
+                simplificado_segmento = segmento[:]
+            else:
+                simplificado_segmento = douglas_peucker(segmento, dp_tol)
+        pedaco: List[List[float]] = []
+        match_sucesso = False
         if len(simplificado_segmento) > 1:
-            match_sucesso = False
-            url_match = montar_url_match(simplificado_segmento, host, overview, gaps)
-            try:
-                resp = requests.get(url_match, timeout=60)
-                resp.raise_for_status()
-                data = resp.json()
-                matchings = data.get("matchings") or []
-                if matchings:
-                    for m in matchings:
-                        geom = m.get("geometry") or {}
-                        if geom.get("type") == "LineString" and geom.get("coordinates"):
-                            final_path.extend([[c[0], c[1]] for c in geom["coordinates"]])
-                            match_sucesso = True
-            except Exception as e:
-                print(f"Falha no /match para segmento final. Erro: {e}")
-            if not match_sucesso:
-                url_match2 = montar_url_match(simplificado_segmento, host, overview, "split")
-                try:
-                    resp2 = requests.get(url_match2, timeout=60)
-                    resp2.raise_for_status()
-                    data2 = resp2.json()
-                    matchings2 = data2.get("matchings") or []
-                    if matchings2:
-                        for m in matchings2:
-                            geom = m.get("geometry") or {}
-                            if geom.get("type") == "LineString" and geom.get("coordinates"):
-                                final_path.extend([[c[0], c[1]] for c in geom["coordinates"]])
-                                match_sucesso = True
-                except Exception as e:
-                    print(f"Falha no /match (gaps=split) para segmento final. Erro: {e}")
-            if not match_sucesso:
+            match_sucesso = _match_segmento(simplificado_segmento, host_parte, overview, gaps, pedaco, rotulo)
+        if not match_sucesso:
+            if gap is not None:
+                print(
+                    f"Gap de {dist:.2f} m; match falhou. Tentando preencher somente entre pontos consecutivos com /route."
+                )
+                pendentes.append((len(pedacos), simplificado_segmento, gap, dist))
+            elif len(simplificado_segmento) > 1:
                 lon0, lat0, _ = simplificado_segmento[0]
                 lon1, lat1, _ = simplificado_segmento[-1]
-                bridging_route: List[List[float]] = call_route((lon0, lat0), (lon1, lat1), host)
-                use_raw_segment = False
-                if bridging_route:
-                    dist_route = 0.0
-                    for a, b in zip(bridging_route, bridging_route[1:]):
-                        dist_route += distancia_m(a[0], a[1], b[0], b[1])
-                    direct_dist = distancia_m(lon0, lat0, lon1, lat1)
-                    if direct_dist > 0 and dist_route / direct_dist > 5.0:
-                        use_raw_segment = True
-                else:
-                    use_raw_segment = True
-
-                if use_raw_segment:
-                    for lon_raw, lat_raw, _ in simplificado_segmento:
-                        if final_path and final_path[-1] == [lon_raw, lat_raw]:
-                            continue
-                        final_path.append([lon_raw, lat_raw])
-                else:
-                    if final_path and final_path[-1] == bridging_route[0]:
-                        final_path.extend(bridging_route[1:])
-                    else:
-                        final_path.extend(bridging_route)
+                pendentes.append((len(pedacos), simplificado_segmento, (host_parte, (lon0, lat0), (lon1, lat1)),
+                                  distancia_m(lon0, lat0, lon1, lat1)))
+        pedacos.append(pedaco)
+
+    # The arrival bridge can join the batch when the end of the path is already known.
+    last_raw = ordenados[-1]  # (lon, lat, ts)
+    host_chegada = host_para(last_raw[0], last_raw[1], host)
+    ultimo_pendente = bool(pendentes) and pendentes[-1][0] == len(pedacos) - 1
+    fim_conhecido = next((p[-1] for p in reversed(pedacos) if p), None) if not ultimo_pendente else None
+    pares = [par for _, _, par, _ in pendentes]
+    if (fim_conhecido is not None and not prazo_curto()
+            and distancia_m(fim_conhecido[0], fim_conhecido[1], last_raw[0], last_raw[1]) > 30.0):
+        pares.append((host_chegada, (fim_conhecido[0], fim_conhecido[1]), (last_raw[0], last_raw[1])))
+    pontes = resolver_pontes(pares)
+
+    for idx, simplificado_segmento, par, direct_dist in pendentes:
+        rota, dist_route = pontes.get(par, ([], 0.0))
+        _anexar_ponte_ou_bruto(pedacos[idx], simplificado_segmento, rota, direct_dist, dist_route)
 
     dedup_path: List[List[float]] = []
-    for coord in final_path:
-        if not dedup_path or dedup_path[-1] != coord:
-            dedup_path.append(coord)
+    for pedaco in pedacos:
+        for coord in pedaco:
+            if not dedup_path or dedup_path[-1] != coord:
+                dedup_path.append(coord)
 
     if not dedup_path:
-        return None, "Nenhuma rota valida encontrada.", False
+        return dedup_path
 
-    try:
-        last_raw = ordenados[-1]  # (lon, lat, ts)
-        last_coord = dedup_path[-1]  # [lon, lat]
-
-        if last_coord != [last_raw[0], last_raw[1]]:
-            d_tail = distancia_m(last_coord[0], last_coord[1], last_raw[0], last_raw[1])
-            if d_tail > 30.0:
-                bridging_route = call_route((last_coord[0], last_coord[1]),
-                                            (last_raw[0],  last_raw[1]), host)
-                if bridging_route:
-                    dist_route = 0.0
-                    for a, b in zip(bridging_route, bridging_route[1:]):
-                        dist_route += distancia_m(a[0], a[1], b[0], b[1])
-                    if d_tail > 0 and dist_route <= (3.0 * d_tail + 50.0):
+    with med.etapa("tail_stitch"):
+        try:
+            last_coord = dedup_path[-1]  # [lon, lat]
+
+            if last_coord != [last_raw[0], last_raw[1]]:
+                d_tail = distancia_m(last_coord[0], last_coord[1], last_raw[0], last_raw[1])
+                if d_tail > 30.0 and not prazo_curto():
+                    par = (host_chegada, (last_coord[0], last_coord[1]), (last_raw[0], last_raw[1]))
+                    if par not in pontes:
+                        pontes.update(resolver_pontes([par]))
+                    bridging_route, dist_route = pontes[par]
+                    if bridging_route and d_tail > 0 and dist_route <= (3.0 * d_tail + 50.0):
                         start_idx = 1 if bridging_route[0] == last_coord else 0
                         for coord in bridging_route[start_idx:]:
                             if not dedup_path or dedup_path[-1] != coord:
                                 dedup_path.append(coord)
-        if dedup_path[-1] != [last_raw[0], last_raw[1]]:
-            d_tail2 = distancia_m(dedup_path[-1][0], dedup_path[-1][1], last_raw[0], last_raw[1])
-            if 2.0 < d_tail2 <= 30.0:
-                dedup_path.append([last_raw[0], last_raw[1]])
-    except Exception as e:
-        print(f"Falha ao costurar chegada: {e}")
-        if dedup_path and dedup_path[-1] != [ordenados[-1][0], ordenados[-1][1]]:
-            dedup_path.append([ordenados[-1][0], ordenados[-1][1]])
-
-    features = []
-    linha_unica = {"type": "LineString", "coordinates": dedup_path}
-    features.append({"type": "Feature", "properties": {"stitched": True}, "geometry": linha_unica})
-    features.append({"type": "Feature", "properties": {"final_point": True}, "geometry": {"type": "Point", "coordinates": [ordenados[-1][0], ordenados[-1][1]]}})
-
-    geojson_final = {"type": "FeatureCollection", "features": features}
-    return geojson_final, "Sucesso no processamento.", True
+            if dedup_path[-1] != [last_raw[0], last_raw[1]]:
+                d_tail2 = distancia_m(dedup_path[-1][0], dedup_path[-1][1], last_raw[0], last_raw[1])
+                if 2.0 < d_tail2 <= 30.0:
+                    dedup_path.append([last_raw[0], last_raw[1]])
+        except Exception as e:
+            print(f"Falha ao costurar chegada: {e}")
+            if dedup_path and dedup_path[-1] != [ordenados[-1][0], ordenados[-1][1]]:
+                dedup_path.append([ordenados[-1][0], ordenados[-1][1]])
+    return dedup_path
 
 def escolher_arquivos():
     try:
@@ -434,6 +628,8 @@ def escolher_arquivos():
 def main():
     argv = sys.argv[1:]
     args = parse_args(argv)
+    if args["regioes"]:
+        carregar_registro(args["regioes"])
 
     files = args["files"]
     if not files:
@@ -443,6 +639,7 @@ def main():
         sys.exit(1)
 
     brutos = []
+    track_id = args["track_id"]
     for path in files:
         try:
             with open(path, "r", encoding="utf-8") as f:
@@ -452,6 +649,8 @@ def main():
                 print(f"{path}: sem pontos validos.")
                 continue
             brutos.extend(pts)
+            if args["checkpoint"] and not track_id:
+                track_id = trilha_id_de(data, path)
         except Exception as e:
             print(f"Erro em {path}: {e}")
 
@@ -465,14 +664,19 @@ def main():
         dp_tol=args["dp"],
         eps_m=args["eps"],
         overview=args["overview"],
-        gaps=args["gaps"]
+        gaps=args["gaps"],
+        timings=args["timings"],
+        medir=args["medir"],
+        track_id=track_id if args["checkpoint"] else None,
+        deadline_s=args["prazo"],
     )
 
     if ok:
-        SAIDA_PASTA.mkdir(parents=True, exist_ok=True)
-        with open(SAIDA_ARQUIVO, "w", encoding="utf-8") as f:
-            json.dump(geojson_data, f, ensure_ascii=False, indent=2)
-        print(f"GeoJSON salvo em: {SAIDA_ARQUIVO}")
+        for destino, erro in escrever_saidas(geojson_data, args["saida"] or [SAIDA_ARQUIVO], args["formato"]).items():
+            if erro is None:
+                print(f"GeoJSON salvo em: {destino}")
+            else:
+                print(f"Falha ao salvar em {destino}: {erro}")
     else:
         print(f"Falha no processamento: {msg}")
 
@@ -1,12 +1,40 @@
+import asyncio
+import base64
+import math
 import os
-from typing import List, Literal, Optional
+import sys
+from array import array
+from collections import deque
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple
+from urllib.parse import quote
 
 import httpx
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, validator
 
+from cliente_backend import BackendIndisponivel, chamada_limitada_async, estado_backends
+from hints_osrm import com_hints, descartar_hints, estatisticas_hints, guardar_hints, hints_para, rejeitou_hints
+from nivel_detalhe import codificar, reduzir
+from processador_async import processar_uma_trilha_async
+from regioes_osrm import dividir_por_regiao, registro
+from saida_rotas import decode_polyline, encode_polyline
+from upstream_osrm import dataset_de, upstream_ativo
+
 OSRM_BASEURL = os.getenv("OSRM_BASEURL", "http://127.0.0.1:5001")
+VALHALLA_BASEURL = os.getenv("VALHALLA_BASEURL", "http://127.0.0.1:8002")
+PROCESS_PRAZO_S = float(os.getenv("PROCESS_PRAZO_S", "30"))
+# Per OSRM request, including the wait for a free slot to the backend.
+OSRM_TIMEOUT_S = 15.0
+# Longer coordinate lists go to OSRM as polyline6, keeping the URL short.
+TRACK_POLYLINE_MIN_COORDS = 100
+# Recent OSRM request paths kept for warming a new dataset (see troca_dataset_osrm.py).
+REPLAY_MAX = 2000
+# Without a token the /admin endpoints only answer to localhost.
+ADMIN_TOKEN = os.getenv("PROXY_ADMIN_TOKEN", "")
+
+_recentes: deque = deque(maxlen=REPLAY_MAX)
+_em_voo: Dict[str, int] = {}
 
 app = FastAPI(title="Realtime Proxy OSRM", version="0.1.0")
 
@@ -18,19 +46,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _fora_dos_limites(lons: Sequence[float], lats: Sequence[float]) -> bool:
+    return (not all(map(math.isfinite, lons)) or not all(map(math.isfinite, lats))
+            or min(lons) < -180.0 or max(lons) > 180.0 or min(lats) < -90.0 or max(lats) > 90.0)
+
 class TrackRequest(BaseModel):
-    coordinates: List[List[float]] = Field(..., description="[lon, lat] em ordem", min_items=2)
+    # Exactly one of coordinates, polyline or coordinates_packed.
+    coordinates: Optional[List[List[float]]] = Field(None, description="[lon, lat] em ordem", min_items=2)
+    polyline: Optional[str] = Field(None, description="Coordenadas como polyline6 (ou precisao 5 com polyline_precision=5)")
+    polyline_precision: Literal[5, 6] = 6
+    coordinates_packed: Optional[str] = Field(None, description="base64 de floats little-endian lon,lat,lon,lat,...")
+    packed_dtype: Literal["float32", "float64"] = "float64"
     profile: Literal["driving", "driving-hgv", "walking", "cycling"] = "driving"
     overview: Literal["simplified", "full", "false"] = "full"
-    geometries: Literal["polyline", "polyline6", "geojson"] = "geojson"
+    geometries: Literal["polyline", "polyline6", "geojson", "delta"] = "geojson"
     steps: bool = False
     annotations: Optional[Literal["false", "true", "nodes", "distance", "duration", "speed", "datasources", "weight"]] = "false"
+    # Level of detail applied by the proxy to routes[].geometry.
+    simplify_m: Optional[float] = Field(None, gt=0, description="Tolerancia (m) da simplificacao da geometria")
+    zoom: Optional[float] = Field(None, ge=0, le=22, description="Zoom do mapa; tolerancia de 1 pixel nesse zoom")
+    bbox: Optional[List[float]] = Field(None, min_items=4, max_items=4, description="[min_lon, min_lat, max_lon, max_lat]")
 
-    @validator("coordinates", each_item=True)
-    def check_coord(cls, v):
-        if not isinstance(v, list) or len(v) != 2:
+    def reduz_geometria(self) -> bool:
+        return self.simplify_m is not None or self.zoom is not None or self.bbox is not None or self.geometries == "delta"
+
+    @validator("coordinates")
+    def check_coords(cls, v):
+        # One pass over the whole list instead of a Python call per coordinate.
+        if v is None:
+            return v
+        if any(len(c) != 2 for c in v):
             raise ValueError("Cada coordenada deve ser [lon, lat]")
-        lon, lat = v
+        if _fora_dos_limites([c[0] for c in v], [c[1] for c in v]):
+            raise ValueError("Coordenadas fora do intervalo permitido")
+        return v
+
+def _coordenadas_packed(codificado: str, dtype: str) -> List[Tuple[float, float]]:
+    try:
+        bruto = base64.b64decode(codificado, validate=True)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"coordinates_packed invalido: {e}") from e
+    arr = array("f" if dtype == "float32" else "d")
+    if len(bruto) % (2 * arr.itemsize):
+        raise HTTPException(status_code=422, detail="coordinates_packed deve ter pares lon,lat completos")
+    arr.frombytes(bruto)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    lons, lats = arr[0::2], arr[1::2]
+    if len(lons) < 2:
+        raise HTTPException(status_code=422, detail="Sao necessarias ao menos 2 coordenadas")
+    if _fora_dos_limites(lons, lats):
+        raise HTTPException(status_code=422, detail="Coordenadas fora do intervalo permitido")
+    return list(zip(lons, lats))
+
+def _coordenadas_polyline(body: "TrackRequest") -> List[Tuple[float, float]]:
+    try:
+        latlon = decode_polyline(body.polyline, body.polyline_precision)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"polyline invalida: {e}") from e
+    if len(latlon) < 2:
+        raise HTTPException(status_code=422, detail="Sao necessarias ao menos 2 coordenadas")
+    if _fora_dos_limites([c[1] for c in latlon], [c[0] for c in latlon]):
+        raise HTTPException(status_code=422, detail="Coordenadas fora do intervalo permitido")
+    return [(lon, lat) for lat, lon in latlon]
+
+class ProcessRequest(BaseModel):
+    points: List[List[float]] = Field(..., description="[lon, lat, ts] em ordem", min_items=2)
+    fence: Optional[List[List[float]]] = Field(None, description="Poligono [lon, lat] roteado pelo Valhalla")
+    timings: bool = False
+    hedge: bool = False
+    deadline_s: Optional[float] = Field(None, gt=0, description="Prazo total da trilha em segundos")
+
+    @validator("points", each_item=True)
+    def check_point(cls, v):
+        if not isinstance(v, list) or len(v) != 3:
+            raise ValueError("Cada ponto deve ser [lon, lat, ts]")
+        lon, lat, _ = v
         if not (-180.0 <= lon <= 180.0 and -90.0 <= lat <= 90.0):
             raise ValueError("Coordenadas fora do intervalo permitido")
         return v
@@ -39,41 +130,158 @@ class TrackRequest(BaseModel):
 async def ping():
     return {"msg": "pong"}
 
+def _osrm_base() -> str:
+    return upstream_ativo(OSRM_BASEURL)
+
+def _checar_admin(request: Request, token: Optional[str]) -> None:
+    if ADMIN_TOKEN:
+        if token != ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="token de admin invalido")
+    elif not request.client or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403, detail="admin apenas via localhost")
+
+@app.get("/admin/osrm")
+async def admin_osrm(request: Request, x_admin_token: Optional[str] = Header(None)):
+    _checar_admin(request, x_admin_token)
+    base = _osrm_base()
+    return {"upstream": base, "dataset": dataset_de(base), "em_voo": dict(_em_voo), "pid": os.getpid(),
+            "hints": estatisticas_hints(), "backends": estado_backends()}
+
+@app.get("/admin/osrm/replay")
+async def admin_replay(request: Request, n: int = 500, x_admin_token: Optional[str] = Header(None)):
+    _checar_admin(request, x_admin_token)
+    recentes = list(_recentes)
+    return {"requests": recentes[-n:] if n > 0 else []}
+
 @app.get("/healthz")
 async def healthz():
-    url = f"{OSRM_BASEURL}/nearest/v1/driving/0,0"
+    base = _osrm_base()
+    url = f"{base}/nearest/v1/driving/0,0"
     try:
         async with httpx.AsyncClient(timeout=2.0) as client:
             r = await client.get(url)
             ok = r.status_code == 200
     except Exception:
         ok = False
-    return {"ok": ok, "osrm": OSRM_BASEURL}
+    return {"ok": ok, "osrm": base}
 
-@app.post("/api/track")
-async def track(body: TrackRequest):
-    coords = ";".join([f"{lon},{lat}" for lon, lat in body.coordinates])
+async def _get_osrm(client: httpx.AsyncClient, host: str, url: str) -> httpx.Response:
+    _em_voo[host] = _em_voo.get(host, 0) + 1
+    try:
+        return await chamada_limitada_async(url, OSRM_TIMEOUT_S, lambda t: client.get(url, timeout=t))
+    except BackendIndisponivel as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    except httpx.InvalidURL as e:
+        raise HTTPException(status_code=413, detail=f"URL do OSRM muito longa ({e}); envie as coordenadas como polyline") from e
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Erro ao contatar OSRM: {e}") from e
+    finally:
+        _em_voo[host] -= 1
+
+async def _rota_osrm(client: httpx.AsyncClient, host: str, body: TrackRequest,
+                     coordinates: Optional[Sequence[Sequence[float]]], polyline: Optional[str] = None):
+    if polyline is not None:
+        fn = "polyline6" if body.polyline_precision == 6 else "polyline"
+        coords = f"{fn}({quote(polyline, safe='')})"
+    elif len(coordinates) > TRACK_POLYLINE_MIN_COORDS:
+        coords = f"polyline6({quote(encode_polyline([(lat, lon) for lon, lat in coordinates], 6), safe='')})"
+    else:
+        coords = ";".join([f"{lon},{lat}" for lon, lat in coordinates])
+    geometries = "geojson" if body.reduz_geometria() else body.geometries
     url = (
-        f"{OSRM_BASEURL}/route/v1/{body.profile}/{coords}"
-        f"?overview={body.overview}&geometries={body.geometries}"
+        f"{host}/route/v1/{body.profile}/{coords}"
+        f"?overview={body.overview}&geometries={geometries}"
         f"&steps={'true' if body.steps else 'false'}"
         f"&annotations={body.annotations if body.annotations else 'false'}"
     )
-
-    try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.get(url)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Erro ao contatar OSRM: {e}") from e
+    dataset = dataset_de(host)
+    # Hints would undo the shorter URL of the polyline path, so they only go with plain coordinates.
+    com_coords = polyline is None and len(coordinates) <= TRACK_POLYLINE_MIN_COORDS
+    hints = hints_para(coordinates, dataset) if com_coords else None
+    resp = await _get_osrm(client, host, com_hints(url, hints))
+    if hints and rejeitou_hints(resp):
+        descartar_hints(coordinates, dataset)
+        resp = await _get_osrm(client, host, url)
 
     if resp.status_code != 200:
         raise HTTPException(status_code=resp.status_code, detail=resp.text)
+    _recentes.append(url[len(host):])
 
     data = resp.json()
+    if com_coords:
+        guardar_hints(coordinates, dataset, data.get("waypoints"))
+    routes = data.get("routes")
+    if routes and body.reduz_geometria():
+        routes = [_reduzir_rota(r, body) for r in routes]
     return {
         "source": "osrm",
         "osrm_url": url,
         "waypoints": data.get("waypoints"),
-        "routes": data.get("routes"),
+        "routes": routes,
         "code": data.get("code", "Ok"),
     }
+
+def _reduzir_rota(rota: Dict[str, Any], body: TrackRequest) -> Dict[str, Any]:
+    geom = rota.get("geometry")
+    if not isinstance(geom, dict) or not geom.get("coordinates"):
+        return rota
+    coords = geom["coordinates"]
+    partes = reduzir(coords, tol_m=body.simplify_m, zoom=body.zoom, bbox=body.bbox)
+    return dict(rota, geometry=codificar(partes, body.geometries),
+                geometry_vertices={"in": len(coords), "out": sum(len(p) for p in partes)})
+
+@app.post("/api/track")
+async def track(body: TrackRequest):
+    informados = [body.coordinates is not None, body.polyline is not None, body.coordinates_packed is not None]
+    if sum(informados) != 1:
+        raise HTTPException(status_code=422, detail="Informe exatamente um de coordinates, polyline ou coordinates_packed")
+    if body.polyline is not None and registro() is None:
+        # Single backend: OSRM decodes the polyline itself.
+        async with httpx.AsyncClient(timeout=OSRM_TIMEOUT_S) as client:
+            return await _rota_osrm(client, _osrm_base(), body, None, polyline=body.polyline)
+    if body.polyline is not None:
+        coordinates = _coordenadas_polyline(body)
+    elif body.coordinates_packed is not None:
+        coordinates = _coordenadas_packed(body.coordinates_packed, body.packed_dtype)
+    else:
+        coordinates = body.coordinates
+    partes = dividir_por_regiao(coordinates, _osrm_base())
+    async with httpx.AsyncClient(timeout=OSRM_TIMEOUT_S) as client:
+        if len(partes) == 1:
+            return await _rota_osrm(client, partes[0][0], body, partes[0][1], polyline=body.polyline)
+        # Cross-region request: one route per regional instance, each leg
+        # ending at the first coordinate of the next region so they connect.
+        # A lone destination in a new region is routed by the previous leg.
+        if len(partes[-1][1]) < 2:
+            _, resto = partes.pop()
+            partes[-1] = (partes[-1][0], partes[-1][1] + resto)
+        pedidos = []
+        for i, (host, coordinates) in enumerate(partes):
+            fim = [partes[i + 1][1][0]] if i + 1 < len(partes) else []
+            pedidos.append(_rota_osrm(client, host, body, coordinates + fim))
+        respostas = await asyncio.gather(*pedidos)
+    reg = registro()
+    return {
+        "source": "osrm",
+        "partes": [
+            dict(r, regiao=(reg.regiao_de(*coordinates[0]) or {}).get("nome") if reg else None)
+            for r, (_, coordinates) in zip(respostas, partes)
+        ],
+        "code": "Ok",
+    }
+
+@app.post("/api/process")
+async def process(body: ProcessRequest):
+    pontos = [(float(lon), float(lat), int(ts)) for lon, lat, ts in body.points]
+    geojson_data, msg, ok = await processar_uma_trilha_async(
+        pontos,
+        host=_osrm_base(),
+        valhalla_host=VALHALLA_BASEURL,
+        fence_poly=body.fence,
+        timings=body.timings,
+        hedge=body.hedge,
+        deadline_s=body.deadline_s or PROCESS_PRAZO_S,
+    )
+    if not ok:
+        raise HTTPException(status_code=422, detail=msg)
+    return geojson_data
@@ -0,0 +1,115 @@
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Registry of regional OSRM instances, e.g.
+# {"regioes": [{"nome": "sp", "host": "http://10.0.0.5:5001",
+#               "poligono": [[lon, lat], ...]}, ...]}
+# Points outside every polygon go to the host passed by the caller.
+REGIOES_ARQUIVO = os.getenv("OSRM_REGIOES", "")
+REGIOES_GRADE_DEG = 0.25
+REGIAO_MIN_PONTOS = 3
+
+
+def _ponto_no_poligono(lon: float, lat: float, poly: Sequence[Sequence[float]]) -> bool:
+    inside = False
+    n = len(poly)
+    j = n - 1
+    for i in range(n):
+        xi, yi = poly[i][0], poly[i][1]
+        xj, yj = poly[j][0], poly[j][1]
+        if (yi > lat) != (yj > lat):
+            x_int = (xj - xi) * (lat - yi) / ((yj - yi) or 1e-12) + xi
+            if lon < x_int:
+                inside = not inside
+        j = i
+    return inside
+
+
+class RegistroRegioes:
+    """Regional OSRM backends looked up through a uniform grid over their bounding boxes."""
+
+    def __init__(self, regioes: List[Dict[str, Any]], grade_deg: float = REGIOES_GRADE_DEG):
+        self.regioes = [r for r in regioes if r.get("host") and len(r.get("poligono") or []) >= 3]
+        self.grade_deg = grade_deg
+        self._grade: Dict[Tuple[int, int], List[int]] = {}
+        for idx, r in enumerate(self.regioes):
+            lons = [p[0] for p in r["poligono"]]
+            lats = [p[1] for p in r["poligono"]]
+            for cx in range(self._celula(min(lons)), self._celula(max(lons)) + 1):
+                for cy in range(self._celula(min(lats)), self._celula(max(lats)) + 1):
+                    self._grade.setdefault((cx, cy), []).append(idx)
+
+    def _celula(self, v: float) -> int:
+        return int(math.floor(v / self.grade_deg))
+
+    def regiao_de(self, lon: float, lat: float) -> Optional[Dict[str, Any]]:
+        for idx in self._grade.get((self._celula(lon), self._celula(lat)), ()):
+            r = self.regioes[idx]
+            if _ponto_no_poligono(lon, lat, r["poligono"]):
+                return r
+        return None
+
+    def host_de(self, lon: float, lat: float, padrao: str) -> str:
+        r = self.regiao_de(lon, lat)
+        return r["host"] if r else padrao
+
+    def dividir(self, pontos: Sequence[Tuple], padrao: str) -> List[Tuple[str, List[Tuple]]]:
+        """
+        Split a sequence of (lon, lat, ...) points into runs served by one host.
+
+        Runs shorter than REGIAO_MIN_PONTOS (GPS jitter along a border) are
+        folded into the previous run instead of producing tiny requests.
+        """
+        partes: List[Tuple[str, List[Tuple]]] = []
+        for p in pontos:
+            host = self.host_de(p[0], p[1], padrao)
+            if partes and partes[-1][0] == host:
+                partes[-1][1].append(p)
+            else:
+                if len(partes) >= 2 and len(partes[-1][1]) < REGIAO_MIN_PONTOS and partes[-2][0] == host:
+                    curto = partes.pop()[1]
+                    partes[-1][1].extend(curto)
+                    partes[-1][1].append(p)
+                    continue
+                partes.append((host, [p]))
+        return partes
+
+
+_registro: Optional[RegistroRegioes] = None
+_registro_carregado = False
+
+
+def carregar_registro(path: str) -> Optional[RegistroRegioes]:
+    global _registro, _registro_carregado
+    _registro_carregado = True
+    _registro = None
+    if not path:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        regioes = data.get("regioes") if isinstance(data, dict) else data
+        _registro = RegistroRegioes(regioes or [])
+    except Exception as e:
+        print(f"Falha ao carregar regioes OSRM de {path}: {e}")
+    return _registro
+
+
+def registro() -> Optional[RegistroRegioes]:
+    if not _registro_carregado:
+        carregar_registro(REGIOES_ARQUIVO)
+    return _registro
+
+
+def dividir_por_regiao(pontos: Sequence[Tuple], padrao: str) -> List[Tuple[str, List[Tuple]]]:
+    reg = registro()
+    if reg is None or not reg.regioes:
+        return [(padrao, list(pontos))] if pontos else []
+    return reg.dividir(pontos, padrao)
+
+
+def host_para(lon: float, lat: float, padrao: str) -> str:
+    reg = registro()
+    return reg.host_de(lon, lat, padrao) if reg is not None else padrao
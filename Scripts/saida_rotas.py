@@ -0,0 +1,203 @@
+import gzip
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+FORMATOS = ("json", "json.gz", "ndjson", "ndjson.gz", "pretty")
+FORMATO_DEFAULT = "json"
+CHUNK_COORDS = 4096
+BUFFER_CHARS = 1 << 16
+
+
+def encode_polyline(coords_latlon: List[Tuple[float, float]], precision: int = 6) -> str:
+    factor = 10 ** precision
+    out: List[str] = []
+    prev_lat, prev_lon = 0, 0
+    for lat, lon in coords_latlon:
+        ilat = int(round(lat * factor))
+        ilon = int(round(lon * factor))
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            v = ~(delta << 1) if delta < 0 else (delta << 1)
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1F)) + 63))
+                v >>= 5
+            out.append(chr(v + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def decode_polyline(encoded: str, precision: int = 6) -> List[Tuple[float, float]]:
+    factor = float(10 ** precision)
+    out: List[Tuple[float, float]] = []
+    idx, n = 0, len(encoded)
+    lat = lon = 0
+    while idx < n:
+        valores = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if idx >= n:
+                    raise ValueError("polyline truncada")
+                b = ord(encoded[idx]) - 63
+                idx += 1
+                if b < 0 or b > 63:
+                    raise ValueError("caractere invalido na polyline")
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            valores.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += valores[0]
+        lon += valores[1]
+        out.append((lat / factor, lon / factor))
+    return out
+
+
+def _lista_numerica(obj: Any) -> bool:
+    if not isinstance(obj, list) or not obj:
+        return False
+    primeiro = obj[0]
+    return isinstance(primeiro, (list, tuple)) and bool(primeiro) and all(type(v) in (int, float) for v in primeiro)
+
+
+def _iter_json(obj: Any) -> Iterator[str]:
+    if isinstance(obj, dict):
+        yield "{"
+        primeiro = True
+        for k, v in obj.items():
+            if not primeiro:
+                yield ","
+            primeiro = False
+            yield json.dumps(str(k), ensure_ascii=False)
+            yield ":"
+            yield from _iter_json(v)
+        yield "}"
+    elif _lista_numerica(obj):
+        yield "["
+        for i in range(0, len(obj), CHUNK_COORDS):
+            if i:
+                yield ","
+            yield ",".join("[" + ",".join(map(repr, c)) + "]" for c in obj[i:i + CHUNK_COORDS])
+        yield "]"
+    elif isinstance(obj, (list, tuple)):
+        yield "["
+        for i, v in enumerate(obj):
+            if i:
+                yield ","
+            yield from _iter_json(v)
+        yield "]"
+    else:
+        yield json.dumps(obj, ensure_ascii=False)
+
+
+def _iter_ndjson_polyline(geojson: Dict[str, Any]) -> Iterator[str]:
+    feats = geojson.get("features") if isinstance(geojson, dict) else None
+    if feats is None:
+        feats = [geojson]
+    for feat in feats:
+        geom = (feat or {}).get("geometry") or {}
+        if geom.get("type") == "LineString":
+            enc = encode_polyline([(c[1], c[0]) for c in geom.get("coordinates") or []], 6)
+            linha = {"type": "Feature", "properties": feat.get("properties") or {},
+                     "geometry": {"type": "LineString", "polyline6": enc}}
+        else:
+            linha = feat
+        yield json.dumps(linha, ensure_ascii=False, separators=(",", ":"))
+        yield "\n"
+
+
+def formato_de(path: Path) -> str:
+    nome = path.name.lower()
+    gz = nome.endswith(".gz")
+    if gz:
+        nome = nome[:-3]
+    base = "ndjson" if nome.endswith(".ndjson") else "json"
+    return base + (".gz" if gz else "")
+
+
+def destino_com_formato(path: Path, formato: str) -> Path:
+    path = Path(path)
+    if formato in ("json", "pretty"):
+        return path
+    base = path.name[:-3] if path.name.endswith(".gz") else path.name
+    if formato.startswith("ndjson"):
+        base = Path(base).with_suffix(".ndjson").name
+    if formato.endswith(".gz"):
+        base += ".gz"
+    return path.with_name(base)
+
+
+def escrever(obj: Any, path: Path, formato: Optional[str] = None) -> Path:
+    """
+    Serialize ``obj`` to ``path`` once, streaming large coordinate arrays.
+
+    json / json.gz        compact GeoJSON
+    ndjson / ndjson.gz    one Feature per line, LineStrings as polyline6
+    pretty                indent=2, for inspection by hand
+    """
+    path = Path(path)
+    formato = formato or formato_de(path)
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de saida desconhecido: {formato}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique temp name: several workers may write the same output at once.
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    if formato.endswith(".gz"):
+        f = gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6)
+    else:
+        f = open(tmp, "w", encoding="utf-8")
+    try:
+        with f:
+            if formato == "pretty":
+                json.dump(obj, f, ensure_ascii=False, indent=2)
+            else:
+                partes = _iter_ndjson_polyline(obj) if formato.startswith("ndjson") else _iter_json(obj)
+                buf: List[str] = []
+                tam = 0
+                for parte in partes:
+                    buf.append(parte)
+                    tam += len(parte)
+                    if tam >= BUFFER_CHARS:
+                        f.write("".join(buf))
+                        buf, tam = [], 0
+                if buf:
+                    f.write("".join(buf))
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            tmp.unlink()
+        except Exception:
+            pass
+        raise
+    return path
+
+
+def escrever_saidas(obj: Any, destinos: List[Path], formato: Optional[str] = None) -> Dict[Path, Optional[str]]:
+    """
+    Write ``obj`` to every destination, encoding each format only once.
+
+    The first destination of each format is serialized; the others receive a
+    byte copy of that file.  Returns {path: None on success | error message}.
+    """
+    resultado: Dict[Path, Optional[str]] = {}
+    por_formato: Dict[str, List[Path]] = {}
+    for d in destinos:
+        d = Path(d)
+        fmt = formato or formato_de(d)
+        por_formato.setdefault(fmt, []).append(destino_com_formato(d, fmt) if formato else d)
+    for fmt, paths in por_formato.items():
+        origem: Optional[Path] = None
+        for p in paths:
+            try:
+                if origem is None:
+                    origem = escrever(obj, p, fmt)
+                else:
+                    p.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(origem, p)
+                resultado[p] = None
+            except Exception as e:
+                resultado[p] = str(e)
+    return resultado
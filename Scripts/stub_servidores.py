@@ -0,0 +1,263 @@
+import json
+import math
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from hints_osrm import coord_fixa
+from saida_rotas import decode_polyline, encode_polyline
+
+STUB_HOST_DEFAULT = "127.0.0.1"
+STUB_PORT_DEFAULT = 5099
+
+
+def _parse_coords(path_coords: str) -> List[List[float]]:
+    texto = unquote(path_coords)
+    for fn, precisao in (("polyline6(", 6), ("polyline(", 5)):
+        if texto.startswith(fn) and texto.endswith(")"):
+            return [[lon, lat] for lat, lon in decode_polyline(texto[len(fn):-1], precisao)]
+    coords: List[List[float]] = []
+    for pair in texto.split(";"):
+        if not pair:
+            continue
+        lon_str, lat_str = pair.split(",", 1)
+        coords.append([float(lon_str), float(lat_str)])
+    return coords
+
+
+def _interpolar(coords: List[List[float]], step_m: float) -> List[List[float]]:
+    if not coords:
+        return []
+    out = [coords[0]]
+    for a, b in zip(coords, coords[1:]):
+        mean_lat = math.radians((a[1] + b[1]) / 2.0)
+        dist = math.hypot((b[0] - a[0]) * 111000.0 * math.cos(mean_lat), (b[1] - a[1]) * 111000.0)
+        n = int(dist // step_m) if step_m > 0 else 0
+        for k in range(1, n):
+            t = k / float(n)
+            out.append([a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1])])
+        out.append(b)
+    return out
+
+
+def _hint_stub(c: List[float]) -> str:
+    # osrm-routed keeps the input coordinate in the hint, in 1e-6 degree fixed point.
+    return f"stub_{coord_fixa(c[0])}_{coord_fixa(c[1])}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Deterministic stand-in for osrm-routed and Valhalla.
+
+    /match echoes the input coordinates as the matched geometry, /route and
+    Valhalla /route interpolate straight lines, /trace_route echoes the shape
+    and /locate always reports a residential edge 1 m away.  Latency and
+    failure injection are taken from the server attributes (``latencias``,
+    ``falhas`` and ``limites`` are keyed by route: match, route, nearest,
+    locate, trace_route, valhalla_route; ``limites`` fails any request with
+    more coordinates than the limit).  Per-coordinate latency is only charged
+    for coordinates without a ``hints=`` entry, like the nearest edge search
+    OSRM skips for hinted waypoints, and only when the hint was issued for
+    that exact input coordinate; hints not issued by the stub are rejected
+    with InvalidHint.  With ``nucleos`` set, at most that many
+    requests are served at once and the rest wait, as in osrm-routed.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, keep-alive
+    # requests stall ~40 ms on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status: int, obj: Any) -> None:
+        body = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _esperar(self, rota: str = "") -> None:
+        srv = self.server
+        atraso = getattr(srv, "latencia_s", 0.0) + getattr(srv, "latencias", {}).get(rota, 0.0)
+        por_coord = getattr(srv, "latencia_por_coord_s", 0.0)
+        if atraso > 0 or por_coord > 0:
+            espera = atraso + por_coord * (getattr(self, "_n_coords", 0) - getattr(self, "_n_hints", 0))
+            nucleos = getattr(srv, "nucleos", None)
+            if nucleos is None:
+                time.sleep(espera)
+                return
+            # Like the osrm-routed thread pool: requests beyond the cores queue.
+            with nucleos:
+                time.sleep(espera)
+
+    def _falhar(self, rota: str) -> bool:
+        limite = getattr(self.server, "limites", {}).get(rota)
+        if limite is not None and getattr(self, "_n_coords", 0) > limite:
+            return True
+        falhas = getattr(self.server, "falhas", {})
+        taxa = falhas.get(rota, 0.0)
+        if taxa <= 0:
+            return False
+        with self.server.lock:
+            self.server.contador[rota] = self.server.contador.get(rota, 0) + 1
+            n = self.server.contador[rota]
+        return (n * taxa) % 1.0 < taxa
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        partes = url.path.strip("/").split("/")
+        qs = parse_qs(url.query)
+        if url.path == "/status":
+            self._responder(200, {"version": "stub", "tileset_last_modified": 0})
+            return
+        if len(partes) < 4 or partes[0] not in ("match", "route", "nearest"):
+            self._responder(400, {"code": "InvalidUrl"})
+            return
+        servico = partes[0]
+        coords = _parse_coords(partes[3])
+        self._n_coords = len(coords)
+        self._n_hints = 0
+        if "hints" in qs:
+            hints = qs["hints"][0].split(";")
+            if len(hints) != len(coords):
+                self._responder(400, {"code": "InvalidOptions", "message": "Number of hints does not match"})
+                return
+            if any(h and not h.startswith("stub") for h in hints):
+                self._responder(400, {"code": "InvalidHint"})
+                return
+            # Like Hint::IsValid: a hint issued for another input coordinate is ignored.
+            self._n_hints = sum(1 for h, c in zip(hints, coords) if h and h == _hint_stub(c))
+        self._esperar(servico)
+        if self._falhar(servico):
+            self._responder(400, {"code": "NoMatch" if servico == "match" else "NoRoute"})
+            return
+        waypoints = [{"location": c, "name": "", "hint": _hint_stub(c)} for c in coords]
+        if servico == "nearest":
+            self._responder(200, {"code": "Ok", "waypoints": waypoints[:1]})
+            return
+        if servico == "match":
+            tracepoints = [dict(w, matchings_index=0, waypoint_index=i) for i, w in enumerate(waypoints)]
+            self._responder(200, {
+                "code": "Ok",
+                "tracepoints": tracepoints,
+                "matchings": [{
+                    "confidence": 1.0,
+                    "geometry": {"type": "LineString", "coordinates": coords},
+                    "distance": 0.0,
+                    "duration": 0.0,
+                }],
+            })
+            return
+        geom = _interpolar(coords, 25.0)
+        if (qs.get("geometries") or ["geojson"])[0] != "geojson":
+            geom_out: Any = encode_polyline([(c[1], c[0]) for c in geom], 6 if qs.get("geometries") == ["polyline6"] else 5)
+        else:
+            geom_out = {"type": "LineString", "coordinates": geom}
+        self._responder(200, {
+            "code": "Ok",
+            "waypoints": waypoints,
+            "routes": [{"geometry": geom_out, "distance": 0.0, "duration": 0.0, "legs": []}],
+        })
+
+    def do_POST(self):
+        self._n_hints = 0
+        n = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(n) or b"{}")
+        except Exception:
+            self._responder(400, {"error": "json"})
+            return
+        path = urlsplit(self.path).path
+        if path == "/locate":
+            locs = payload.get("locations") or []
+            self._n_coords = len(locs)
+            self._esperar("locate")
+            self._responder(200, {"locations": [
+                {"correlation": {"edges": [{"distance": 1.0, "road_class": "residential", "use": "road"}]}}
+                for _ in locs
+            ]})
+            return
+        if path == "/trace_route":
+            shape = payload.get("shape") or []
+            self._n_coords = len(shape)
+            self._esperar("trace_route")
+            if self._falhar("trace_route"):
+                self._responder(400, {"error": "No suitable edges near location"})
+                return
+            coords = [[float(p["lon"]), float(p["lat"])] for p in shape]
+            self._responder(200, {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {}, "geometry": {"type": "LineString", "coordinates": coords}}
+            ]})
+            return
+        if path == "/route":
+            locs = payload.get("locations") or []
+            self._n_coords = len(locs)
+            self._esperar("valhalla_route")
+            if self._falhar("valhalla_route"):
+                self._responder(400, {"error": "No path could be found"})
+                return
+            coords = _interpolar([[float(p["lon"]), float(p["lat"])] for p in locs], 25.0)
+            shape = encode_polyline([(c[1], c[0]) for c in coords], 6)
+            self._responder(200, {"trip": {"legs": [{"shape": shape}], "status": 0}})
+            return
+        self._responder(404, {"error": "not found"})
+
+
+def iniciar_stub(host: str = STUB_HOST_DEFAULT,
+                 port: int = 0,
+                 latencia_s: float = 0.0,
+                 latencia_por_coord_s: float = 0.0,
+                 falhas: Optional[Dict[str, float]] = None,
+                 latencias: Optional[Dict[str, float]] = None,
+                 limites: Optional[Dict[str, int]] = None,
+                 nucleos: Optional[int] = None) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), StubHandler)
+    srv.daemon_threads = True
+    srv.latencia_s = latencia_s
+    srv.latencia_por_coord_s = latencia_por_coord_s
+    srv.falhas = dict(falhas or {})
+    srv.latencias = dict(latencias or {})
+    srv.limites = dict(limites or {})
+    srv.nucleos = threading.BoundedSemaphore(nucleos) if nucleos else None
+    srv.contador = {}
+    srv.lock = threading.Lock()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def url_stub(srv: ThreadingHTTPServer) -> str:
+    host, port = srv.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def main():
+    port = STUB_PORT_DEFAULT
+    latencia = 0.0
+    por_coord = 0.0
+    nucleos = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--port="):
+            port = int(arg.split("=", 1)[1])
+        elif arg.startswith("--latencia="):
+            latencia = float(arg.split("=", 1)[1])
+        elif arg.startswith("--latencia-por-coord="):
+            por_coord = float(arg.split("=", 1)[1])
+        elif arg.startswith("--nucleos="):
+            nucleos = int(arg.split("=", 1)[1])
+    srv = iniciar_stub(port=port, latencia_s=latencia, latencia_por_coord_s=por_coord, nucleos=nucleos)
+    print(f"Stub OSRM/Valhalla em {url_stub(srv)} (latencia {latencia:.3f} s)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import pytest
+
+from cache_rotas import chave_canonica
+
+COORDS = [(-46.633301, -23.550501), (-46.641207, -23.561804)]
+PARAMS = {"geometries": "geojson", "overview": "full", "continue_straight": "true"}
+
+
+def test_jitter_abaixo_da_grade_gera_mesma_chave():
+    tremido = [(lon + 2e-7, lat - 3e-7) for lon, lat in COORDS]
+    assert chave_canonica("route", tremido, PARAMS) == chave_canonica("route", COORDS, PARAMS)
+
+
+def test_repr_do_float_nao_muda_a_chave():
+    assert chave_canonica("route", [(-46.6333010000001, -23.5505009999999), COORDS[1]], PARAMS) == \
+        chave_canonica("route", COORDS, PARAMS)
+
+
+def test_ordem_dos_parametros_nao_muda_a_chave():
+    invertidos = dict(reversed(list(PARAMS.items())))
+    assert chave_canonica("route", COORDS, invertidos) == chave_canonica("route", COORDS, PARAMS)
+
+
+def test_parametros_como_texto_ou_numero_coincidem():
+    assert chave_canonica("match", COORDS, {"radiuses": 12}) == chave_canonica("match", COORDS, {"radiuses": "12"})
+
+
+@pytest.mark.parametrize("outra", [
+    lambda: chave_canonica("route", [(-46.633301 + 2e-5, -23.550501), COORDS[1]], PARAMS),
+    lambda: chave_canonica("route", list(reversed(COORDS)), PARAMS),
+    lambda: chave_canonica("route", COORDS, dict(PARAMS, overview="simplified")),
+    lambda: chave_canonica("match", COORDS, PARAMS),
+    lambda: chave_canonica("route", COORDS, PARAMS, quant_deg=1e-4),
+])
+def test_requisicoes_diferentes_geram_chaves_diferentes(outra):
+    assert outra() != chave_canonica("route", COORDS, PARAMS)
+
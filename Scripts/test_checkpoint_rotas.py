@@ -0,0 +1,83 @@
+import pytest
+
+import cache_rotas
+import checkpoint_rotas
+
+PARAMS = checkpoint_rotas.chave_parametros(variante="teste")
+
+
+@pytest.fixture(autouse=True)
+def cache_temporario(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_rotas, "CACHE_DIR", tmp_path)
+
+
+def _trilha(n):
+    return [(-46.8 + i * 0.0002, -23.5 + (i % 7) * 0.00005, i * 10) for i in range(n)]
+
+
+def _caminho(pontos, chamadas=None):
+    # A segment starts at the first point and at every timestamp multiple of 300,
+    # alternating engines, so the segmentation does not depend on where a run starts.
+    if chamadas is not None:
+        chamadas.append(pontos[0][2])
+    inicios = [p[2] for i, p in enumerate(pontos) if i == 0 or p[2] % 300 == 0]
+    props = {
+        "segment_start_ts": inicios,
+        "segment_engines": ["osrm" if (t // 300) % 2 == 0 else "valhalla" for t in inicios],
+    }
+    return [[lon, lat] for lon, lat, _ in pontos], props
+
+
+def _incremental(pontos, chamadas=None):
+    return checkpoint_rotas.processar_incremental("t1", PARAMS, pontos, lambda p: _caminho(p, chamadas), lambda c: c)
+
+
+def test_segunda_execucao_processa_so_a_cauda_e_iguala_o_total():
+    pontos = _trilha(100)
+    _incremental(pontos[:60])
+    chamadas = []
+    caminho, props = _incremental(pontos, chamadas)
+
+    k = 60 - 1 - checkpoint_rotas.CHECKPOINT_OVERLAP_PONTOS
+    assert chamadas == [pontos[k][2]]
+    assert props["checkpoint"] == {"incremental": True, "pontos_novos": 40, "offset": k}
+    caminho_total, props_total = _caminho(pontos)
+    assert caminho == caminho_total
+    for c in ("segment_start_ts", "segment_engines"):
+        assert props[c] == props_total[c]
+
+
+def test_varias_execucoes_acumulam_propriedades_por_segmento():
+    pontos = _trilha(200)
+    for n in (40, 75, 110, 160, 200):
+        caminho, props = _incremental(pontos[:n])
+    caminho_total, props_total = _caminho(pontos)
+    assert caminho == caminho_total
+    assert props["segment_start_ts"] == props_total["segment_start_ts"]
+    assert props["segment_engines"] == props_total["segment_engines"]
+
+
+def test_mesma_entrada_nao_reprocessa():
+    pontos = _trilha(80)
+    primeiro, _ = _incremental(pontos)
+    chamadas = []
+    caminho, props = _incremental(pontos, chamadas)
+    assert chamadas == []
+    assert caminho == primeiro
+    assert props["checkpoint"]["pontos_novos"] == 0
+
+
+def test_parametros_diferentes_ignoram_o_checkpoint():
+    pontos = _trilha(80)
+    _incremental(pontos[:50])
+    chamadas = []
+    checkpoint_rotas.processar_incremental("t1", "outros", pontos, lambda p: _caminho(p, chamadas), lambda c: c)
+    assert chamadas == [pontos[0][2]]
+
+
+def test_juntar_propriedades_une_segmento_que_continua_no_corte():
+    anteriores = {"segment_start_ts": [0, 300, 600], "segment_engines": ["osrm", "valhalla", "osrm"]}
+    novas = {"segment_start_ts": [450, 600], "segment_engines": ["valhalla", "osrm"]}
+    out = checkpoint_rotas.juntar_propriedades(anteriores, novas, 450)
+    assert out["segment_start_ts"] == [0, 300, 600]
+    assert out["segment_engines"] == ["osrm", "valhalla", "osrm"]
@@ -0,0 +1,135 @@
+import time
+
+import cliente_backend
+from cliente_backend import Disjuntor, Limitador
+
+
+def _abrir(d, falhas):
+    for _ in range(falhas):
+        assert d.permitir()
+        d.falha()
+
+
+def test_disjuntor_abre_apos_falhas_seguidas():
+    d = Disjuntor(limiar=3, aberto_s=60.0)
+    _abrir(d, 2)
+    assert d.estado == Disjuntor.FECHADO
+    _abrir(d, 1)
+    assert d.estado == Disjuntor.ABERTO
+    assert not d.permitir()
+    assert d.rejeitados == 1
+
+
+def test_sucesso_zera_a_contagem_de_falhas():
+    d = Disjuntor(limiar=3, aberto_s=60.0)
+    _abrir(d, 2)
+    d.sucesso()
+    _abrir(d, 2)
+    assert d.estado == Disjuntor.FECHADO
+
+
+def test_meio_aberto_deixa_passar_uma_sonda():
+    d = Disjuntor(limiar=1, aberto_s=0.05)
+    _abrir(d, 1)
+    time.sleep(0.06)
+    assert d.permitir()
+    assert d.estado == Disjuntor.MEIO_ABERTO
+    assert not d.permitir()
+
+
+def test_sonda_com_sucesso_fecha():
+    d = Disjuntor(limiar=1, aberto_s=0.05)
+    _abrir(d, 1)
+    time.sleep(0.06)
+    assert d.permitir()
+    d.sucesso()
+    assert d.estado == Disjuntor.FECHADO
+    assert d.permitir() and d.permitir()
+
+
+def test_sonda_com_falha_reabre():
+    d = Disjuntor(limiar=5, aberto_s=0.05)
+    _abrir(d, 5)
+    time.sleep(0.06)
+    assert d.permitir()
+    d.falha()
+    assert d.estado == Disjuntor.ABERTO
+    assert not d.permitir()
+
+
+def test_sonda_liberada_sem_veredito_permite_outra():
+    d = Disjuntor(limiar=1, aberto_s=0.05)
+    _abrir(d, 1)
+    time.sleep(0.06)
+    assert d.permitir()
+    d.liberar_sonda()
+    assert d.estado == Disjuntor.MEIO_ABERTO
+    assert d.permitir()
+
+
+CLASSE = "route/3"
+
+
+def _em_carga(lim, ocupados):
+    for _ in range(ocupados):
+        assert lim.reservar(1.0)
+
+
+def _chamada(lim, rtt, falha=False):
+    assert lim.reservar(1.0)
+    lim.liberar(rtt, CLASSE, falha)
+
+
+def test_limite_cresce_com_rtt_estavel():
+    lim = Limitador(adaptativo=True)
+    _em_carga(lim, 12)
+    for _ in range(30):
+        _chamada(lim, 0.01)
+    assert lim.limite > cliente_backend.LIMITE_INICIAL
+
+
+def test_limite_nao_cresce_sem_uso():
+    lim = Limitador(adaptativo=True)
+    for _ in range(30):
+        _chamada(lim, 0.01)
+    assert lim.limite == cliente_backend.LIMITE_INICIAL
+
+
+def test_limite_encolhe_com_rtt_lento():
+    lim = Limitador(adaptativo=True)
+    for _ in range(5):
+        _chamada(lim, 0.01)
+    pico = lim.limite
+    for _ in range(40):
+        _chamada(lim, 0.1)
+    assert lim.limite < pico
+    assert lim.limite < cliente_backend.LIMITE_INICIAL
+    assert lim.limite >= cliente_backend.LIMITE_MIN
+
+
+def test_falha_recua_uma_vez_por_rtt():
+    lim = Limitador(adaptativo=True)
+    _chamada(lim, 0.05, falha=True)
+    assert lim.limite == cliente_backend.LIMITE_INICIAL * cliente_backend.LIMITE_RECUO
+    assert lim.recuos == 1
+    _chamada(lim, 0.05, falha=True)
+    assert lim.recuos == 1
+    time.sleep(0.06)
+    _chamada(lim, 0.05, falha=True)
+    assert lim.recuos == 2
+    assert lim.limite == cliente_backend.LIMITE_INICIAL * cliente_backend.LIMITE_RECUO ** 2
+
+
+def test_limitador_fixo_nao_se_ajusta():
+    lim = Limitador(adaptativo=False)
+    _chamada(lim, 0.05, falha=True)
+    _chamada(lim, 1.0)
+    assert lim.limite == cliente_backend.MAX_EM_VOO_POR_BACKEND
+
+
+def test_reserva_espera_vaga_quando_cheio():
+    lim = Limitador(adaptativo=False)
+    _em_carga(lim, cliente_backend.MAX_EM_VOO_POR_BACKEND)
+    assert not lim.reservar(0.01)
+    lim.liberar()
+    assert lim.reservar(0.01)
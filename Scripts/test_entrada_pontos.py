@@ -0,0 +1,16 @@
+import pytest
+
+import valhalla
+from entrada_pontos import normalizar
+
+
+def test_linhas_em_dict_sob_track_route_sao_ignoradas():
+    data = {"track": {"route": [{"lat": -23.5, "lon": -46.6}, {"lat": -23.51, "lon": -46.61}]}}
+    assert normalizar(data) == ([], True)
+    with pytest.raises(ValueError):
+        valhalla.normalize_points(data)
+
+
+def test_track_route_misturado_mantem_linhas_validas():
+    data = {"track": {"route": [[1700000000, -23.5, -46.6], {"lat": -23.51, "lon": -46.61}, [1700000002, -23.52, -46.62]]}}
+    assert normalizar(data) == ([(-46.6, -23.5, 1700000000), (-46.62, -23.52, 1700000002)], True)
@@ -0,0 +1,74 @@
+import pytest
+
+import fila_rotas
+
+
+@pytest.fixture
+def conn(tmp_path):
+    c = fila_rotas.abrir(str(tmp_path / "fila.db"))
+    yield c
+    c.close()
+
+
+def _estado(conn, job_id):
+    return conn.execute("SELECT estado, tentativas, worker FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def test_mesmo_job_entra_uma_vez(conn):
+    a, novo_a = fila_rotas.enfileirar(conn, {"arquivo": "a.json"})
+    b, novo_b = fila_rotas.enfileirar(conn, {"arquivo": "a.json"})
+    assert a == b and novo_a and not novo_b
+
+
+def test_reserva_por_prioridade(conn):
+    fila_rotas.enfileirar(conn, {"arquivo": "curto.json"}, prioridade=1.0)
+    longo, _ = fila_rotas.enfileirar(conn, {"arquivo": "longo.json"}, prioridade=10.0)
+    assert fila_rotas.reservar(conn, "w1")[0] == longo
+
+
+def test_lease_expirado_volta_para_a_fila(conn):
+    job_id, _ = fila_rotas.enfileirar(conn, {"arquivo": "a.json"})
+    assert fila_rotas.reservar(conn, "w1", lease_s=-1.0)[0] == job_id
+    assert fila_rotas.reservar(conn, "w2")[0] == job_id
+    assert tuple(_estado(conn, job_id)) == (fila_rotas.EXECUTANDO, 2, "w2")
+    # The worker that lost the lease can neither renew nor finish the job.
+    assert not fila_rotas.renovar(conn, job_id, "w1")
+    assert not fila_rotas.concluir(conn, job_id, "w1", {"ok": True})
+    assert fila_rotas.concluir(conn, job_id, "w2", {"ok": True})
+    assert _estado(conn, job_id)["estado"] == fila_rotas.FEITO
+
+
+def test_lease_renovado_nao_expira(conn):
+    job_id, _ = fila_rotas.enfileirar(conn, {"arquivo": "a.json"})
+    fila_rotas.reservar(conn, "w1", lease_s=-1.0)
+    assert fila_rotas.renovar(conn, job_id, "w1", lease_s=60.0)
+    assert fila_rotas.reservar(conn, "w2") is None
+
+
+def test_leases_expirados_esgotam_as_tentativas(conn):
+    job_id, _ = fila_rotas.enfileirar(conn, {"arquivo": "a.json"})
+    for _ in range(fila_rotas.FILA_MAX_TENTATIVAS):
+        assert fila_rotas.reservar(conn, "w1", lease_s=-1.0)[0] == job_id
+    assert fila_rotas.reservar(conn, "w1") is None
+    estado = _estado(conn, job_id)
+    assert estado["estado"] == fila_rotas.FALHOU
+    assert estado["tentativas"] == fila_rotas.FILA_MAX_TENTATIVAS
+
+
+def test_falhas_retentadas_ate_o_maximo(conn):
+    job_id, _ = fila_rotas.enfileirar(conn, {"arquivo": "a.json"})
+    for tentativa in range(1, fila_rotas.FILA_MAX_TENTATIVAS + 1):
+        assert fila_rotas.reservar(conn, "w1")[0] == job_id
+        assert fila_rotas.falhar(conn, job_id, "w1", "erro", retentar=True)
+        esperado = fila_rotas.FALHOU if tentativa == fila_rotas.FILA_MAX_TENTATIVAS else fila_rotas.PENDENTE
+        assert _estado(conn, job_id)["estado"] == esperado
+    assert fila_rotas.reservar(conn, "w1") is None
+
+
+def test_falha_sem_retentar_vai_direto_para_falhou(conn):
+    job_id, _ = fila_rotas.enfileirar(conn, {"arquivo": "a.json"})
+    fila_rotas.reservar(conn, "w1")
+    fila_rotas.falhar(conn, job_id, "w1", "entrada invalida", retentar=False)
+    assert _estado(conn, job_id)["estado"] == fila_rotas.FALHOU
+    assert fila_rotas.reenfileirar_falhas(conn) == 1
+    assert tuple(_estado(conn, job_id)) == (fila_rotas.PENDENTE, 0, None)
@@ -0,0 +1,78 @@
+import asyncio
+from collections import OrderedDict
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import hints_osrm
+import realtime_proxy_osrm as proxy
+import regioes_osrm
+
+REGIOES = [
+    {"nome": "a", "host": "http://a", "poligono": [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]},
+    {"nome": "b", "host": "http://b", "poligono": [[1.0, 0.0], [2.0, 0.0], [2.0, 1.0], [1.0, 1.0]]},
+]
+
+
+@pytest.fixture
+def pernas(monkeypatch):
+    monkeypatch.setattr(regioes_osrm, "_registro", regioes_osrm.RegistroRegioes(REGIOES))
+    monkeypatch.setattr(regioes_osrm, "_registro_carregado", True)
+    chamadas = []
+
+    async def rota_falsa(client, host, body, coordinates, polyline=None):
+        chamadas.append((host, [list(c) for c in coordinates]))
+        return {"source": "osrm", "routes": [], "code": "Ok"}
+
+    monkeypatch.setattr(proxy, "_rota_osrm", rota_falsa)
+    return chamadas
+
+
+def test_destino_sozinho_em_nova_regiao_entra_na_perna_anterior(pernas):
+    coords = [[0.2, 0.5], [0.4, 0.5], [0.6, 0.5], [1.5, 0.5]]
+    r = TestClient(proxy.app).post("/api/track", json={"coordinates": coords})
+    assert r.status_code == 200
+    assert pernas == [("http://a", coords)]
+    assert [p["regiao"] for p in r.json()["partes"]] == ["a"]
+
+
+def test_pernas_entre_regioes_se_conectam(pernas):
+    coords = [[0.2, 0.5], [0.4, 0.5], [0.6, 0.5], [1.5, 0.5], [1.7, 0.5]]
+    r = TestClient(proxy.app).post("/api/track", json={"coordinates": coords})
+    assert r.status_code == 200
+    assert pernas == [("http://a", coords[:4]), ("http://b", coords[3:])]
+
+
+@pytest.fixture
+def urls(monkeypatch):
+    monkeypatch.setattr(hints_osrm, "_hints", OrderedDict())
+    pedidas = []
+
+    async def get_falso(client, host, url):
+        pedidas.append(url)
+        return httpx.Response(200, json={"code": "Ok", "routes": [], "waypoints": []})
+
+    monkeypatch.setattr(proxy, "_get_osrm", get_falso)
+    return pedidas
+
+
+def _rota(coords):
+    body = proxy.TrackRequest(coordinates=coords)
+    return asyncio.run(proxy._rota_osrm(None, "http://a", body, coords))
+
+
+def test_hints_vao_com_coordenadas_simples(urls):
+    coords = [[0.001 * i, 0.5] for i in range(3)]
+    hints_osrm.guardar_hints(coords, "http://a", [{"hint": f"h{i}"} for i in range(3)])
+    _rota(coords)
+    assert "hints=h0;h1;h2" in urls[0]
+
+
+def test_trilha_em_polyline_nao_leva_hints(urls):
+    n = proxy.TRACK_POLYLINE_MIN_COORDS + 1
+    coords = [[0.001 * i, 0.5] for i in range(n)]
+    hints_osrm.guardar_hints(coords, "http://a", [{"hint": f"h{i}"} for i in range(n)])
+    _rota(coords)
+    assert "polyline6(" in urls[0]
+    assert "hints=" not in urls[0]
@@ -0,0 +1,75 @@
+import math
+import random
+from typing import Any, Dict, List, Tuple
+
+CENTRO_SP = (-46.6333, -23.5505)
+FORMAS = ("urbano", "rodovia", "saltos", "loop")
+
+_M_POR_GRAU = 111000.0
+
+
+def _passo(lon: float, lat: float, dx_m: float, dy_m: float) -> Tuple[float, float]:
+    return (lon + dx_m / (_M_POR_GRAU * math.cos(math.radians(lat))),
+            lat + dy_m / _M_POR_GRAU)
+
+
+def gerar_trilha(forma: str,
+                 n: int,
+                 seed: int = 0,
+                 origem: Tuple[float, float] = CENTRO_SP,
+                 ts0: int = 1_700_000_000,
+                 ruido_m: float = 4.0) -> List[Tuple[float, float, int]]:
+    """
+    Generate a deterministic (lon, lat, ts) track with ``n`` points.
+
+    urbano   ~10 m/s on a 100 m street grid with right-angle turns
+    rodovia  ~30 m/s with slowly drifting heading
+    saltos   urbano with a teleport (2 km, 60 s gap) every ~200 points
+    loop     laps of a 400 m radius circle
+    """
+    if forma not in FORMAS:
+        raise ValueError(f"Forma desconhecida: {forma}")
+    rnd = random.Random(seed)
+    lon, lat = origem
+    ts = ts0
+    heading = rnd.uniform(0, 2 * math.pi)
+    andado_quadra = 0.0
+    out: List[Tuple[float, float, int]] = []
+    for i in range(n):
+        if forma == "loop":
+            ang = 2 * math.pi * (i % 250) / 250.0
+            lon_c, lat_c = _passo(origem[0], origem[1], 400.0 * math.cos(ang), 400.0 * math.sin(ang))
+        else:
+            if forma == "rodovia":
+                heading += rnd.gauss(0.0, 0.01)
+                v = 30.0
+            else:
+                v = 10.0
+                andado_quadra += v
+                if andado_quadra >= 100.0:
+                    andado_quadra = 0.0
+                    heading += rnd.choice((-math.pi / 2, 0.0, 0.0, math.pi / 2))
+            lon, lat = _passo(lon, lat, v * math.cos(heading), v * math.sin(heading))
+            if forma == "saltos" and i > 0 and i % 200 == 0:
+                lon, lat = _passo(lon, lat, 2000.0 * math.cos(heading + 1.0), 2000.0 * math.sin(heading + 1.0))
+                ts += 60
+            lon_c, lat_c = lon, lat
+        lon_c, lat_c = _passo(lon_c, lat_c, rnd.gauss(0.0, ruido_m), rnd.gauss(0.0, ruido_m))
+        out.append((lon_c, lat_c, ts))
+        ts += 1
+    return out
+
+
+def como_erictech(pontos: List[Tuple[float, float, int]]) -> Dict[str, Any]:
+    return {"track": {"route": [[ts * 1000, lat, lon] for lon, lat, ts in pontos]}}
+
+
+def como_array_de_dicts(pontos: List[Tuple[float, float, int]]) -> List[Dict[str, Any]]:
+    return [{"lat": lat, "lon": lon, "time": ts} for lon, lat, ts in pontos]
+
+
+def como_geojson(pontos: List[Tuple[float, float, int]]) -> Dict[str, Any]:
+    return {"type": "FeatureCollection", "features": [{
+        "type": "Feature", "properties": {},
+        "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lon, lat, _ in pontos]},
+    }]}
@@ -0,0 +1,205 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+
+import upstream_osrm
+
+OSRM_IMAGEM_DEFAULT = "osrm/osrm-backend:v5.22.0"
+PORTA_NOVA_DEFAULT = 5002
+PROXY_DEFAULT = "http://127.0.0.1:8000"
+PRONTO_TIMEOUT_S = 600.0
+PONTO_SONDA = (-46.6333, -23.5505)
+
+AQUECER_PARALELO = 8
+AQUECER_RODADAS_MAX = 10
+AQUECER_RODADAS_MIN = 2
+AQUECER_TOLERANCIA = 0.10
+AQUECER_TIMEOUT_S = 30.0
+
+# Proxy requests time out after 15 s and workers reread the upstream file
+# every second, so after this long nothing can still be using the old instance.
+DRENAGEM_MIN_S = 20.0
+DRENAGEM_MAX_S = 120.0
+
+
+def parse_args(argv: List[str]) -> Dict[str, Any]:
+    """
+    Blue/green rollover of the OSRM dataset behind the proxy.
+
+    --dataset=<nome>          version tag of the new dataset (required), e.g. sp-2026-11
+    --novo-url=<url>          new instance already running; otherwise it is started with docker:
+    --osrm=<arquivo.osrm>     dataset file as seen inside /data (e.g. sp-2026-11.osrm)
+    --dados=<dir>             host directory mounted at /data
+    --porta=<n>               host port of the new instance (default 5002)
+    --imagem=<img>            OSRM image (default osrm/osrm-backend:v5.22.0)
+    --upstream=<arquivo>      upstream file read by the proxy (default: OSRM_UPSTREAM)
+    --proxy=<url>             proxy that provides the replay and the in-flight counts
+    --admin-token=<t>         token for the proxy /admin endpoints
+    --replay=<arquivo>        extra request paths to replay, one per line
+    --parar-antigo=<nome>     docker container of the old instance, stopped after draining
+    --sem-trocar              start and warm only, without switching the upstream
+    """
+    args: Dict[str, Any] = {
+        "dataset": None,
+        "novo_url": None,
+        "osrm": None,
+        "dados": None,
+        "porta": PORTA_NOVA_DEFAULT,
+        "imagem": OSRM_IMAGEM_DEFAULT,
+        "upstream": upstream_osrm.UPSTREAM_ARQUIVO,
+        "proxy": PROXY_DEFAULT,
+        "admin_token": None,
+        "replay": None,
+        "parar_antigo": None,
+        "trocar": True,
+    }
+    for arg in argv:
+        if arg == "--sem-trocar":
+            args["trocar"] = False
+            continue
+        if not arg.startswith("--") or "=" not in arg:
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+        chave, val = arg[2:].split("=", 1)
+        chave = chave.replace("-", "_")
+        if chave not in args:
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+        args[chave] = int(val) if chave == "porta" else val
+    if not args["dataset"]:
+        raise SystemExit("Informe --dataset=<nome>.")
+    if not args["novo_url"] and not (args["osrm"] and args["dados"]):
+        raise SystemExit("Informe --novo-url= ou --osrm= e --dados= para iniciar a nova instancia.")
+    if args["trocar"] and not args["upstream"]:
+        raise SystemExit("Informe --upstream= (ou OSRM_UPSTREAM) para trocar o upstream do proxy.")
+    return args
+
+
+def _container(dataset: str) -> str:
+    return f"osrm-{dataset}"
+
+
+def iniciar_instancia(args: Dict[str, Any]) -> str:
+    nome_osrm = Path(args["osrm"]).name
+    cmd = [
+        "docker", "run", "-d", "--rm", "--name", _container(args["dataset"]),
+        "-p", f"{args['porta']}:5000", "-v", f"{args['dados']}:/data", args["imagem"],
+        "osrm-routed", "--algorithm", "mld", f"/data/{nome_osrm}",
+    ]
+    print("Iniciando:", " ".join(cmd))
+    subprocess.run(cmd, check=True)
+    return f"http://127.0.0.1:{args['porta']}"
+
+
+def esperar_pronto(url: str, timeout: float = PRONTO_TIMEOUT_S) -> float:
+    t0 = time.monotonic()
+    sonda = f"{url}/nearest/v1/driving/{PONTO_SONDA[0]},{PONTO_SONDA[1]}"
+    while time.monotonic() - t0 < timeout:
+        try:
+            # Any OSRM answer (even NoSegment) means the dataset is loaded.
+            if requests.get(sonda, timeout=5).status_code < 500:
+                return time.monotonic() - t0
+        except requests.RequestException:
+            pass
+        time.sleep(1.0)
+    raise SystemExit(f"{url} nao respondeu em {timeout:.0f} s")
+
+
+def _admin(args: Dict[str, Any], caminho: str) -> Optional[Dict[str, Any]]:
+    headers = {"X-Admin-Token": args["admin_token"]} if args["admin_token"] else {}
+    try:
+        r = requests.get(f"{args['proxy'].rstrip('/')}{caminho}", headers=headers, timeout=5)
+        r.raise_for_status()
+        return r.json()
+    except Exception as e:
+        print(f"Aviso: proxy {args['proxy']}{caminho} indisponivel: {e}")
+        return None
+
+
+def caminhos_replay(args: Dict[str, Any]) -> List[str]:
+    caminhos: List[str] = []
+    resp = _admin(args, "/admin/osrm/replay?n=2000")
+    if resp:
+        caminhos.extend(resp.get("requests") or [])
+    if args["replay"]:
+        with open(args["replay"], "r", encoding="utf-8") as f:
+            caminhos.extend(linha.strip() for linha in f if linha.strip().startswith("/"))
+    return list(dict.fromkeys(caminhos))
+
+
+def _rodada(sessao: requests.Session, url: str, caminhos: List[str]) -> Dict[str, Any]:
+    def um(caminho: str) -> Optional[float]:
+        t0 = time.perf_counter()
+        try:
+            r = sessao.get(url + caminho, timeout=AQUECER_TIMEOUT_S)
+        except requests.RequestException:
+            return None
+        return time.perf_counter() - t0 if r.status_code < 500 else None
+
+    with ThreadPoolExecutor(max_workers=AQUECER_PARALELO) as ex:
+        lat = list(ex.map(um, caminhos))
+    ok = [v for v in lat if v is not None]
+    return {"ok": len(ok), "erros": len(lat) - len(ok), "p50_s": statistics.median(ok) if ok else None}
+
+
+def aquecer(url: str, caminhos: List[str]) -> List[Dict[str, Any]]:
+    """Replay the recent requests until the median latency of a round stops improving."""
+    rodadas: List[Dict[str, Any]] = []
+    if not caminhos:
+        print("Aviso: nenhuma requisicao para replay; a nova instancia nao foi aquecida.")
+        return rodadas
+    sessao = requests.Session()
+    for i in range(AQUECER_RODADAS_MAX):
+        r = _rodada(sessao, url, caminhos)
+        rodadas.append(r)
+        print(f"aquecimento {i + 1}: {r['ok']} ok, {r['erros']} erros, p50 "
+              f"{r['p50_s'] * 1000 if r['p50_s'] is not None else float('nan'):.1f} ms")
+        if len(rodadas) >= AQUECER_RODADAS_MIN and r["p50_s"] is not None and rodadas[-2]["p50_s"]:
+            if abs(r["p50_s"] - rodadas[-2]["p50_s"]) / rodadas[-2]["p50_s"] <= AQUECER_TOLERANCIA:
+                break
+    return rodadas
+
+
+def drenar(args: Dict[str, Any], antigo: Optional[str]) -> float:
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < DRENAGEM_MAX_S:
+        time.sleep(1.0)
+        if time.monotonic() - t0 < DRENAGEM_MIN_S:
+            continue
+        estado = _admin(args, "/admin/osrm") or {}
+        if not antigo or not (estado.get("em_voo") or {}).get(antigo):
+            break
+    return time.monotonic() - t0
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args["upstream"]:
+        upstream_osrm.UPSTREAM_ARQUIVO = args["upstream"]
+    antigo = upstream_osrm.upstream_ativo("") or None
+    novo = args["novo_url"].rstrip("/") if args["novo_url"] else iniciar_instancia(args)
+    relatorio: Dict[str, Any] = {"dataset": args["dataset"], "novo": novo, "antigo": antigo}
+
+    relatorio["pronto_s"] = esperar_pronto(novo)
+    print(f"{novo} pronto em {relatorio['pronto_s']:.1f} s")
+    caminhos = caminhos_replay(args)
+    relatorio["replay"] = len(caminhos)
+    relatorio["aquecimento"] = aquecer(novo, caminhos)
+
+    if args["trocar"]:
+        upstream_osrm.publicar(novo, args["dataset"], args["upstream"])
+        print(f"Upstream do proxy: {antigo or '-'} -> {novo} (dataset {args['dataset']})")
+        relatorio["drenagem_s"] = drenar(args, antigo)
+        if args["parar_antigo"]:
+            subprocess.run(["docker", "stop", args["parar_antigo"]], check=False)
+            relatorio["parado"] = args["parar_antigo"]
+    print(json.dumps(relatorio, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Active OSRM upstream, shared by every proxy worker and processor through a
+# small JSON file that the rollover tool replaces atomically:
+# {"ativo": {"url": "http://127.0.0.1:5002", "dataset": "sp-2026-11", "desde": ...},
+#  "historico": [{"url": ..., "dataset": ..., "desde": ...}, ...]}
+UPSTREAM_ARQUIVO = os.getenv("OSRM_UPSTREAM", "")
+UPSTREAM_RELEITURA_S = 1.0
+UPSTREAM_HISTORICO = 10
+
+_lock = threading.Lock()
+_estado: Dict[str, Any] = {"path": None, "mtime": None, "checado": 0.0, "dados": {}}
+
+
+def _dados(path: Optional[str] = None) -> Dict[str, Any]:
+    path = path or UPSTREAM_ARQUIVO
+    if not path:
+        return {}
+    agora = time.monotonic()
+    if _estado["path"] == path and agora - _estado["checado"] < UPSTREAM_RELEITURA_S:
+        return _estado["dados"]
+    with _lock:
+        _estado["checado"] = agora
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            _estado.update(path=path, mtime=None, dados={})
+            return {}
+        if _estado["path"] != path or _estado["mtime"] != mtime:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    dados = json.load(f)
+                _estado.update(path=path, mtime=mtime, dados=dados if isinstance(dados, dict) else {})
+            except Exception as e:
+                print(f"Falha ao ler upstream OSRM de {path}: {e}")
+        return _estado["dados"]
+
+
+def upstream_ativo(padrao: str) -> str:
+    ativo = _dados().get("ativo") or {}
+    return ativo.get("url") or padrao
+
+
+def dataset_de(host: str) -> str:
+    """Dataset tag for cache entries produced by ``host`` (the host itself when unknown)."""
+    dados = _dados()
+    alvo = host.rstrip("/")
+    for item in [dados.get("ativo") or {}] + list(dados.get("historico") or []):
+        if item.get("url", "").rstrip("/") == alvo and item.get("dataset"):
+            return str(item["dataset"])
+    return host
+
+
+def publicar(url: str, dataset: str, path: Optional[str] = None) -> Dict[str, Any]:
+    """Make ``url`` the active upstream; the previous one moves to the history."""
+    path = path or UPSTREAM_ARQUIVO
+    if not path:
+        raise RuntimeError("Arquivo de upstream nao configurado (OSRM_UPSTREAM ou --upstream=).")
+    atual: Dict[str, Any] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            atual = json.load(f)
+    except Exception:
+        pass
+    historico = list(atual.get("historico") or [])
+    if atual.get("ativo"):
+        historico.insert(0, atual["ativo"])
+    novo = {
+        "ativo": {"url": url.rstrip("/"), "dataset": dataset, "desde": time.time()},
+        "historico": historico[:UPSTREAM_HISTORICO],
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(novo, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    with _lock:
+        _estado["checado"] = 0.0
+    return novo
@@ -1,13 +1,23 @@
 import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Any, Tuple, Optional
 import sys
 
-import tkinter as tk
-from tkinter import filedialog, messagebox
-
 import requests
 
+import processador_rotas_unificado as pru
+from cache_rotas import cache_get, cache_set, chave_celula
+from cliente_backend import http_get_json, http_post_json
+from custo_trilhas import ordenar_ljf
+from entrada_pontos import normalizar
+from instrumentacao import medir_trilha
+from metricas_qualidade import GradeSegmentos, comprimento_m, metricas_trilha
+from saida_rotas import escrever
+
 VALHALLA_BASE = "http://localhost:8002"
 VALHALLA_ROUTE = VALHALLA_BASE.rstrip("/") + "/route"
 MAX_VIAS = 10 
@@ -26,46 +36,110 @@ LOCATE_MAX_DIST_M = 25
 
 LOCATE_TIMEOUT = 8
 
-def is_point_on_valid_road(lat: float, lon: float) -> bool:
+LOCATE_SEARCH_FILTER = {
+    "min_road_class": "residential",
+    "max_road_class": "motorway"
+}
+
+LOCATE_CACHE_ENABLE = True
+LOCATE_CACHE_CELL_DEG = 0.00005
+LOCATE_CACHE_TTL_S = 7 * 24 * 3600.0
+VALHALLA_DATASET_VERSION = os.getenv("VALHALLA_DATASET_VERSION", "")
+# After a failed /status the version is looked up again at most this often;
+# until then /locate answers are not cached.
+VALHALLA_STATUS_RETRY_S = 60.0
+
+# OSRM-vs-Valhalla comparison (--comparar)
+COMPARA_PARALELO = 8
+COMPARA_MATCH_MAX_PONTOS = 100  # osrm-routed --max-matching-size default
+DIFF_PASSO_M = 10.0
+DIFF_DIVERGENTE_M = 50.0
+
+_dataset_version: Optional[str] = None
+_dataset_version_falha = 0.0
+
+def valhalla_dataset_version() -> Optional[str]:
+    """Tileset version tag for the /locate cache, or None while it cannot be determined."""
+    global _dataset_version, _dataset_version_falha
+    if _dataset_version is not None:
+        return _dataset_version
+    if VALHALLA_DATASET_VERSION:
+        _dataset_version = VALHALLA_DATASET_VERSION
+        return _dataset_version
+    if time.monotonic() - _dataset_version_falha < VALHALLA_STATUS_RETRY_S:
+        return None
+    try:
+        st = http_get_json(VALHALLA_BASE.rstrip("/") + "/status", timeout=LOCATE_TIMEOUT, engine="valhalla")
+        version = str(st.get("tileset_last_modified") or st.get("version") or "")
+    except Exception:
+        version = ""
+    if not version:
+        _dataset_version_falha = time.monotonic()
+        return None
+    _dataset_version = version
+    return _dataset_version
+
+def _locate_best_edge(lat: float, lon: float) -> Tuple[bool, Optional[Dict[str, Any]]]:
     url = VALHALLA_BASE.rstrip("/") + "/locate"
     payload = {
         "locations": [{
             "lat": lat,
             "lon": lon,
             "radius": LOCATE_MAX_DIST_M,
-            "search_filter": {
-                "min_road_class": "residential",
-                "max_road_class": "motorway"
-            }
+            "search_filter": LOCATE_SEARCH_FILTER
         }]
     }
     try:
-        r = requests.post(url, json=payload, timeout=LOCATE_TIMEOUT)
-        if r.status_code != 200:
-            return False
-        data = r.json()
+        data = http_post_json(url, payload, timeout=LOCATE_TIMEOUT, engine="valhalla")
         locs = data.get("locations") or []
         if not locs:
-            return False
+            return True, None
         corr = (locs[0].get("correlation") or {})
         edges = corr.get("edges") or []
         if not edges:
-            return False
+            return True, None
         best = min(
             edges, key=lambda e: float(e.get("distance", 1e9))
         )
-        dist = float(best.get("distance", 1e9))
-        if dist > LOCATE_MAX_DIST_M:
-            return False
-        road_class = str(best.get("road_class", ""))
-        use = str(best.get("use", ""))
-        if road_class not in ALLOWED_ROAD_CLASSES:
-            return False
-        if use in DISALLOWED_USE:
-            return False
-        return True
+        return True, {
+            "distance": float(best.get("distance", 1e9)),
+            "road_class": str(best.get("road_class", "")),
+            "use": str(best.get("use", "")),
+        }
     except Exception:
+        return False, None
+
+def locate_nearest_edge(lat: float, lon: float) -> Optional[Dict[str, Any]]:
+    if not LOCATE_CACHE_ENABLE:
+        return _locate_best_edge(lat, lon)[1]
+    dataset = valhalla_dataset_version()
+    if dataset is None:
+        return _locate_best_edge(lat, lon)[1]
+    filtro = "r{}_{}_{}".format(
+        LOCATE_MAX_DIST_M,
+        LOCATE_SEARCH_FILTER["min_road_class"],
+        LOCATE_SEARCH_FILTER["max_road_class"],
+    )
+    key = f"{filtro}_{chave_celula(lat, lon, LOCATE_CACHE_CELL_DEG)}"
+    cached = cache_get("valhalla_locate", key, dataset, LOCATE_CACHE_TTL_S)
+    if cached is not None:
+        return cached["value"]
+    ok, edge = _locate_best_edge(lat, lon)
+    if ok:
+        cache_set("valhalla_locate", key, dataset, edge)
+    return edge
+
+def is_point_on_valid_road(lat: float, lon: float) -> bool:
+    best = locate_nearest_edge(lat, lon)
+    if not best:
+        return False
+    if best["distance"] > LOCATE_MAX_DIST_M:
+        return False
+    if best["road_class"] not in ALLOWED_ROAD_CLASSES:
+        return False
+    if best["use"] in DISALLOWED_USE:
         return False
+    return True
 
 def decode_polyline6(polyline: str) -> List[Tuple[float, float]]:
     index, lat, lon = 0, 0, 0
@@ -91,99 +165,13 @@ def decode_polyline6(polyline: str) -> List[Tuple[float, float]]:
         coordinates.append((lat / 1e6, lon / 1e6))
     return coordinates
 
-def _from_array_of_dicts(data: Any) -> Optional[List[Dict[str, Any]]]:
-    if isinstance(data, list) and data and all(isinstance(x, dict) for x in data):
-        out: List[Dict[str, Any]] = []
-        for p in data:
-            if "lat" in p and "lon" in p:
-                item = {"lat": float(p["lat"]), "lon": float(p["lon"])}
-                if "time" in p:
-                    item["time"] = int(p["time"])
-                out.append(item)
-            else:
-                return None
-        return out
-    return None
-
-def _from_erictech_schema(data: Any) -> Optional[List[Dict[str, Any]]]:
-    try:
-        route = data["track"]["route"]
-        if not isinstance(route, list) or not route:
-            return None
-        out: List[Dict[str, Any]] = []
-        for row in route:
-            if not isinstance(row, list) or len(row) < 3:
-                return None
-            ts_ms, lat, lon = row[0], row[1], row[2]
-            item = {"lat": float(lat), "lon": float(lon)}
-            try:
-                item["time"] = int(round(float(ts_ms) / 1000.0))
-            except Exception:
-                pass
-            out.append(item)
-        return out
-    except Exception:
-        return None
-
-def _from_array_of_arrays(data: Any) -> Optional[List[Dict[str, Any]]]:
-    if isinstance(data, list) and data and all(isinstance(x, (list, tuple)) for x in data):
-        out: List[Dict[str, Any]] = []
-        for row in data:
-            if len(row) >= 3 and isinstance(row[1], (int, float)) and isinstance(row[2], (int, float)):
-                ts, lat, lon = row[0], row[1], row[2]
-                item = {"lat": float(lat), "lon": float(lon)}
-                try:
-                    item["time"] = int(round(float(ts)))
-                except Exception:
-                    pass
-            elif len(row) >= 2 and isinstance(row[0], (int, float)) and isinstance(row[1], (int, float)):
-                item = {"lat": float(row[0]), "lon": float(row[1])}
-            else:
-                return None
-            out.append(item)
-        return out
-    return None
-
-def _from_geojson_featurecollection(data: Any) -> Optional[List[Dict[str, Any]]]:
-    try:
-        if isinstance(data, dict) and data.get("type") == "FeatureCollection":
-            features = data.get("features")
-            if not isinstance(features, list):
-                return None
-            coords: List[Tuple[float, float]] = []
-            for feat in features:
-                geom = (feat or {}).get("geometry") or {}
-                gtype = geom.get("type")
-                gcoords = geom.get("coordinates")
-                if gtype == "LineString" and isinstance(gcoords, list):
-                    coords = gcoords
-                    break
-            if not coords:
-                for feat in features:
-                    geom = (feat or {}).get("geometry") or {}
-                    if geom.get("type") == "MultiLineString":
-                        for line in geom.get("coordinates", []):
-                            if isinstance(line, list):
-                                coords.extend(line)
-                        if coords:
-                            break
-            if coords:
-                out: List[Dict[str, Any]] = []
-                for c in coords:
-                    if isinstance(c, (list, tuple)) and len(c) >= 2:
-                        lon, lat = c[0], c[1]
-                        out.append({"lat": float(lat), "lon": float(lon)})
-                return out if out else None
-    except Exception:
-        return None
-    return None
-
 def normalize_points(data: Any) -> List[Dict[str, Any]]:
-    for loader in (_from_array_of_dicts, _from_erictech_schema, _from_array_of_arrays, _from_geojson_featurecollection):
-        res = loader(data)
-        if res:
-            return res
-    raise ValueError("Formato não reconhecido para Valhalla.")
+    pontos, com_tempo = normalizar(data)
+    if not pontos:
+        raise ValueError("Formato não reconhecido para Valhalla.")
+    if com_tempo:
+        return [{"lat": lat, "lon": lon, "time": ts} for lon, lat, ts in pontos]
+    return [{"lat": lat, "lon": lon} for lon, lat, _ in pontos]
 
 def _sample_vias(points: List[Dict[str, Any]], max_vias: int) -> List[Dict[str, Any]]:
     n = len(points)
@@ -209,6 +197,52 @@ def _interp_timestamps_ms(points_in: List[Dict[str, Any]], count_out: int) -> Li
     span = max(0, t1_ms - t0_ms)
     return [t0_ms + (span * i) // (count_out - 1) for i in range(count_out)]
 
+def payload_rota(points_in: List[Dict[str, Any]]) -> Dict[str, Any]:
+    start = points_in[0]
+    end = points_in[-1]
+    vias_raw = _sample_vias(points_in, MAX_VIAS)
+    vias: List[Dict[str, Any]] = []
+    for v in vias_raw:
+        if is_point_on_valid_road(v["lat"], v["lon"]):
+            vias.append(v)
+    def _loc(p: Dict[str, Any], loc_type: str) -> Dict[str, Any]:
+        return {
+            "lon": p["lon"],
+            "lat": p["lat"],
+            "type": loc_type,
+            "radius": LOCATE_MAX_DIST_M,
+            "search_filter": LOCATE_SEARCH_FILTER
+        }
+    locations = [_loc(start, "break")] + [
+        _loc(v, "through") for v in vias
+    ] + [_loc(end, "break")]
+
+    return {
+        "locations": locations,
+        "costing": "auto",
+        "directions_options": {"units": "kilometers"},
+        "alternates": 0,
+        "filters": {"attributes": ["shape"]}
+    }
+
+def coords_rota(data: Dict[str, Any]) -> List[Tuple[float, float]]:
+    trip = data.get("trip", {})
+    poly_segments: List[str] = []
+    if "legs" in trip:
+        for leg in trip.get("legs", []):
+            if "shape" in leg and leg["shape"]:
+                poly_segments.append(leg["shape"])
+    if not poly_segments and "shape" in trip and trip["shape"]:
+        poly_segments.append(trip["shape"])
+
+    coords_latlon: List[Tuple[float, float]] = []
+    for i, seg in enumerate(poly_segments):
+        dec = decode_polyline6(seg)
+        if i > 0 and coords_latlon and dec and coords_latlon[-1] == dec[0]:
+            dec = dec[1:]
+        coords_latlon.extend(dec)
+    return coords_latlon
+
 def run():
     headless = len(sys.argv) >= 2
     if headless:
@@ -217,6 +251,8 @@ def run():
             print(f"Erro: arquivo não encontrado: {src}")
             return
     else:
+        import tkinter as tk
+        from tkinter import filedialog, messagebox
         root = tk.Tk()
         root.withdraw()
         root.update()
@@ -247,35 +283,8 @@ def run():
             messagebox.showerror("Poucos pontos", "É necessário ao menos ponto inicial e final.")
         return
 
-    start = points_in[0]
-    end = points_in[-1]
-    vias_raw = _sample_vias(points_in, MAX_VIAS)
-    vias: List[Dict[str, Any]] = []
-    for v in vias_raw:
-        if is_point_on_valid_road(v["lat"], v["lon"]):
-            vias.append(v)
-    def _loc(p: Dict[str, Any], loc_type: str) -> Dict[str, Any]:
-        return {
-            "lon": p["lon"],
-            "lat": p["lat"],
-            "type": loc_type,
-            "radius": LOCATE_MAX_DIST_M,
-            "search_filter": {
-                "min_road_class": "residential",
-                "max_road_class": "motorway"
-            }
-        }
-    locations = [_loc(start, "break")] + [
-        _loc(v, "through") for v in vias
-    ] + [_loc(end, "break")]
-
-    payload = {
-        "locations": locations,
-        "costing": "auto",
-        "directions_options": {"units": "kilometers"},
-        "alternates": 0,
-        "filters": {"attributes": ["shape"]}
-    }
+    payload = payload_rota(points_in)
+    locations = payload["locations"]
 
     try:
         resp = requests.post(VALHALLA_ROUTE, json=payload, timeout=90)
@@ -295,25 +304,11 @@ def run():
         (print if headless else messagebox.showerror)("Erro", "Resposta do Valhalla /route não é JSON válido.")
         return
 
-    trip = data.get("trip", {})
-    poly_segments: List[str] = []
-    if "legs" in trip:
-        for leg in trip.get("legs", []):
-            if "shape" in leg and leg["shape"]:
-                poly_segments.append(leg["shape"])
-    if not poly_segments and "shape" in trip and trip["shape"]:
-        poly_segments.append(trip["shape"])
-    if not poly_segments:
+    coords_latlon = coords_rota(data)
+    if not coords_latlon:
         (print if headless else messagebox.showerror)("Sem geometria", "Não encontrei 'shape' no retorno do /route.")
         return
 
-    coords_latlon: List[Tuple[float, float]] = []
-    for i, seg in enumerate(poly_segments):
-        dec = decode_polyline6(seg)
-        if i > 0 and coords_latlon and dec and coords_latlon[-1] == dec[0]:
-            dec = dec[1:]
-        coords_latlon.extend(dec)
-
     ts_ms_list = _interp_timestamps_ms(points_in, len(coords_latlon))
     osrm_route_rows = [[int(ts_ms), float(lat), float(lon)] for (lat, lon), ts_ms in zip(coords_latlon, ts_ms_list)]
     osrm_compat_obj = {"track": {"route": osrm_route_rows}}
@@ -333,10 +328,8 @@ def run():
     geojson_path = outdir / f"{base}_route.geojson"
 
     try:
-        with open(osrm_compat_path, "w", encoding="utf-8") as f:
-            json.dump(osrm_compat_obj, f, ensure_ascii=False, indent=2)
-        with open(geojson_path, "w", encoding="utf-8") as f:
-            json.dump(geojson_obj, f, ensure_ascii=False, indent=2)
+        escrever(osrm_compat_obj, osrm_compat_path, "json")
+        escrever(geojson_obj, geojson_path, "json")
     except Exception as e:
         (print if headless else messagebox.showerror)("Erro ao salvar", f"Falha ao salvar saídas:\n{e}")
         return
@@ -345,5 +338,251 @@ def run():
     print(f" - {osrm_compat_path}")
     print(f" - {geojson_path}")
 
+def _percentil(valores: List[float], p: float) -> Optional[float]:
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100.0 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+def _densificar(coords: List[List[float]], passo_m: float) -> List[List[float]]:
+    out = coords[:1]
+    for a, b in zip(coords, coords[1:]):
+        n = int(pru.distancia_m(a[0], a[1], b[0], b[1]) // passo_m)
+        for k in range(1, n):
+            t = k / float(n)
+            out.append([a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1])])
+        out.append(b)
+    return out
+
+def diferenca_geometrias(a: List[List[float]], b: List[List[float]]) -> Dict[str, Any]:
+    """
+    Hausdorff distance, mean deviation (both directions, sampled every
+    DIFF_PASSO_M along each line) and length ratio b/a, in metres.
+    """
+    if len(a) < 2 or len(b) < 2:
+        return {}
+    grade_a, grade_b = GradeSegmentos(a), GradeSegmentos(b)
+    ab = [grade_b.distancia(c[0], c[1]) for c in _densificar(a, DIFF_PASSO_M)]
+    ba = [grade_a.distancia(c[0], c[1]) for c in _densificar(b, DIFF_PASSO_M)]
+    comp_a = comprimento_m(a)
+    return {
+        "hausdorff_m": round(max(max(ab), max(ba)), 2),
+        "desvio_medio_m": round((sum(ab) + sum(ba)) / (len(ab) + len(ba)), 2),
+        "razao_comprimento": round(comprimento_m(b) / comp_a, 4) if comp_a > 0 else None,
+    }
+
+def _osrm_match(pts: List[Tuple[float, float, int]], host: str) -> List[List[float]]:
+    caminho: List[List[float]] = []
+    passo = COMPARA_MATCH_MAX_PONTOS - 1
+    for i in range(0, max(1, len(pts) - 1), passo):
+        pedaco = pts[i:i + COMPARA_MATCH_MAX_PONTOS]
+        if len(pedaco) < 2:
+            break
+        url = pru.montar_url_match(pedaco, host, "full", "ignore")
+        pru._anexar_coords(caminho, pru._coords_matchings(http_get_json(url, timeout=60, engine="osrm")))
+    return caminho
+
+def _valhalla(pts: List[Tuple[float, float, int]], host: str, modo: str) -> List[List[float]]:
+    if modo == "trace_route":
+        data = http_post_json(f"{host.rstrip('/')}/trace_route", pru._payload_trace_route(pts),
+                              timeout=90, engine="valhalla")
+        return pru._coords_trace_route(data)
+    pontos = [{"lat": lat, "lon": lon, "time": ts} for lon, lat, ts in pts]
+    data = http_post_json(f"{host.rstrip('/')}/route", payload_rota(pontos), timeout=90, engine="valhalla")
+    return [[lon, lat] for lat, lon in coords_rota(data)]
+
+def _rodar_engine(engine: str, pts: List[Tuple[float, float, int]],
+                  args: Dict[str, Any]) -> Tuple[Dict[str, Any], List[List[float]]]:
+    with medir_trilha(True) as med:
+        t0 = time.perf_counter()
+        erro = None
+        try:
+            if engine == "osrm":
+                coords = _osrm_match(pts, args["osrm"])
+            else:
+                coords = _valhalla(pts, args["valhalla"], args["modo_valhalla"])
+        except Exception as e:
+            coords, erro = [], str(e)
+        dt = time.perf_counter() - t0
+        http = med.resumo()["http"]
+    res: Dict[str, Any] = {
+        "ok": bool(coords) and erro is None,
+        "latencia_s": round(dt, 4),
+        "chamadas": sum(int(h["chamadas"]) for h in http.values()),
+        "bytes": sum(int(h["bytes_recebidos"]) for h in http.values()),
+        "vertices": len(coords),
+    }
+    if erro:
+        res["erro"] = erro
+    if coords:
+        m = metricas_trilha(coords, pts, pru.MAX_DT_GAP, pru.MIN_DIST_GAP, pru.MAX_VEL_GAP)
+        res.update(comprimento_m=m["total_route_length_m"], matched_ratio=m.get("matched_ratio"),
+                   desvio_bruto_medio_m=m.get("mean_distance_raw_to_matched_m"))
+    return res, coords
+
+def comparar_trilha(path: Path, args: Dict[str, Any], pool: ThreadPoolExecutor) -> Dict[str, Any]:
+    linha: Dict[str, Any] = {"arquivo": str(path)}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            pontos, _ = normalizar(json.load(f))
+    except Exception as e:
+        return dict(linha, erro=f"leitura: {e}")
+    pts = pru.dedupe_por_raio(pru.ordenar_por_ts(pontos), pru.DEDUP_EPS_M)
+    if len(pts) < 2:
+        return dict(linha, erro="poucos pontos")
+    cerca = args["cerca"]
+    linha["pontos"] = len(pts)
+    linha["fracao_na_cerca"] = round(
+        sum(1 for p in pts if pru.point_in_poly(p[0], p[1], cerca)) / len(pts), 4) if cerca else 0.0
+    futuros = {eng: pool.submit(_rodar_engine, eng, pts, args) for eng in ("osrm", "valhalla")}
+    geoms = {}
+    for eng, fut in futuros.items():
+        linha[eng], geoms[eng] = fut.result()
+    if geoms["osrm"] and geoms["valhalla"]:
+        linha["diff"] = diferenca_geometrias(geoms["osrm"], geoms["valhalla"])
+    return linha
+
+def _resumo_grupo(linhas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"trilhas": len(linhas)}
+    for eng in ("osrm", "valhalla"):
+        res = [l[eng] for l in linhas if eng in l]
+        ok = [r for r in res if r["ok"]]
+        lat = [r["latencia_s"] for r in ok]
+        ratios = [r["matched_ratio"] for r in ok if r.get("matched_ratio") is not None]
+        desvios = [r["desvio_bruto_medio_m"] for r in ok if r.get("desvio_bruto_medio_m") is not None]
+        out[eng] = {
+            "ok": len(ok),
+            "falhas": len(res) - len(ok),
+            "latencia_p50_s": _percentil(lat, 50),
+            "latencia_p95_s": _percentil(lat, 95),
+            "bytes_medio": round(statistics.mean([r["bytes"] for r in ok])) if ok else None,
+            "matched_ratio_medio": round(statistics.mean(ratios), 4) if ratios else None,
+            "desvio_bruto_medio_m": round(statistics.mean(desvios), 2) if desvios else None,
+        }
+    diffs = [l["diff"] for l in linhas if l.get("diff")]
+    haus = [d["hausdorff_m"] for d in diffs]
+    razoes = [d["razao_comprimento"] for d in diffs if d.get("razao_comprimento") is not None]
+    out["diff"] = {
+        "comparadas": len(diffs),
+        "hausdorff_p50_m": _percentil(haus, 50),
+        "hausdorff_p95_m": _percentil(haus, 95),
+        "hausdorff_max_m": max(haus) if haus else None,
+        "desvio_medio_p50_m": _percentil([d["desvio_medio_m"] for d in diffs], 50),
+        "razao_comprimento_p5": _percentil(razoes, 5),
+        "razao_comprimento_p50": _percentil(razoes, 50),
+        "razao_comprimento_p95": _percentil(razoes, 95),
+        f"divergentes_{int(DIFF_DIVERGENTE_M)}m": sum(1 for h in haus if h > DIFF_DIVERGENTE_M),
+    }
+    return out
+
+def _arquivos_corpus(entradas: List[str]) -> List[Path]:
+    arquivos: List[Path] = []
+    for e in entradas:
+        p = Path(e).expanduser()
+        if p.is_dir():
+            arquivos.extend(sorted(x for x in p.rglob("*") if x.suffix.lower() in (".json", ".geojson")))
+        elif p.exists():
+            arquivos.append(p)
+        else:
+            print(f"Aviso: {p} nao encontrado.")
+    return arquivos
+
+def parse_args_comparacao(argv: List[str]) -> Dict[str, Any]:
+    """
+    Batch OSRM /match vs Valhalla comparison over a corpus of tracks.
+
+    --comparar <arquivos ou pastas>   tracks (.json/.geojson, folders are searched recursively)
+    --osrm=<url>                      OSRM host (default: the processors' default)
+    --valhalla=<url>                  Valhalla host (default http://localhost:8002)
+    --modo-valhalla=<m>               trace_route (default) or route (start/end + sampled vias)
+    --paralelo=<n>                    concurrent engine calls (default 8)
+    --fence=<lon,lat;...>             fence polygon for the in/out breakdown (default: the processors' fence)
+    --saida=<arquivo>                 JSON report (default comparacao_osrm_valhalla.json)
+    """
+    args: Dict[str, Any] = {
+        "entradas": [],
+        "osrm": pru.OSRM_HOST_DEFAULT,
+        "valhalla": VALHALLA_BASE,
+        "modo_valhalla": "trace_route",
+        "paralelo": COMPARA_PARALELO,
+        "cerca": pru.FENCE_POLYGON_DEFAULT,
+        "saida": "comparacao_osrm_valhalla.json",
+    }
+    for arg in argv:
+        if arg == "--comparar":
+            continue
+        if not arg.startswith("--"):
+            args["entradas"].append(arg)
+            continue
+        chave, _, val = arg[2:].partition("=")
+        if chave == "osrm":
+            args["osrm"] = val.rstrip("/")
+        elif chave == "valhalla":
+            args["valhalla"] = val.rstrip("/")
+        elif chave == "modo-valhalla" and val in ("trace_route", "route"):
+            args["modo_valhalla"] = val
+        elif chave == "paralelo":
+            args["paralelo"] = max(1, int(val))
+        elif chave == "fence":
+            args["cerca"] = pru._parse_fence_poly(val)
+        elif chave == "saida":
+            args["saida"] = val
+        else:
+            raise SystemExit(f"Parametro desconhecido: {arg}")
+    return args
+
+def comparar(argv: List[str]) -> Dict[str, Any]:
+    args = parse_args_comparacao(argv)
+    # Biggest files first (size ~ points): a large track started last would
+    # leave the other workers idle while it finishes.
+    arquivos = ordenar_ljf(_arquivos_corpus(args["entradas"]), lambda p: p.stat().st_size)
+    if not arquivos:
+        raise SystemExit("Uso: python valhalla.py --comparar <arquivos ou pastas> [--osrm=] [--valhalla=] ...")
+
+    t0 = time.perf_counter()
+    # Tracks are read by one small pool and their engine calls run on the
+    # other, so both engines are busy while the next tracks are parsed.
+    with ThreadPoolExecutor(max_workers=args["paralelo"]) as pool_engines, \
+            ThreadPoolExecutor(max_workers=max(1, args["paralelo"] // 2)) as pool_trilhas:
+        linhas = list(pool_trilhas.map(lambda p: comparar_trilha(p, args, pool_engines), arquivos))
+    validas = [l for l in linhas if "erro" not in l]
+    relatorio = {
+        "osrm": args["osrm"],
+        "valhalla": args["valhalla"],
+        "modo_valhalla": args["modo_valhalla"],
+        "duracao_s": round(time.perf_counter() - t0, 2),
+        "resumo": {
+            "todas": _resumo_grupo(validas),
+            "na_cerca": _resumo_grupo([l for l in validas if l["fracao_na_cerca"] > 0]),
+            "fora_da_cerca": _resumo_grupo([l for l in validas if l["fracao_na_cerca"] == 0]),
+        },
+        "trilhas": linhas,
+    }
+    escrever(relatorio, Path(args["saida"]), "pretty")
+
+    def fmt(v: Any, escala: float = 1.0, casas: int = 1) -> str:
+        return "-" if v is None else f"{v * escala:.{casas}f}"
+    print(f"{len(validas)}/{len(linhas)} trilhas comparadas em {relatorio['duracao_s']} s")
+    for grupo, res in relatorio["resumo"].items():
+        if not res["trilhas"]:
+            continue
+        print(f"\n[{grupo}] {res['trilhas']} trilhas")
+        for eng in ("osrm", "valhalla"):
+            e = res[eng]
+            print(f"  {eng:<9} ok {e['ok']:<5} falhas {e['falhas']:<4} p50 {fmt(e['latencia_p50_s'], 1000)} ms  "
+                  f"p95 {fmt(e['latencia_p95_s'], 1000)} ms  bytes {e['bytes_medio'] or '-'}  "
+                  f"matched_ratio {fmt(e['matched_ratio_medio'], 1, 3)}  desvio bruto {fmt(e['desvio_bruto_medio_m'])} m")
+        d = res["diff"]
+        print(f"  diff      hausdorff p50 {fmt(d['hausdorff_p50_m'])} m  p95 {fmt(d['hausdorff_p95_m'])} m  "
+              f"desvio medio p50 {fmt(d['desvio_medio_p50_m'])} m  comprimento v/o p50 "
+              f"{fmt(d['razao_comprimento_p50'], 1, 3)}  >{int(DIFF_DIVERGENTE_M)} m: "
+              f"{d[f'divergentes_{int(DIFF_DIVERGENTE_M)}m']}")
+    print(f"\nRelatorio salvo em: {args['saida']}")
+    return relatorio
+
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    if "--comparar" in sys.argv[1:]:
+        comparar(sys.argv[1:])
+    else:
+        run()
\ No newline at end of file